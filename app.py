@@ -9,85 +9,5516 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import sqlite3
+import io
+import itertools
+import math
 import json
-from datetime import datetime, timedelta
-import plotly.express as px
-import plotly.graph_objects as go
+import hashlib
+import fnmatch
+import tempfile
+import sys
+import uuid
+import cProfile
+import logging
+import asyncio
+from datetime import date, datetime, timedelta
 import re
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field, replace
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Any, Iterator, Tuple
 import os
+import shutil
+import atexit
+
+if TYPE_CHECKING:
+    # Plotly is imported on first chart render; it is a large share of import time
+    import plotly.graph_objects as go
+
+logger = logging.getLogger("bi_chatbot")
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over whole-word phrases.
+
+    Every phrase is found in one left-to-right pass over the text, so
+    adding phrases grows the build step but not the cost of a lookup.
+    """
+
+    def __init__(self, phrases: List[str]):
+        self.phrases = list(dict.fromkeys(phrases))
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for phrase_id, phrase in enumerate(self.phrases):
+            state = 0
+            for char in phrase:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(phrase_id)
+
+        # Breadth-first pass to wire failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """Return (start, end, phrase) for every whole-word occurrence in text"""
+        matches = []
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for phrase_id in output[state]:
+                phrase = self.phrases[phrase_id]
+                start, end = position - len(phrase) + 1, position + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    matches.append((start, end, phrase))
+        return matches
+
+    def find_longest(self, text: str) -> List[Tuple[int, int, str]]:
+        """Non-overlapping matches, preferring the longest phrase ("how many customers" over "customers")"""
+        chosen, taken = [], set()
+        for start, end, phrase in sorted(self.find(text), key=lambda m: (m[0] - m[1], m[0])):
+            span = range(start, end)
+            if not taken.intersection(span):
+                taken.update(span)
+                chosen.append((start, end, phrase))
+        return sorted(chosen)
+
+@dataclass
+class Intent:
+    """A question shape: trigger phrases plus the slots it fills in by default.
+
+    Intents without ``sql`` are rendered by the aggregate template builder;
+    intents with ``sql`` format it with the extracted slots.
+    """
+
+    name: str
+    keywords: List[str]
+    priority: int = 0
+    defaults: Dict[str, Any] = field(default_factory=dict)
+    required_slots: List[str] = field(default_factory=list)
+    sql: Optional[str] = None
+
+@dataclass
+class IntentMatch:
+    intent: Optional[str]
+    slots: Dict[str, Any]
+    keywords: List[str]
+
+class IntentEngine:
+    """Compiled natural-language-to-SQL matcher.
+
+    Intent trigger phrases and slot vocabulary (metrics, dimensions) share one
+    keyword automaton; an inverted index maps each phrase to the intents it
+    votes for. Periods and limits are pulled out with precompiled regexes.
+    """
+
+    METRICS = {
+        # name: (SQL expression, default alias, phrases)
+        'revenue': ('SUM(amount)', 'revenue', ['sales', 'revenue', 'sold', 'selling', 'income', 'spend', 'spent', 'turnover']),
+        'quantity': ('SUM(quantity)', 'units_sold', ['units', 'quantity', 'volume', 'items sold', 'units sold']),
+        'orders': ('COUNT(*)', 'order_count', ['orders', 'transactions', 'number of sales', 'how many sales', 'order count']),
+        'average_order_value': ('AVG(amount)', 'average_order_value', ['average order value', 'aov', 'average order', 'avg order value', 'average sale']),
+        'customer_count': ('COUNT(DISTINCT customer_id)', 'customer_count', ['how many customers', 'number of customers', 'customer count', 'unique customers', 'distinct customers']),
+    }
+    # Aliases that depend on the grouping, kept compatible with the original templates
+    METRIC_ALIASES = {
+        ('revenue', None): 'total_sales',
+        ('revenue', 'customer_name'): 'total_spent',
+        ('revenue', 'month'): 'monthly_sales',
+        ('quantity', 'month'): 'monthly_units',
+        ('orders', 'month'): 'monthly_orders',
+    }
+    DIMENSIONS = {
+        'product_name': ['product', 'products', 'item', 'items'],
+        'customer_name': ['customer', 'customers', 'client', 'clients', 'buyers'],
+        'region': ['region', 'regions', 'territory', 'territories'],
+        'sales_rep': ['rep', 'reps', 'sales rep', 'sales reps', 'salesperson', 'salespeople', 'sales people'],
+        'category': ['category', 'categories'],
+        'month': ['monthly', 'by month', 'per month', 'each month', 'month by month', 'over time'],
+    }
+    DEFAULT_INTENTS = [
+        Intent('trend', ['trend', 'trends', 'monthly', 'over time', 'by month', 'per month', 'month by month'],
+               priority=3, defaults={'dimension': 'month', 'metric': 'revenue'}),
+        Intent('ranking', ['top', 'best', 'bottom', 'worst', 'highest', 'lowest', 'most', 'least', 'leading', 'biggest'],
+               priority=2, defaults={'limit': 10, 'dimension': 'product_name', 'metric': 'revenue'}),
+        Intent('breakdown', ['by', 'per', 'each', 'breakdown', 'split', 'across'],
+               priority=1, defaults={'metric': 'revenue'}, required_slots=['dimension']),
+        Intent('count', ['how many', 'number of', 'count'], priority=1, defaults={'metric': 'orders'}),
+        Intent('average', ['average', 'avg', 'mean', 'aov'], priority=1, defaults={'metric': 'average_order_value'}),
+        Intent('total', ['total', 'sum', 'how much', 'sales', 'revenue', 'income', 'turnover'],
+               defaults={'metric': 'revenue'}),
+    ]
+    FALLBACK_SQL = "SELECT * FROM sales LIMIT 10"
+
+    NUMBER_WORDS = {
+        'a': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+        'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'fifteen': 15, 'twenty': 20,
+        'fifty': 50, 'hundred': 100,
+    }
+    _NUMBER = r"(\d+|" + '|'.join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r")"
+    _LIMIT_RE = re.compile(r"\b(top|bottom|best|worst|highest|lowest|first|leading|biggest)\s+" + _NUMBER + r"\b")
+    _ASCENDING_RE = re.compile(r"\b(bottom|worst|lowest|least|smallest)\b")
+    # First day of the current quarter, evaluated by SQLite in UTC like the other periods
+    QUARTER_START = "date('now', 'start of month', '-' || ((strftime('%m', 'now') - 1) % 3) || ' months')"
+    _RELATIVE_PERIOD_RE = re.compile(r"\b(?:last|past|previous|prior)\s+(?:" + _NUMBER + r"\s+)?(day|week|month|quarter|year)s?\b")
+    _ANCHORED_PERIODS = [
+        (re.compile(r"\b(this month|month to date|mtd)\b"), "date('now', 'start of month')"),
+        (re.compile(r"\b(this year|year to date|ytd)\b"), "date('now', 'start of year')"),
+        (re.compile(r"\b(this week|week to date)\b"), "date('now', '-6 days', 'weekday 0')"),
+        (re.compile(r"\btoday\b"), "date('now')"),
+        (re.compile(r"\byesterday\b"), "date('now', '-1 day')"),
+        (re.compile(r"\b(this quarter|quarter to date|qtd)\b"), QUARTER_START),
+    ]
+    _GROUPING_RE = re.compile(r"\b(by|per|each|across)\s+$")
+    _CLEAN_RE = re.compile(r"[^a-z0-9]+")
+
+    def __init__(self, intents: Optional[List[Intent]] = None):
+        self.intents: Dict[str, Intent] = {}
+        self._automaton: Optional[KeywordAutomaton] = None
+        for intent in (self.DEFAULT_INTENTS if intents is None else intents):
+            self.register(intent)
+
+    def register(self, intent: Intent):
+        """Add or replace an intent; the automaton is rebuilt on the next match"""
+        self.intents[intent.name] = intent
+        self._automaton = None
+
+    def compile(self) -> KeywordAutomaton:
+        """Build the keyword automaton and the phrase -> intents / slot indexes"""
+        if self._automaton is not None:
+            return self._automaton
+
+        self._intent_index: Dict[str, List[str]] = {}
+        for intent in self.intents.values():
+            for keyword in intent.keywords:
+                self._intent_index.setdefault(self.normalize(keyword), []).append(intent.name)
+
+        self._slot_index: Dict[str, List[Tuple[str, str]]] = {}
+        for metric, (_, _, phrases) in self.METRICS.items():
+            for phrase in phrases:
+                self._slot_index.setdefault(self.normalize(phrase), []).append(('metric', metric))
+        for dimension, phrases in self.DIMENSIONS.items():
+            for phrase in phrases:
+                self._slot_index.setdefault(self.normalize(phrase), []).append(('dimension', dimension))
+
+        self._automaton = KeywordAutomaton(list(self._intent_index) + list(self._slot_index))
+        return self._automaton
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        return cls._CLEAN_RE.sub(' ', text.lower().replace("'", '')).strip()
+
+    def _number(self, token: Optional[str], default: int = 1) -> int:
+        if token is None:
+            return default
+        return int(token) if token.isdigit() else self.NUMBER_WORDS[token]
+
+    def _period(self, text: str) -> Optional[str]:
+        relative = self._RELATIVE_PERIOD_RE.search(text)
+        if relative:
+            count, unit = self._number(relative.group(1)), relative.group(2)
+            if unit == 'week':
+                count, unit = count * 7, 'day'
+            elif unit == 'quarter':
+                count, unit = count * 3, 'month'
+            return f"date('now', '-{count} {unit}{'s' if count != 1 else ''}')"
+        for pattern, expression in self._ANCHORED_PERIODS:
+            if pattern.search(text):
+                return expression
+        return None
+
+    def extract_slots(self, question: str) -> Dict[str, Any]:
+        """Pull metric, dimension, period, limit and direction out of a question"""
+        text = self.normalize(question)
+        automaton = self.compile()
+        slots: Dict[str, Any] = {'keywords': [], 'dimensions': []}
+        grouped = None
+        for start, _, phrase in automaton.find_longest(text):
+            slots['keywords'].append(phrase)
+            for slot, value in self._slot_index.get(phrase, []):
+                if slot == 'dimension':
+                    slots['dimensions'].append(value)
+                    # "products by region": the phrase after by/per/each is the grouping
+                    if grouped is None and self._GROUPING_RE.search(text[:start]):
+                        grouped = value
+                else:
+                    slots.setdefault(slot, value)
+        if slots['dimensions']:
+            slots['dimension'] = grouped or slots['dimensions'][0]
+
+        period = self._period(text)
+        if period:
+            slots['period'] = period
+        limit = self._LIMIT_RE.search(text)
+        if limit:
+            slots['limit'] = self._number(limit.group(2))
+        if self._ASCENDING_RE.search(text):
+            slots['ascending'] = True
+        return slots
+
+    def match(self, question: str) -> IntentMatch:
+        """Score intents by priority plus distinct trigger phrases and fill defaults"""
+        slots = self.extract_slots(question)
+        keywords = slots.pop('keywords')
+        dimensions = slots.pop('dimensions')
+        # Intent triggers may overlap slot phrases ("monthly"), so look at every hit, not just the longest
+        text = self.normalize(question)
+        votes: Dict[str, set] = {}
+        for _, _, phrase in self._automaton.find(text):
+            for name in self._intent_index.get(phrase, []):
+                votes.setdefault(name, set()).add(phrase)
+
+        best, best_score = None, None
+        for name, phrases in votes.items():
+            intent = self.intents[name]
+            if any(slot not in slots for slot in intent.required_slots):
+                continue
+            score = (intent.priority + len(phrases), len(phrases))
+            if best_score is None or score > best_score:
+                best, best_score = intent, score
+
+        if best is None:
+            return IntentMatch(None, slots, keywords)
+        merged = dict(best.defaults)
+        merged.update(slots)
+        # "count customers by region" counts distinct customers rather than grouping by them
+        if best.name == 'count' and 'customer_name' in dimensions and 'metric' not in slots:
+            merged['metric'] = 'customer_count'
+            others = [dimension for dimension in dimensions if dimension != 'customer_name']
+            if others:
+                merged['dimension'] = others[0]
+            else:
+                merged.pop('dimension', None)
+        return IntentMatch(best.name, merged, keywords)
+
+    def build_sql(self, match: IntentMatch, table_schema: Optional[Dict] = None) -> str:
+        """Render a match through its intent's template"""
+        slots = match.slots
+        if match.intent is None:
+            if 'limit' in slots:
+                return f"SELECT * FROM sales LIMIT {slots['limit']}"
+            return self.FALLBACK_SQL
+
+        intent = self.intents[match.intent]
+        if intent.sql is not None:
+            return intent.sql.format(**slots)
+
+        sales_columns = None
+        if table_schema and 'sales' in table_schema:
+            sales_columns = set(table_schema['sales'])
+        dimension = slots.get('dimension')
+        if dimension not in (None, 'month') and sales_columns is not None and dimension not in sales_columns:
+            dimension = None
+
+        metric = slots.get('metric', 'revenue')
+        expression, default_alias, _ = self.METRICS[metric]
+        alias = self.METRIC_ALIASES.get((metric, dimension), default_alias)
+        where = f" WHERE date >= {slots['period']}" if slots.get('period') else ''
+
+        if dimension is None:
+            return f"SELECT {expression} as {alias} FROM sales{where}"
+        if dimension == 'month':
+            return (f"SELECT strftime('%Y-%m', date) as month, {expression} as {alias} "
+                    f"FROM sales{where} GROUP BY month ORDER BY month")
+        direction = 'ASC' if slots.get('ascending') else 'DESC'
+        sql = f"SELECT {dimension}, {expression} as {alias} FROM sales{where} GROUP BY {dimension} ORDER BY {alias} {direction}"
+        if slots.get('limit'):
+            sql += f" LIMIT {slots['limit']}"
+        return sql
+
+    def grouping_dimension(self, question: str) -> Optional[str]:
+        """The dimension a question groups by ("... by region", "monthly"), if it names one"""
+        text = self.normalize(question)
+        for start, _, phrase in self.compile().find_longest(text):
+            for slot, value in self._slot_index.get(phrase, []):
+                if slot == 'dimension' and (value == 'month' or self._GROUPING_RE.search(text[:start])):
+                    return value
+        return None
+
+    def generate_sql(self, question: str, table_schema: Optional[Dict] = None) -> str:
+        return self.build_sql(self.match(question), table_schema)
+
+@st.cache_resource(show_spinner=False)
+def get_intent_engine() -> IntentEngine:
+    """Compiled default intent engine shared across sessions"""
+    engine = IntentEngine()
+    engine.compile()
+    return engine
+
+def cache_directory(db_path: str) -> str:
+    """On-disk cache directory for a database: <db dir>/.bi_cache/<db name>/"""
+    db_dir, db_file = os.path.split(os.path.abspath(db_path))
+    path = os.path.join(db_dir, '.bi_cache', os.path.splitext(db_file)[0])
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class SemanticQueryCache:
+    """Reuse SQL from previously answered questions that mean the same thing.
+
+    Questions are embedded with a character n-gram TF-IDF model (robust to
+    rephrasing and typos) and compared by cosine similarity. A hit, exact or
+    near, only counts when the intent engine extracts the same intent and
+    slots from both questions as it did when the entry was stored, so "sales
+    last month" never answers "sales this month". For LLM backends (and
+    questions without an intent) the content words must match as well, so
+    "orders by Acme Inc" never answers "orders by Acme Corp". Entries are
+    scoped to a schema fingerprint (and optionally to the backend that
+    produced them), evicted least recently used first and persisted as JSON
+    at most once per ``save_interval`` seconds, plus once at exit.
+    """
+
+    SLOT_KEYS = ('metric', 'dimension', 'period', 'limit', 'ascending')
+    # Words that don't change what an intent-less question asks for
+    STOPWORDS = frozenset([
+        'a', 'an', 'the', 'all', 'me', 'us', 'we', 'our', 'show', 'list', 'give', 'tell', 'find', 'get',
+        'display', 'please', 'what', 'whats', 'which', 'who', 'is', 'are', 'was', 'were', 'do', 'does', 'did',
+        'of', 'in', 'on', 'for', 'by', 'with', 'and',
+    ])
+
+    def __init__(self, index_path: Optional[str], intent_engine: IntentEngine,
+                 threshold: float = 0.8, max_entries: int = 2000, intent_scopes: Tuple[str, ...] = ('', 'mock'),
+                 save_interval: float = 5.0):
+        self.index_path = index_path
+        self.intent_engine = intent_engine
+        # Scopes whose SQL depends only on the intent engine's slots (the built-in engine)
+        self.intent_scopes = intent_scopes
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        # Concurrent saves would otherwise race on the shared temp file
+        self._save_lock = threading.Lock()
+        # Entries changed since the index was last written
+        self._unsaved = False
+        self._last_save = 0.0
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._vectorizer = None
+        self._matrix = None
+        self._matrix_keys: List[str] = []
+        self._dirty = True
+        self._counters = {'lookups': 0, 'exact_hits': 0, 'similar_hits': 0, 'misses': 0,
+                          'rejected_by_slots': 0, 'evictions': 0}
+        self._load()
+        if index_path:
+            atexit.register(self.flush)
+
+    def signature(self, question: str, scope: str = '') -> str:
+        """Intent plus slot values; two questions may share SQL only if these agree.
+
+        An LLM reads more than the slots, so outside the intent scopes (and for
+        questions without an intent) the content words are part of the
+        signature too: names and numbers must match exactly.
+        """
+        match = self.intent_engine.match(question)
+        slots = {key: match.slots.get(key) for key in self.SLOT_KEYS}
+        if match.intent is not None and scope in self.intent_scopes:
+            return json.dumps([match.intent, slots], sort_keys=True)
+        words = sorted(set(IntentEngine.normalize(question).split()) - self.STOPWORDS)
+        return json.dumps([match.intent, slots, words], sort_keys=True)
+
+    def _load(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as handle:
+                entries = json.load(handle)
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable semantic cache %s: %s", self.index_path, exc)
+            return
+        for entry in entries[-self.max_entries:]:
+            self._entries[entry['key']] = entry
+
+    def save(self):
+        """Atomically rewrite the on-disk index"""
+        if not self.index_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                entries = list(self._entries.values())
+                self._unsaved = False
+                self._last_save = time.monotonic()
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w') as handle:
+                json.dump(entries, handle)
+            os.replace(temp_path, self.index_path)
+
+    def flush(self):
+        """Write the index if entries changed since the last save"""
+        if self._unsaved:
+            self.save()
+
+    def _refit(self):
+        """Refit the vectorizer on the current questions (only after the entry set changed)"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self._matrix_keys = list(self._entries)
+        if not self._matrix_keys:
+            self._vectorizer, self._matrix = None, None
+        else:
+            self._vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4), sublinear_tf=True)
+            self._matrix = self._vectorizer.fit_transform(
+                [self._entries[key]['normalized'] for key in self._matrix_keys])
+        self._dirty = False
+
+    def lookup(self, question: str, schema_fingerprint: str, scope: str = '') -> Optional[str]:
+        """SQL of the most similar compatible question, or None"""
+        normalized = IntentEngine.normalize(question)
+        with self._lock:
+            self._counters['lookups'] += 1
+            key = hashlib.sha1(f"{schema_fingerprint}|{scope}|{normalized}".encode()).hexdigest()
+            entry = self._entries.get(key)
+            signature = None
+            if entry is not None:
+                # Persisted entries outlive the periods and engine that produced them
+                signature = self.signature(question, scope)
+                if entry['signature'] == signature:
+                    return self._hit(key, 'exact_hits')
+                self._counters['rejected_by_slots'] += 1
+
+            if self._dirty:
+                self._refit()
+            if self._matrix is None:
+                self._counters['misses'] += 1
+                return None
+            similarities = (self._matrix @ self._vectorizer.transform([normalized]).T).toarray().ravel()
+            for index in np.argsort(-similarities)[:5]:
+                if similarities[index] < self.threshold:
+                    break
+                candidate_key = self._matrix_keys[index]
+                candidate = self._entries.get(candidate_key)
+                # The exact entry, if any, was already checked above
+                if candidate is None or candidate_key == key or candidate['schema'] != schema_fingerprint \
+                        or candidate.get('scope', '') != scope:
+                    continue
+                if signature is None:
+                    signature = self.signature(question, scope)
+                if candidate['signature'] != signature:
+                    self._counters['rejected_by_slots'] += 1
+                    continue
+                return self._hit(candidate_key, 'similar_hits')
+            self._counters['misses'] += 1
+            return None
+
+    def _hit(self, key: str, counter: str) -> str:
+        self._counters[counter] += 1
+        entry = self._entries[key]
+        entry['hits'] += 1
+        self._entries.move_to_end(key)
+        return entry['sql']
+
+    def store(self, question: str, sql_query: str, schema_fingerprint: str, scope: str = ''):
+        """Remember the SQL a question was translated to"""
+        normalized = IntentEngine.normalize(question)
+        key = hashlib.sha1(f"{schema_fingerprint}|{scope}|{normalized}".encode()).hexdigest()
+        entry = {
+            'key': key,
+            'question': question,
+            'normalized': normalized,
+            'sql': sql_query,
+            'schema': schema_fingerprint,
+            'scope': scope,
+            'signature': self.signature(question, scope),
+            'hits': 0,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            # Entries for an older schema can never hit again
+            for stale_key in [k for k, e in self._entries.items() if e['schema'] != schema_fingerprint]:
+                del self._entries[stale_key]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+            self._dirty = True
+            self._unsaved = True
+            due = time.monotonic() - self._last_save >= self.save_interval
+        # Rewriting the whole index per question is O(entries); batch it instead
+        if due:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+        self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            unsaved = self._unsaved
+        hits = counters['exact_hits'] + counters['similar_hits']
+        return {
+            'entries': entries,
+            'unsaved': unsaved,
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'hit_rate': round(hits / counters['lookups'], 3) if counters['lookups'] else 0.0,
+            **counters,
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache(db_path: str) -> SemanticQueryCache:
+    """Semantic question cache shared by every session reading this database"""
+    return SemanticQueryCache(
+        os.path.join(cache_directory(db_path), 'semantic_cache.json'),
+        get_intent_engine(),
+        threshold=float(os.environ.get('BI_CHATBOT_SEMANTIC_THRESHOLD', '0.8'))
+    )
+
+@dataclass
+class ColumnStats:
+    name: str
+    kind: str  # 'currency', 'count', 'percent' or 'number'
+    additive: bool
+    count: int
+    total: float
+    mean: float
+    minimum: float
+    maximum: float
+    std: float
+    outliers: int = 0
+
+@dataclass
+class ResultSummary:
+    rows: int
+    columns: List[ColumnStats]
+    label_column: Optional[str] = None
+    top: Optional[Tuple[Any, float, float]] = None  # (label, value, share of total)
+    top_n_share: Optional[Tuple[int, float]] = None  # (n, share of total)
+    change: Optional[Tuple[Any, Any, float]] = None  # (previous period, last period, fractional change)
+    open_period: Optional[Any] = None  # latest period, still in progress and left out of ``change``
+
+class InsightEngine:
+    """Result statistics computed in one vectorized pass, worded by column meaning.
+
+    All measure columns are reduced together as one float matrix, so cost is
+    linear in rows × columns. Column names decide formatting: identifiers are
+    skipped, money gets a currency format, counts stay integral and rates are
+    shown as percentages. For results too large to materialize,
+    summarize_query pushes the same aggregates down into SQL.
+    """
+
+    ID_RE = re.compile(r"(^id$|_id$|^id_|_key$)")
+    TIME_RE = re.compile(r"(date|month|week|year|day|period|quarter|time)")
+    PERCENT_HINTS = ('pct', 'percent', 'rate', 'share', 'ratio')
+    COUNT_HINTS = ('count', 'quantity', 'units', 'orders', 'number', 'num_', 'stock', 'customers', 'transactions')
+    CURRENCY_HINTS = ('amount', 'revenue', 'sales', 'spent', 'price', 'cost', 'value', 'profit', 'income', 'total')
+    NON_ADDITIVE_HINTS = ('avg', 'average', 'mean', 'median', 'min', 'max', 'price')
+    PERIOD_RE = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+
+    def __init__(self, run_query: Optional[Callable[[str], pd.DataFrame]] = None, top_n: int = 3,
+                 outlier_sigma: float = 3.0, today: Callable[[], date] = date.today):
+        self.run_query = run_query
+        self.top_n = top_n
+        self.outlier_sigma = outlier_sigma
+        self.today = today
+
+    def is_open_period(self, period: Any) -> bool:
+        """Whether a period (2026, 2026-10, 2026-10-17 or a date) hasn't ended yet"""
+        today = self.today()
+        if isinstance(period, (datetime, date)):
+            return pd.Timestamp(period).date() >= today
+        text = str(period)
+        return bool(self.PERIOD_RE.match(text)) and text >= today.isoformat()[:len(text)]
+
+    @classmethod
+    def column_kind(cls, name: str, dtype=None) -> str:
+        """'id', 'currency', 'count', 'percent' or 'number' from the column name (and dtype)"""
+        lowered = name.lower()
+        if cls.ID_RE.search(lowered):
+            return 'id'
+        if any(hint in lowered for hint in cls.PERCENT_HINTS):
+            return 'percent'
+        if any(hint in lowered for hint in cls.COUNT_HINTS):
+            return 'count'
+        if any(hint in lowered for hint in cls.CURRENCY_HINTS):
+            return 'currency'
+        if dtype is not None and pd.api.types.is_integer_dtype(dtype):
+            return 'count'
+        return 'number'
+
+    @classmethod
+    def is_additive(cls, name: str, kind: str) -> bool:
+        lowered = name.lower()
+        return kind in ('currency', 'count') and not any(hint in lowered for hint in cls.NON_ADDITIVE_HINTS)
+
+    @staticmethod
+    def format_value(value: float, kind: str, precise: bool = False) -> str:
+        if value is None or not np.isfinite(value):
+            return 'n/a'
+        if kind == 'currency':
+            return f"${value:,.2f}"
+        if kind == 'count':
+            return f"{value:,.1f}" if precise and value != round(value) else f"{value:,.0f}"
+        if kind == 'percent':
+            return f"{value:.1f}%"
+        return f"{value:,.2f}"
+
+    @staticmethod
+    def label(name: str) -> str:
+        text = name.replace('_', ' ')
+        return text[:1].upper() + text[1:]
+
+    def measure_columns(self, df: pd.DataFrame) -> List[Tuple[str, str]]:
+        """(name, kind) for numeric columns that are not identifiers"""
+        measures = []
+        for name, dtype in df.dtypes.items():
+            if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                kind = self.column_kind(str(name), dtype)
+                if kind != 'id':
+                    measures.append((str(name), kind))
+        return measures
+
+    def _label_and_time_columns(self, df: pd.DataFrame) -> Tuple[Optional[str], Optional[str]]:
+        label_column, time_column = None, None
+        for name, dtype in df.dtypes.items():
+            name = str(name)
+            if pd.api.types.is_numeric_dtype(dtype) or self.ID_RE.search(name.lower()):
+                continue
+            if pd.api.types.is_datetime64_any_dtype(dtype) or self.TIME_RE.search(name.lower()):
+                time_column = time_column or name
+            else:
+                label_column = label_column or name
+        return label_column, time_column
+
+    def compute(self, df: pd.DataFrame) -> ResultSummary:
+        """All column statistics from one float matrix"""
+        measures = self.measure_columns(df)
+        label_column, time_column = self._label_and_time_columns(df)
+        summary = ResultSummary(rows=len(df), columns=[], label_column=label_column)
+        if not measures or df.empty:
+            return summary
+
+        values = df[[name for name, _ in measures]].to_numpy(dtype=np.float64, na_value=np.nan)
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        counts = present.sum(axis=0)
+        totals = filled.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+            # Centered second pass: E[x²] - mean² cancels catastrophically for large magnitudes
+            centered = np.where(present, values - means, 0.0)
+            variances = (centered * centered).sum(axis=0) / counts
+            stds = np.sqrt(variances)
+            minimums = np.where(present, values, np.inf).min(axis=0)
+            maximums = np.where(present, values, -np.inf).max(axis=0)
+            outliers = ((np.abs(values - means) > self.outlier_sigma * stds) & present & (stds > 0)).sum(axis=0)
+
+        for index, (name, kind) in enumerate(measures):
+            mean, minimum, maximum = means[index], minimums[index], maximums[index]
+            scale = 100.0 if kind == 'percent' and maximum <= 1.0 else 1.0
+            summary.columns.append(ColumnStats(
+                name=name, kind=kind, additive=self.is_additive(name, kind), count=int(counts[index]),
+                total=float(totals[index]) * scale, mean=float(mean) * scale, minimum=float(minimum) * scale,
+                maximum=float(maximum) * scale, std=float(stds[index]) * scale, outliers=int(outliers[index])
+            ))
+
+        primary_index = next((i for i, stats in enumerate(summary.columns) if stats.additive), 0)
+        primary = summary.columns[primary_index]
+        primary_values = filled[:, primary_index]
+
+        # Shares and period changes only mean something when each row is one label or period
+        if label_column is not None and len(df) > 1 and primary.additive and primary.total > 0 \
+                and df[label_column].is_unique:
+            top_index = int(np.argmax(primary_values))
+            summary.top = (df[label_column].iat[top_index], float(primary_values[top_index]),
+                           float(primary_values[top_index] / primary.total))
+            if len(df) > self.top_n:
+                top_sum = np.partition(primary_values, len(primary_values) - self.top_n)[-self.top_n:].sum()
+                summary.top_n_share = (self.top_n, float(top_sum / primary.total))
+
+        if time_column is not None and len(df) > 1 and df[time_column].is_unique:
+            periods = df[time_column].reset_index(drop=True)
+            # Linear max scans instead of sorting the whole column
+            last = int(periods.argmax())
+            earlier = periods.drop(index=last)
+            # A month to date against a whole month is not a trend: compare the last two complete periods
+            if self.is_open_period(periods.iat[last]):
+                summary.open_period = periods.iat[last]
+                last = int(earlier.idxmax()) if len(earlier) > 1 else None
+                earlier = earlier.drop(index=last) if last is not None else earlier
+            if last is not None:
+                previous = int(earlier.idxmax())
+                if primary_values[previous]:
+                    summary.change = (periods.iat[previous], periods.iat[last],
+                                      float(primary_values[last] / primary_values[previous] - 1.0))
+        return summary
+
+    def compute_sql(self, sql_query: str) -> ResultSummary:
+        """The same statistics computed by the database over the full result of sql_query"""
+        if self.run_query is None:
+            raise ValueError("InsightEngine needs run_query for SQL pushdown")
+        inner = sql_query.strip().rstrip(';')
+        sample = self.run_query(f"SELECT * FROM ({inner}) LIMIT 1000")
+        measures = self.measure_columns(sample)
+        label_column, _ = self._label_and_time_columns(sample)
+        if not measures:
+            rows = self.run_query(f"SELECT COUNT(*) AS n FROM ({inner})")['n'].iat[0]
+            return ResultSummary(rows=int(rows), columns=[], label_column=label_column)
+
+        select = ["COUNT(*) AS n"]
+        if label_column is not None:
+            select.append(f"COUNT(DISTINCT {quote_identifier(label_column)}) AS labels")
+        # Squares are taken around the sample mean so the variance doesn't cancel for large magnitudes
+        shifts = []
+        for index, (name, _) in enumerate(measures):
+            column = quote_identifier(name)
+            shift = float(pd.to_numeric(sample[name], errors='coerce').mean())
+            shifts.append(shift if np.isfinite(shift) else 0.0)
+            select += [f"COUNT({column}) AS c{index}", f"TOTAL({column}) AS s{index}", f"MIN({column}) AS lo{index}",
+                       f"MAX({column}) AS hi{index}",
+                       f"TOTAL(({column} - {shifts[index]!r}) * ({column} - {shifts[index]!r})) AS sq{index}"]
+        moments = self.run_query(f"SELECT {', '.join(select)} FROM ({inner})").iloc[0]
+
+        summary = ResultSummary(rows=int(moments['n']), columns=[], label_column=label_column)
+        outlier_terms = []
+        for index, (name, kind) in enumerate(measures):
+            count = int(moments[f'c{index}'])
+            total = float(moments[f's{index}'])
+            mean = total / count if count else float('nan')
+            offset = mean - shifts[index]
+            std = float(np.sqrt(max(float(moments[f'sq{index}']) / count - offset * offset, 0.0))) if count else 0.0
+            summary.columns.append(ColumnStats(
+                name=name, kind=kind, additive=self.is_additive(name, kind), count=count, total=total, mean=mean,
+                minimum=float(moments[f'lo{index}']) if count else float('nan'),
+                maximum=float(moments[f'hi{index}']) if count else float('nan'), std=std
+            ))
+            if std > 0:
+                outlier_terms.append(
+                    f"TOTAL(ABS({quote_identifier(name)} - {mean!r}) > {self.outlier_sigma * std!r}) AS o{index}")
+        if outlier_terms:
+            outliers = self.run_query(f"SELECT {', '.join(outlier_terms)} FROM ({inner})").iloc[0]
+            for index, stats in enumerate(summary.columns):
+                stats.outliers = int(outliers.get(f'o{index}', 0))
+
+        primary = next((stats for stats in summary.columns if stats.additive), None)
+        if label_column is not None and primary is not None and primary.total > 0 and summary.rows > 1 \
+                and int(moments['labels']) == summary.rows:
+            top = self.run_query(
+                f"SELECT {quote_identifier(label_column)} AS label, {quote_identifier(primary.name)} AS value "
+                f"FROM ({inner}) ORDER BY value DESC LIMIT {self.top_n}"
+            )
+            if not top.empty:
+                summary.top = (top['label'].iat[0], float(top['value'].iat[0]), float(top['value'].iat[0]) / primary.total)
+                if summary.rows > self.top_n:
+                    summary.top_n_share = (self.top_n, float(top['value'].sum()) / primary.total)
+        return summary
+
+    def render(self, summary: ResultSummary) -> str:
+        """Markdown lines for a summary"""
+        if summary.rows == 0:
+            return "No data found for your query."
+        lines = []
+        for stats in summary.columns:
+            name = stats.name.replace('_', ' ')
+            if summary.rows == 1:
+                lines.append(f"{self.label(stats.name)}: {self.format_value(stats.total, stats.kind)}")
+            elif stats.additive:
+                lines.append(
+                    f"{self.label(stats.name) if stats.name.lower().startswith('total') else 'Total ' + name}: {self.format_value(stats.total, stats.kind)} across {summary.rows:,} rows "
+                    f"(average {self.format_value(stats.mean, stats.kind, precise=True)}, range "
+                    f"{self.format_value(stats.minimum, stats.kind)} – {self.format_value(stats.maximum, stats.kind)})"
+                )
+            else:
+                lines.append(
+                    f"{self.label(stats.name)}: average {self.format_value(stats.mean, stats.kind, precise=True)}, "
+                    f"range {self.format_value(stats.minimum, stats.kind)} – {self.format_value(stats.maximum, stats.kind)}"
+                )
+
+        primary = next((stats for stats in summary.columns if stats.additive), None)
+        if summary.top is not None and primary is not None:
+            label, value, share = summary.top
+            lines.append(f"Top performer: {label} ({self.format_value(value, primary.kind)}, {share:.1%} of total)")
+        if summary.top_n_share is not None:
+            n, share = summary.top_n_share
+            lines.append(f"Top {n} account for {share:.1%} of the total")
+        if summary.change is not None:
+            previous, last, change = summary.change
+            note = f" ({summary.open_period} is still in progress)" if summary.open_period is not None else ""
+            lines.append(f"{previous} → {last}: {change:+.1%}{note}")
+        if summary.rows >= 10:
+            for stats in summary.columns:
+                if stats.outliers:
+                    lines.append(f"{stats.outliers:,} unusual {stats.name.replace('_', ' ')} value"
+                                 f"{'s' if stats.outliers != 1 else ''} (beyond {self.outlier_sigma:g}σ of the mean)")
+        return "  \n".join(lines) if lines else "Data retrieved successfully."
+
+    def summarize(self, df: pd.DataFrame) -> str:
+        """Generate natural language insights from query results"""
+        if df.empty:
+            return "No data found for your query."
+        return self.render(self.compute(df))
+
+    def summarize_query(self, sql_query: str) -> str:
+        """Insights over a query's full result without loading it into pandas"""
+        return self.render(self.compute_sql(sql_query))
+
+class LLMClient:
+    """Backend that turns questions into SQL and query results into prose"""
+
+    name = 'base'
+
+    def generate_sql_query(self, natural_query: str, table_schema: Dict) -> str:
+        raise NotImplementedError
+
+    def generate_insights(self, query_result: pd.DataFrame, original_query: str) -> str:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+# Mock OpenAI client for demo (used when no API key is configured)
+class MockOpenAI(LLMClient):
+    name = 'mock'
 
-# Mock OpenAI client for demo (replace with real OpenAI when API key available)
-class MockOpenAI:
     def __init__(self):
-        pass
+        self.intent_engine = get_intent_engine()
+        self.insight_engine = InsightEngine()
+    
+    def generate_sql_query(self, natural_query: str, table_schema: Dict) -> str:
+        """Convert natural language to SQL query"""
+        return self.intent_engine.generate_sql(natural_query, table_schema)
     
+    def generate_insights(self, query_result: pd.DataFrame, original_query: str) -> str:
+        """Generate natural language insights from query results"""
+        return self.insight_engine.summarize(query_result)
+
+class LLMError(Exception):
+    """The language model backend failed or returned something unusable"""
+
+class AsyncLoopThread:
+    """An asyncio event loop on a daemon thread, so synchronous Streamlit code can await async I/O"""
+
+    def __init__(self, name: str = 'bi-llm-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout: Optional[float] = None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second with bursts up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                delay = (tokens - self._tokens) / self.rate
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
+
+class PromptCache:
+    """Persistent prompt -> response cache in its own SQLite file.
+
+    Keys hash the model, the schema and the full prompt, so a schema change or
+    a different model never serves a stale answer.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS prompt_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created REAL,
+                last_used REAL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_last_used ON prompt_cache(last_used)")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, schema_hash: str, messages: List[Dict[str, str]]) -> str:
+        payload = json.dumps([model, schema_hash, messages], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM prompt_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE prompt_cache SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM prompt_cache WHERE key IN (SELECT key FROM prompt_cache ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM prompt_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0}
+
+class OpenAIChatClient(LLMClient):
+    """OpenAI-compatible chat completions client.
+
+    Requests run on one shared httpx.AsyncClient (pooled keep-alive
+    connections) in a background event loop. A token bucket caps requests per
+    minute and a semaphore caps requests in flight. Identical prompts that
+    arrive while one is already in flight wait for that request instead of
+    sending their own, and answers are kept in a persistent PromptCache.
+    """
+
+    SQL_SYSTEM_PROMPT = (
+        "You translate business questions into a single SQLite SELECT statement. "
+        "Use only the tables and columns listed below. Reply with the SQL only, no explanation.\n\n"
+        "Schema:\n{schema}"
+    )
+    INSIGHTS_SYSTEM_PROMPT = (
+        "You are a business analyst. Summarize the query result below in 3-5 short bullet points "
+        "for a non-technical reader, starting with '📊 **Key Insights:**'."
+    )
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    _FENCE_RE = re.compile(r"```(?:sql)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+
+    def __init__(self, api_key: str, model: str = 'gpt-4o-mini', base_url: str = 'https://api.openai.com/v1',
+                 requests_per_minute: float = 60, max_concurrency: int = 4, timeout: float = 30.0,
+                 max_retries: int = 2, prompt_cache: Optional[PromptCache] = None):
+        import httpx  # Optional dependency, only needed when a real model is configured
+
+        self._httpx = httpx
+        self.api_key = api_key
+        self.model = model
+        self.name = f"openai:{model}"
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.prompt_cache = prompt_cache
+        self._loop = AsyncLoopThread()
+        self._closed = False
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._counters = {'requests': 0, 'retries': 0, 'errors': 0, 'coalesced': 0, 'cache_hits': 0,
+                          'prompt_tokens': 0, 'completion_tokens': 0, 'request_seconds': 0.0}
+
+        async def setup():
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={'Authorization': f"Bearer {api_key}"},
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+            )
+            self._semaphore = asyncio.Semaphore(max_concurrency)
+            # A question makes two calls back to back (SQL, then insights): allow a burst
+            # of at least max_concurrency so an idle server doesn't add a wait between them
+            self._bucket = TokenBucket(requests_per_minute / 60.0, max(1.0, float(max_concurrency), requests_per_minute / 60.0))
+        self._loop.run(setup())
+
+    @staticmethod
+    def schema_hash(table_schema: Optional[Dict]) -> str:
+        return hashlib.sha1(json.dumps(table_schema or {}, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    async def _post(self, messages: List[Dict[str, str]]) -> str:
+        payload = {'model': self.model, 'messages': messages, 'temperature': 0}
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._bucket.acquire()
+                start = time.perf_counter()
+                try:
+                    response = await self._client.post('/chat/completions', json=payload)
+                except self._httpx.HTTPError as exc:
+                    error = LLMError(f"LLM request failed: {exc}")
+                else:
+                    self._counters['request_seconds'] += time.perf_counter() - start
+                    self._counters['requests'] += 1
+                    if response.status_code == 200:
+                        try:
+                            data = response.json()
+                            content = data['choices'][0]['message']['content']
+                            if not isinstance(content, str):
+                                raise TypeError(f"message content is {type(content).__name__}")
+                        except (ValueError, KeyError, IndexError, TypeError) as exc:
+                            # Truncated or non-JSON body, or no message; a retry won't fix it
+                            error = LLMError(f"LLM returned an unusable response: {exc}")
+                            break
+                        usage = data.get('usage') or {}
+                        self._counters['prompt_tokens'] += usage.get('prompt_tokens', 0)
+                        self._counters['completion_tokens'] += usage.get('completion_tokens', 0)
+                        return content
+                    error = LLMError(f"LLM request failed with HTTP {response.status_code}")
+                    if response.status_code not in self.RETRY_STATUSES:
+                        break
+                if attempt < self.max_retries:
+                    self._counters['retries'] += 1
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+            self._counters['errors'] += 1
+            raise error
+
+    async def _complete(self, messages: List[Dict[str, str]], schema_hash: str) -> str:
+        """Answer from the prompt cache, join an identical in-flight request, or send a new one"""
+        key = PromptCache.key(self.model, schema_hash, messages)
+        if self.prompt_cache is not None:
+            cached = self.prompt_cache.get(key)
+            if cached is not None:
+                self._counters['cache_hits'] += 1
+                return cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._counters['coalesced'] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            content = await self._post(messages)
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # Marks it retrieved when nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(key, self.model, content)
+        future.set_result(content)
+        return content
+
+    def _sql_messages(self, natural_query: str, table_schema: Dict) -> List[Dict[str, str]]:
+        schema = "\n".join(f"{table}({', '.join(columns)})" for table, columns in (table_schema or {}).items())
+        return [
+            {'role': 'system', 'content': self.SQL_SYSTEM_PROMPT.format(schema=schema)},
+            {'role': 'user', 'content': natural_query.strip()},
+        ]
+
+    @classmethod
+    def extract_sql(cls, content: str) -> str:
+        """Strip markdown fences and anything after the first statement"""
+        fenced = cls._FENCE_RE.search(content)
+        sql_query = (fenced.group(1) if fenced else content).strip()
+        sql_query = sql_query.split(';')[0].strip()
+        if not re.match(r"^(select|with)\b", sql_query, re.IGNORECASE):
+            raise LLMError(f"LLM did not return a SELECT statement: {content[:200]!r}")
+        return sql_query
+
     def generate_sql_query(self, natural_query: str, table_schema: Dict) -> str:
         """Convert natural language to SQL query"""
-        query_lower = natural_query.lower()
-        
-        # Simple pattern matching for demo
-        if 'sales' in query_lower and 'last month' in query_lower:
-            return "SELECT SUM(amount) as total_sales FROM sales WHERE date >= date('now', '-1 month')"
-        elif 'revenue' in query_lower and 'by product' in query_lower:
-            return "SELECT product_name, SUM(amount) as revenue FROM sales GROUP BY product_name ORDER BY revenue DESC"
-        elif 'customers' in query_lower and 'this year' in query_lower:
-            return "SELECT COUNT(DISTINCT customer_id) as customer_count FROM sales WHERE date >= date('now', 'start of year')"
-        elif 'top' in query_lower and 'customers' in query_lower:
-            return "SELECT customer_name, SUM(amount) as total_spent FROM sales GROUP BY customer_name ORDER BY total_spent DESC LIMIT 10"
-        elif 'monthly' in query_lower and 'trend' in query_lower:
-            return "SELECT strftime('%Y-%m', date) as month, SUM(amount) as monthly_sales FROM sales GROUP BY month ORDER BY month"
+        messages = self._sql_messages(natural_query, table_schema)
+        content = self._loop.run(self._complete(messages, self.schema_hash(table_schema)), self.timeout * 3)
+        return self.extract_sql(content)
+
+    def generate_sql_batch(self, questions: List[str], table_schema: Dict) -> List[str]:
+        """Translate several questions concurrently (duplicates share one request)"""
+        schema_hash = self.schema_hash(table_schema)
+
+        async def run_all():
+            return await asyncio.gather(*[
+                self._complete(self._sql_messages(question, table_schema), schema_hash) for question in questions
+            ])
+        return [self.extract_sql(content) for content in self._loop.run(run_all(), self.timeout * 3)]
+
+    def generate_insights(self, query_result: pd.DataFrame, original_query: str) -> str:
+        """Generate natural language insights from query results"""
+        if query_result.empty:
+            return "No data found for your query."
+        sample = query_result.head(20).to_csv(index=False)
+        messages = [
+            {'role': 'system', 'content': self.INSIGHTS_SYSTEM_PROMPT},
+            {'role': 'user', 'content': f"Question: {original_query}\nRows: {len(query_result)}\n\n{sample}"},
+        ]
+        return self._loop.run(self._complete(messages, result_fingerprint(query_result)), self.timeout * 3)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._counters)
+        stats['request_seconds'] = round(stats['request_seconds'], 3)
+        stats['rate_limit_wait_seconds'] = round(self._bucket.waited_seconds, 3)
+        stats['model'] = self.model
+        if self.prompt_cache is not None:
+            stats['prompt_cache'] = self.prompt_cache.stats()
+        return stats
+
+    def close(self):
+        # A second close would wait forever on the stopped loop
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.run(self._client.aclose(), self.timeout)
+        self._loop.close()
+
+class LocalLLMStubServer:
+    """OpenAI-compatible /v1/chat/completions endpoint backed by MockOpenAI.
+
+    Lets OpenAIChatClient be exercised offline (tests, benchmarks, demos):
+
+        with LocalLLMStubServer(latency=0.2) as server:
+            client = OpenAIChatClient('test-key', base_url=server.base_url)
+
+    queue_response() makes the next requests fail (rate limits, outages or
+    malformed bodies) before normal answers resume.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self._mock = MockOpenAI()
+        self._server = None
+        self._queued: deque = deque()
+        self._queue_lock = threading.Lock()
+
+    def queue_response(self, status: int, body: bytes = b'', times: int = 1):
+        """Answer the next ``times`` requests with this status and raw body"""
+        with self._queue_lock:
+            self._queued.extend([(status, body)] * times)
+
+    def _next_queued(self) -> Optional[Tuple[int, bytes]]:
+        with self._queue_lock:
+            return self._queued.popleft() if self._queued else None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def respond(self, messages: List[Dict[str, str]]) -> str:
+        system = next((m['content'] for m in messages if m.get('role') == 'system'), '')
+        user = next((m['content'] for m in reversed(messages) if m.get('role') == 'user'), '')
+        if system.startswith(OpenAIChatClient.INSIGHTS_SYSTEM_PROMPT[:40]):
+            question = user.split('\n', 1)[0].replace('Question: ', '')
+            return f"📊 **Key Insights:**\n\n• Stub summary for: {question}"
+        return f"```sql\n{self._mock.generate_sql_query(user, {})};\n```"
+
+    def start(self) -> 'LocalLLMStubServer':
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stub = self
+
+        class CompletionsHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                queued = stub._next_queued()
+                if queued is not None:
+                    status, body = queued
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                messages = request.get('messages', [])
+                content = stub.respond(messages)
+                prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+                payload = json.dumps({
+                    'id': f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'stub'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4,
+                              'total_tokens': prompt_tokens + len(content) // 4},
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), CompletionsHandler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='bi-llm-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'LocalLLMStubServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+@st.cache_resource(show_spinner=False)
+def get_llm_client(api_key: str, model: str, base_url: str, cache_path: str) -> OpenAIChatClient:
+    """One client per API key/model, so sessions sharing a key share its connections and rate limit"""
+    return OpenAIChatClient(
+        api_key,
+        model=model,
+        base_url=base_url,
+        requests_per_minute=float(os.environ.get('BI_CHATBOT_LLM_RPM', '60')),
+        max_concurrency=int(os.environ.get('BI_CHATBOT_LLM_CONCURRENCY', '4')),
+        prompt_cache=PromptCache(cache_path)
+    )
+
+@dataclass
+class BusinessDataConnection:
+    name: str
+    type: str  # 'sqlite', 'csv', 'excel', 'api'
+    connection_string: str
+    tables: List[str]
+    description: str
+    status: str = 'ready'  # 'queued', 'importing', 'ready', 'error'
+    rows: int = 0
+    error: str = ''
+    state: Dict[str, Any] = field(default_factory=dict)  # import bookkeeping (size, mtime, sha1, columns)
+
+class SQLiteConnectionPool:
+    """Shared SQLite connection pool: many pooled readers, one serialized writer.
+
+    Readers are opened once in WAL mode with tuned page cache/mmap pragmas and
+    handed out exclusively to whichever thread borrows them, so Streamlit
+    script threads (which change on every rerun) still reuse warm connections.
+    All writes go through a single writer connection guarded by a lock.
+    """
+
+    def __init__(self, db_path: str, max_readers: int = 8, cache_size_kb: int = 64 * 1024,
+                 mmap_size: int = 256 * 1024 * 1024, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self._idle_readers: deque = deque()
+        self._open_readers = 0
+        self._readers_in_use = 0
+        self._reader_cond = threading.Condition()
+
+        self._writer_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+
+        # Utilization / wait-time counters
+        self._stats_lock = threading.Lock()
+        self._reader_borrows = 0
+        self._reader_waits = 0
+        self._reader_wait_total = 0.0
+        self._reader_wait_max = 0.0
+        self._peak_readers_in_use = 0
+        self._writer_borrows = 0
+        self._writer_wait_total = 0.0
+        self._writer_wait_max = 0.0
+
+        # Write tracking: per-table versions bumped on every committed write, plus
+        # an epoch that moves when another process changes the database file
+        self._version_lock = threading.Lock()
+        self._table_versions: Dict[str, int] = {}
+        self._pending_tables: set = set()
+        self._pending_schema_change = False
+        self.write_generation = 0
+        self.schema_generation = 0
+        self.external_epoch = 0
+        self._monitor_lock = threading.Lock()
+        self._monitor: Optional[sqlite3.Connection] = None
+        self._known_data_version: Optional[int] = None
+
+        # Extra databases ATTACHed to every reader (alias -> path); readers catch
+        # up with attach/detach the next time they are borrowed
+        self._attachments: Dict[str, str] = {}
+        self._attach_generation = 0
+        self._reader_attach_generation: Dict[int, int] = {}
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        """Open a connection with the pool's pragmas applied"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if read_only:
+            conn.execute("PRAGMA query_only = 1")
+            self._apply_attachments(conn)
+        else:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _apply_attachments(self, conn: sqlite3.Connection):
+        """Bring a reader's attached databases in line with the pool's"""
+        with self._version_lock:
+            wanted = dict(self._attachments)
+            generation = self._attach_generation
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")} - {'main', 'temp'}
+        for alias in attached - set(wanted):
+            conn.execute(f"DETACH DATABASE {quote_identifier(alias)}")
+        for alias, path in wanted.items():
+            if alias not in attached:
+                conn.execute(f"ATTACH DATABASE ? AS {quote_identifier(alias)}", (path,))
+        self._reader_attach_generation[id(conn)] = generation
+
+    @property
+    def attachments(self) -> Dict[str, str]:
+        with self._version_lock:
+            return dict(self._attachments)
+
+    def attach(self, alias: str, path: str):
+        """ATTACH another SQLite database to every reader as ``alias``"""
+        with self._version_lock:
+            self._attachments[alias] = os.path.abspath(path)
+            self._attach_generation += 1
+            self.schema_generation += 1
+
+    def detach(self, alias: str):
+        with self._version_lock:
+            if self._attachments.pop(alias, None) is not None:
+                self._attach_generation += 1
+                self.schema_generation += 1
+
+    def note_external_change(self, schema_changed: bool = False):
+        """Invalidate version snapshots after a change the pool cannot observe (e.g. an attached file)"""
+        with self._version_lock:
+            self.external_epoch += 1
+            if schema_changed:
+                self.schema_generation += 1
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        # Caller must hold self._writer_lock
+        if self._writer is None:
+            # No statement cache: the authorizer only fires when a statement is prepared
+            self._writer = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout_ms / 1000,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=0
+            )
+            self._writer.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            self._writer.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+            self._writer.execute("PRAGMA temp_store = MEMORY")
+            self._writer.execute("PRAGMA journal_mode = WAL")
+            self._writer.execute("PRAGMA synchronous = NORMAL")
+            self._writer.set_authorizer(self._track_write)
+        return self._writer
+
+    _DATA_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+    _SCHEMA_ACTIONS = (
+        sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_ALTER_TABLE,
+        sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_DROP_INDEX,
+        sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DROP_VIEW
+    )
+
+    def _track_write(self, action, arg1, arg2, db_name, source):
+        """Authorizer hook recording which tables the writer touches"""
+        if action in self._DATA_ACTIONS and arg1 and not arg1.startswith('sqlite_'):
+            self._pending_tables.add(arg1.lower())
+        elif action in self._SCHEMA_ACTIONS:
+            self._pending_schema_change = True
+            # DROP/ALTER TABLE pass the table in arg1/arg2 respectively
+            table = arg2 if action == sqlite3.SQLITE_ALTER_TABLE else arg1
+            if action in (sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_ALTER_TABLE) and table:
+                self._pending_tables.add(table.lower())
+        return sqlite3.SQLITE_OK
+
+    def _publish_writes(self):
+        """Bump versions for the tables written by the transaction that just committed"""
+        with self._version_lock:
+            for table in self._pending_tables:
+                self._table_versions[table] = self._table_versions.get(table, 0) + 1
+            if self._pending_tables or self._pending_schema_change:
+                self.write_generation += 1
+            if self._pending_schema_change:
+                self.schema_generation += 1
+        self._pending_tables = set()
+        self._pending_schema_change = False
+        # Our own commit moves data_version too; remember it so it isn't mistaken
+        # for an external write
+        with self._monitor_lock:
+            self._known_data_version = self._read_data_version()
+
+    def _read_data_version(self) -> int:
+        # Caller must hold self._monitor_lock
+        if self._monitor is None:
+            self._monitor = self._connect(read_only=True)
+        return self._monitor.execute("PRAGMA data_version").fetchone()[0]
+
+    def check_external_writes(self) -> int:
+        """Advance external_epoch if another process committed since the last check"""
+        with self._monitor_lock:
+            current = self._read_data_version()
+            if self._known_data_version is None:
+                self._known_data_version = current
+            elif current != self._known_data_version:
+                self._known_data_version = current
+                with self._version_lock:
+                    self.external_epoch += 1
+        return self.external_epoch
+
+    def data_version(self, tables: Optional[List[str]] = None) -> tuple:
+        """Version snapshot for the given tables (or the whole database)"""
+        epoch = self.check_external_writes()
+        with self._version_lock:
+            if tables is None:
+                return (epoch, self.write_generation)
+            return (epoch,) + tuple(self._table_versions.get(t.lower(), 0) for t in tables)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection for the duration of the block"""
+        # Make sure the database is in WAL mode before the first reader opens
+        if self._writer is None:
+            with self._writer_lock:
+                self._writer_connection()
+
+        start = time.perf_counter()
+        waited = False
+        conn = None
+        with self._reader_cond:
+            while not self._idle_readers and self._open_readers >= self.max_readers:
+                waited = True
+                self._reader_cond.wait()
+            if self._idle_readers:
+                conn = self._idle_readers.pop()
+            else:
+                self._open_readers += 1
+            self._readers_in_use += 1
+            in_use = self._readers_in_use
+        wait = time.perf_counter() - start
+
+        try:
+            if conn is None:
+                conn = self._connect(read_only=True)
+            elif self._reader_attach_generation.get(id(conn)) != self._attach_generation:
+                self._apply_attachments(conn)
+        except Exception:
+            if conn is not None:
+                # Drop a reader that could not catch up with the attachments
+                self._reader_attach_generation.pop(id(conn), None)
+                conn.close()
+            with self._reader_cond:
+                self._open_readers -= 1
+                self._readers_in_use -= 1
+                self._reader_cond.notify()
+            raise
+
+        with self._stats_lock:
+            self._reader_borrows += 1
+            self._reader_wait_total += wait
+            self._reader_wait_max = max(self._reader_wait_max, wait)
+            self._peak_readers_in_use = max(self._peak_readers_in_use, in_use)
+            if waited:
+                self._reader_waits += 1
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._reader_cond:
+                self._readers_in_use -= 1
+                self._idle_readers.append(conn)
+                self._reader_cond.notify()
+
+    @contextmanager
+    def _borrow_writer(self) -> Iterator[sqlite3.Connection]:
+        start = time.perf_counter()
+        with self._writer_lock:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self._writer_borrows += 1
+                self._writer_wait_total += wait
+                self._writer_wait_max = max(self._writer_wait_max, wait)
+            yield self._writer_connection()
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Borrow the single writer connection inside one IMMEDIATE transaction"""
+        with self._borrow_writer() as conn:
+            self._pending_tables = set()
+            self._pending_schema_change = False
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._pending_tables = set()
+                self._pending_schema_change = False
+                raise
+            else:
+                if conn.in_transaction:
+                    conn.commit()
+                self._publish_writes()
+
+    @contextmanager
+    def bulk_writer(self) -> Iterator[sqlite3.Connection]:
+        """Borrow the writer for a bulk load with durability relaxed.
+
+        The caller issues its own BEGIN/COMMIT per chunk so each transaction
+        stays bounded; table versions are published once the load finishes.
+        """
+        with self._borrow_writer() as conn:
+            self._pending_tables = set()
+            self._pending_schema_change = False
+            conn.execute("PRAGMA synchronous = OFF")
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                conn.execute("PRAGMA synchronous = NORMAL")
+                self._publish_writes()
+
+    def stats(self) -> Dict[str, Any]:
+        """Report pool utilization and wait-time metrics"""
+        with self._reader_cond:
+            open_readers = self._open_readers
+            in_use = self._readers_in_use
+        with self._stats_lock:
+            borrows = self._reader_borrows
+            writer_borrows = self._writer_borrows
+            return {
+                'max_readers': self.max_readers,
+                'open_readers': open_readers,
+                'readers_in_use': in_use,
+                'reader_utilization': in_use / self.max_readers if self.max_readers else 0.0,
+                'peak_readers_in_use': self._peak_readers_in_use,
+                'reader_borrows': borrows,
+                'reader_waits': self._reader_waits,
+                'reader_wait_avg_ms': (self._reader_wait_total / borrows * 1000) if borrows else 0.0,
+                'reader_wait_max_ms': self._reader_wait_max * 1000,
+                'writer_borrows': writer_borrows,
+                'writer_wait_avg_ms': (self._writer_wait_total / writer_borrows * 1000) if writer_borrows else 0.0,
+                'writer_wait_max_ms': self._writer_wait_max * 1000,
+            }
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._reader_cond:
+            while self._idle_readers:
+                self._idle_readers.pop().close()
+                self._open_readers -= 1
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._monitor_lock:
+            if self._monitor is not None:
+                self._monitor.close()
+                self._monitor = None
+
+@st.cache_resource(show_spinner=False)
+def get_connection_pool(db_path: str) -> SQLiteConnectionPool:
+    """Process-wide connection pool per database, shared across sessions and reruns"""
+    return SQLiteConnectionPool(db_path)
+
+def quote_identifier(name: str) -> str:
+    """Quote an SQLite identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+def quote_table(name: str) -> str:
+    """Quote a catalog table name; ``alias.table`` names live in attached databases"""
+    schema, _, table = name.rpartition('.')
+    return f"{quote_identifier(schema)}.{quote_identifier(table)}" if schema else quote_identifier(name)
+
+def sql_literal(value: Any) -> str:
+    """Render a value as an SQLite literal"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+@dataclass
+class ColumnInfo:
+    name: str
+    type: str
+    not_null: bool = False
+    primary_key: bool = False
+    samples: List[Any] = field(default_factory=list)  # distinct values seen in the first rows
+
+@dataclass
+class TableInfo:
+    name: str
+    columns: List[ColumnInfo]
+    row_count: int = 0
+    indexes: Dict[str, List[str]] = field(default_factory=dict)  # index name -> indexed columns
+    has_rowid: bool = True  # False for WITHOUT ROWID tables
+    key_columns: List[str] = field(default_factory=list)  # primary key columns, in key order
+
+    @property
+    def column_names(self) -> List[str]:
+        return [col.name for col in self.columns]
+
+class SchemaCatalog:
+    """In-memory description of the database schema, built once and reused.
+
+    The catalog is rebuilt only when the schema changes: writes through the
+    connection pool bump its schema generation immediately, and
+    PRAGMA schema_version is polled at most every ``check_interval`` seconds
+    to notice changes made by other processes. Row counts are refreshed on
+    the same schedule for tables whose data version moved.
+
+    ``tables`` includes the bookkeeping tables of the rollups and the alert
+    engine; ``user_tables`` and ``as_dict()``, which feed the Data Explorer
+    and the NL-to-SQL layer, leave them out.
+    """
+
+    # Glob patterns of internal tables in the main database (staging tables are never catalogued)
+    INTERNAL_TABLES = ['sales_rollup', 'rollup_state', 'alert_*', 'demo_seed']
+
+    def __init__(self, pool: SQLiteConnectionPool, sample_size: int = 20,
+                 sample_scan_rows: int = 10000, check_interval: float = 5.0):
+        self.pool = pool
+        self.sample_size = sample_size
+        self.sample_scan_rows = sample_scan_rows
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._tables: Dict[str, TableInfo] = {}
+        self._table_versions: Dict[str, tuple] = {}
+        self._schema_version: Optional[int] = None
+        self._schema_generation = -1
+        self._last_check = 0.0
+        self.fingerprint = ""
+        self.builds = 0
+
+    def ensure_current(self):
+        """Rebuild if the schema changed; cheap enough to call on every question"""
+        if self.pool.schema_generation != self._schema_generation:
+            self.refresh(force=True)
+        elif time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+
+    def refresh(self, force: bool = False):
+        """Re-check schema_version and row counts, rebuilding what changed"""
+        with self._lock:
+            generation = self.pool.schema_generation
+            with self.pool.reader() as conn:
+                schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+                if force or schema_version != self._schema_version:
+                    self._tables = self._build(conn)
+                    self._table_versions = {}
+                    self._schema_version = schema_version
+                    self.fingerprint = self._compute_fingerprint(self._tables)
+                    self.builds += 1
+                self._schema_generation = generation
+                self._refresh_row_counts(conn)
+            self._last_check = time.monotonic()
+
+    def _build(self, conn: sqlite3.Connection) -> Dict[str, TableInfo]:
+        tables = {}
+        # Tables of attached databases are catalogued as "alias.table"
+        schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] != 'temp']
+        for schema in schemas:
+            prefix = '' if schema == 'main' else f"{schema}."
+            schema_q = quote_identifier(schema)
+            names = [row[0] for row in conn.execute(
+                f"SELECT name FROM {schema_q}.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+                "AND name NOT GLOB '__staging_*' ORDER BY name"
+            )]
+            for name in names:
+                table_name = prefix + name
+                quoted = quote_table(table_name)
+                table_info = conn.execute(f"PRAGMA {schema_q}.table_info({quote_identifier(name)})").fetchall()
+                columns = [
+                    ColumnInfo(name=row[1], type=(row[2] or '').upper(), not_null=bool(row[3]), primary_key=bool(row[5]))
+                    for row in table_info
+                ]
+                key_columns = [row[1] for row in sorted(table_info, key=lambda row: row[5]) if row[5]]
+                try:
+                    conn.execute(f"SELECT rowid FROM {quoted} LIMIT 0")
+                    has_rowid = True
+                except sqlite3.OperationalError:
+                    has_rowid = False
+                indexes = {}
+                for index_row in conn.execute(f"PRAGMA {schema_q}.index_list({quote_identifier(name)})"):
+                    index_name = index_row[1]
+                    indexes[index_name] = [
+                        # Expression index columns have no name
+                        info[2] if info[2] is not None else '<expr>'
+                        for info in conn.execute(f"PRAGMA {schema_q}.index_info({quote_identifier(index_name)})")
+                    ]
+                for col in columns:
+                    if 'CHAR' in col.type or 'TEXT' in col.type or 'CLOB' in col.type:
+                        col.samples = self._sample_values(conn, quoted, col.name)
+                tables[table_name] = TableInfo(name=table_name, columns=columns, indexes=indexes,
+                                               has_rowid=has_rowid, key_columns=key_columns)
+        return tables
+
+    def _sample_values(self, conn: sqlite3.Connection, quoted_table: str, column: str) -> List[Any]:
+        """Distinct values from the first rows only, so large tables stay cheap"""
+        col = quote_identifier(column)
+        rows = conn.execute(
+            # NOT INDEXED: a covering index would return the first rows in key order
+            f"SELECT DISTINCT {col} FROM (SELECT {col} FROM {quoted_table} NOT INDEXED LIMIT ?) "
+            f"WHERE {col} IS NOT NULL LIMIT ?",
+            (self.sample_scan_rows, self.sample_size)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _refresh_row_counts(self, conn: sqlite3.Connection):
+        for table_name, info in self._tables.items():
+            version = self.pool.data_version([table_name])
+            if self._table_versions.get(table_name) != version:
+                info.row_count = conn.execute(f"SELECT COUNT(*) FROM {quote_table(table_name)}").fetchone()[0]
+                self._table_versions[table_name] = version
+
+    @staticmethod
+    def _compute_fingerprint(tables: Dict[str, TableInfo]) -> str:
+        description = [(name, [(col.name, col.type) for col in info.columns]) for name, info in sorted(tables.items())]
+        return hashlib.sha1(json.dumps(description).encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def tables(self) -> Dict[str, TableInfo]:
+        self.ensure_current()
+        return self._tables
+
+    @property
+    def user_tables(self) -> Dict[str, TableInfo]:
+        """Tables users query and browse, without internal bookkeeping tables"""
+        return {name: info for name, info in self.tables.items() if not self.is_internal(name)}
+
+    @classmethod
+    def is_internal(cls, table_name: str) -> bool:
+        return any(fnmatch.fnmatchcase(table_name, pattern) for pattern in cls.INTERNAL_TABLES)
+
+    def table(self, table_name: str) -> Optional[TableInfo]:
+        return self.tables.get(table_name)
+
+    def row_count(self, table_name: str) -> int:
+        info = self.table(table_name)
+        return info.row_count if info else 0
+
+    def as_dict(self) -> Dict[str, List[str]]:
+        """Table -> column names, the shape the NL-to-SQL layer expects"""
+        return {name: info.column_names for name, info in self.user_tables.items()}
+
+@st.cache_resource(show_spinner=False)
+def get_schema_catalog(db_path: str) -> SchemaCatalog:
+    """Schema catalog shared by every session reading this database"""
+    return SchemaCatalog(get_connection_pool(db_path))
+
+class QueryResultCache:
+    """Process-wide LRU/TTL cache of query results keyed on normalized SQL.
+
+    Each entry remembers the versions of the tables its SQL reads from; an
+    entry is only served while none of those tables has been written since
+    (tracked by the connection pool), so results never go stale.
+    """
+
+    _LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+    _TABLE_RE = re.compile(r"\b(?:from|join)\s+([A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)?)", re.IGNORECASE)
+    _CACHEABLE_RE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+    def __init__(self, pool: SQLiteConnectionPool, max_entries: int = 256,
+                 max_bytes: int = 256 * 1024 * 1024, ttl_seconds: float = 900):
+        self.pool = pool
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def normalize_sql(cls, sql_query: str) -> str:
+        """Collapse whitespace outside string literals and drop a trailing semicolon"""
+        parts = cls._LITERAL_RE.split(sql_query.strip().rstrip(';').strip())
+        normalized = []
+        for i, part in enumerate(parts):
+            # Odd indexes are the captured literals
+            normalized.append(part if i % 2 else re.sub(r"\s+", " ", part))
+        return "".join(normalized).strip()
+
+    @classmethod
+    def is_cacheable(cls, sql_query: str) -> bool:
+        return bool(cls._CACHEABLE_RE.match(sql_query))
+
+    @classmethod
+    def referenced_tables(cls, sql_query: str) -> Optional[List[str]]:
+        """Tables named after FROM/JOIN, or None when they can't be determined"""
+        without_literals = cls._LITERAL_RE.sub("''", sql_query)
+        tables = sorted({name.split('.')[-1].lower() for name in cls._TABLE_RE.findall(without_literals)})
+        return tables or None
+
+    def version_for(self, sql_query: str) -> tuple:
+        """Snapshot of the data version this query depends on; take it before executing"""
+        return self.pool.data_version(self.referenced_tables(sql_query))
+
+    def _key(self, sql_query: str, params: tuple) -> str:
+        key = self.normalize_sql(sql_query)
+        return f"{key} -- {params!r}" if params else key
+
+    def get(self, sql_query: str, params: tuple = ()) -> Optional[pd.DataFrame]:
+        """Return a cached result if it is still valid"""
+        key = self._key(sql_query, params)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        expired = time.time() - entry['created_at'] > self.ttl_seconds
+        stale = not expired and self.pool.data_version(entry['tables']) != entry['version']
+        with self._lock:
+            if expired or stale:
+                if self._entries.get(key) is entry:
+                    self._remove(key)
+                if expired:
+                    self.expirations += 1
+                else:
+                    self.invalidations += 1
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return entry['df'].copy(deep=False)
+
+    def put(self, sql_query: str, result_df: pd.DataFrame, version: tuple, params: tuple = ()):
+        """Store a result computed against the given version snapshot"""
+        nbytes = int(result_df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes // 4:
+            return
+        key = self._key(sql_query, params)
+        entry = {
+            'df': result_df,
+            'tables': self.referenced_tables(sql_query),
+            'version': version,
+            'created_at': time.time(),
+            'nbytes': nbytes
+        }
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        # Caller must hold self._lock
+        entry = self._entries.pop(key)
+        self._bytes -= entry['nbytes']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Report hit/miss counters and current footprint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_query_result_cache(db_path: str) -> QueryResultCache:
+    """Result cache shared by every session reading this database"""
+    return QueryResultCache(get_connection_pool(db_path))
+
+@dataclass
+class QueryPlanReport:
+    sql: str
+    plan: List[str]
+    full_scans: List[str]  # tables read row by row without any index
+    suggestions: List[str]  # CREATE INDEX statements that would avoid those scans
+
+class IndexAdvisor:
+    """Creates the indexes the generated SQL relies on and watches for new scans.
+
+    Every distinct query shape (SQL with literals stripped) is run through
+    EXPLAIN QUERY PLAN once. Shapes that scan a table get an index
+    suggestion, and with ``auto_create`` enabled the suggestion is built once
+    the shape has been seen ``auto_create_after`` times.
+    """
+
+    # name -> (table, indexed expressions); the month expression must match the
+    # generated SQL exactly for SQLite to use it
+    DEFAULT_INDEXES = {
+        'idx_sales_date_amount': ('sales', "date, amount, customer_id"),
+        'idx_sales_customer_id': ('sales', "customer_id"),
+        'idx_sales_product_amount': ('sales', "product_name, amount"),
+        'idx_sales_customer_amount': ('sales', "customer_name, amount"),
+        'idx_sales_month_amount': ('sales', "strftime('%Y-%m', date), date, amount"),
+    }
+
+    _NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+    _CLAUSE_END = r"(?=\bgroup\s+by\b|\border\s+by\b|\blimit\b|\bhaving\b|$)"
+    _WHERE_RE = re.compile(r"\bwhere\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL)
+    _GROUP_RE = re.compile(r"\bgroup\s+by\b(.*?)(?=\border\s+by\b|\blimit\b|\bhaving\b|$)", re.IGNORECASE | re.DOTALL)
+    _PREDICATE_RE = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*(=|>=|<=|>|<|\bbetween\b|\bin\b)", re.IGNORECASE)
+    _AGGREGATE_RE = re.compile(r"\b(?:sum|avg|min|max|count|total)\s*\(\s*(?:distinct\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*\)", re.IGNORECASE)
+    _ALIAS_RE = re.compile(r"(strftime\s*\([^)]*\))\s+as\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+
+    def __init__(self, pool: SQLiteConnectionPool, catalog: SchemaCatalog,
+                 auto_create: bool = False, auto_create_after: int = 20):
+        self.pool = pool
+        self.catalog = catalog
+        self.auto_create = auto_create
+        self.auto_create_after = auto_create_after
+
+        self._lock = threading.Lock()
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self.created_indexes: List[str] = []
+
+    def ensure_default_indexes(self) -> List[str]:
+        """Create any missing default index; returns the names created"""
+        with self.pool.reader() as conn:
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        missing = [name for name in self.DEFAULT_INDEXES if name not in existing]
+        if missing:
+            with self.pool.writer() as conn:
+                for name in missing:
+                    table, columns = self.DEFAULT_INDEXES[name]
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+                # Refresh planner statistics for the new indexes
+                conn.execute("ANALYZE")
+        return missing
+
+    @classmethod
+    def query_shape(cls, sql_query: str) -> str:
+        """Normalized SQL with string and numeric literals replaced by ?"""
+        normalized = QueryResultCache.normalize_sql(sql_query)
+        return cls._NUMBER_RE.sub('?', QueryResultCache._LITERAL_RE.sub('?', normalized))
+
+    def explain(self, sql_query: str) -> QueryPlanReport:
+        """Run EXPLAIN QUERY PLAN and flag tables that are scanned without an index"""
+        with self.pool.reader() as conn:
+            # EXPLAIN doesn't open a read transaction, so it plans against whatever
+            # schema this connection last loaded: read sqlite_master to pick up new
+            # indexes, and key the text on the schema generation so sqlite3's
+            # statement cache can't replay an old plan
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            plan = [row[3] for row in conn.execute(
+                f"EXPLAIN QUERY PLAN /* schema {self.pool.schema_generation} */ {sql_query}"
+            )]
+        full_scans = []
+        for detail in plan:
+            match = re.match(r"SCAN (?:TABLE )?([A-Za-z_][A-Za-z0-9_]*)", detail)
+            if match and 'INDEX' not in detail:
+                full_scans.append(match.group(1))
+        suggestions = [ddl for table in full_scans for ddl in [self.suggest_index(sql_query, table)] if ddl]
+        return QueryPlanReport(sql=sql_query, plan=plan, full_scans=full_scans, suggestions=suggestions)
+
+    def suggest_index(self, sql_query: str, table: str) -> Optional[str]:
+        """Index for a single-table query: equality, range, group-by, then covered columns"""
+        if re.search(r"\bjoin\b", sql_query, re.IGNORECASE):
+            return None
+        info = self.catalog.table(table)
+        if info is None:
+            return None
+        columns = set(info.column_names)
+        without_literals = QueryResultCache._LITERAL_RE.sub("''", sql_query)
+
+        equality, ranges = [], []
+        where = self._WHERE_RE.search(without_literals)
+        if where:
+            for column, op in self._PREDICATE_RE.findall(where.group(1)):
+                if column in columns:
+                    (equality if op in ('=',) or op.lower() == 'in' else ranges).append(column)
+
+        grouping = []
+        group = self._GROUP_RE.search(sql_query)
+        if group:
+            aliases = {alias.lower(): expr for expr, alias in self._ALIAS_RE.findall(sql_query)}
+            for term in (t.strip() for t in group.group(1).split(',')):
+                term = aliases.get(term.lower(), term)
+                if term in columns or term.lower().startswith('strftime'):
+                    grouping.append(term)
+
+        if not (equality or ranges or grouping):
+            return None
+
+        # Equality columns, then one range column or the grouping terms, then
+        # the aggregated columns so the index covers the query
+        keys = equality + (ranges[:1] if ranges else grouping)
+        covered = [col for col in self._AGGREGATE_RE.findall(without_literals) if col in columns]
+        for term in grouping if ranges else []:
+            covered.append(term)
+        if any(term.lower().startswith('strftime') for term in keys) and 'date' in columns:
+            covered.insert(0, 'date')
+        ordered = []
+        for term in keys + covered:
+            if term not in ordered:
+                ordered.append(term)
+        digest = hashlib.sha1(",".join(ordered).encode('utf-8')).hexdigest()[:8]
+        return f"CREATE INDEX IF NOT EXISTS idx_auto_{table}_{digest} ON {table}({', '.join(ordered)})"
+
+    def observe(self, sql_query: str) -> Optional[QueryPlanReport]:
+        """Record one execution of a query shape, explaining it the first time it is seen"""
+        shape = self.query_shape(sql_query)
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is not None:
+                entry['count'] += 1
+        if entry is None:
+            try:
+                report = self.explain(sql_query)
+            except sqlite3.Error:
+                return None
+            with self._lock:
+                entry = self._shapes.setdefault(shape, {'count': 0, 'report': report})
+                entry['count'] += 1
+
+        report = entry['report']
+        if self.auto_create and report.suggestions and entry['count'] >= self.auto_create_after:
+            self.apply(report)
+        return report
+
+    def apply(self, report: QueryPlanReport):
+        """Create the suggested indexes and re-plan the query"""
+        with self._lock:
+            entry = self._shapes.get(self.query_shape(report.sql))
+            if entry is not None and not entry['report'].suggestions:
+                return
+        with self.pool.writer() as conn:
+            for ddl in report.suggestions:
+                conn.execute(ddl)
+                self.created_indexes.append(ddl)
+            conn.execute("ANALYZE")
+        new_report = self.explain(report.sql)
+        with self._lock:
+            if entry is not None:
+                entry['report'] = new_report
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Recurring query shapes with their scan flags and suggestions"""
+        with self._lock:
+            return [
+                {
+                    'shape': shape,
+                    'executions': entry['count'],
+                    'full_scans': ", ".join(entry['report'].full_scans),
+                    'suggestions': "; ".join(entry['report'].suggestions),
+                }
+                for shape, entry in sorted(self._shapes.items(), key=lambda item: -item[1]['count'])
+            ]
+
+@st.cache_resource(show_spinner=False)
+def get_index_advisor(db_path: str) -> IndexAdvisor:
+    """Index advisor shared by every session reading this database"""
+    return IndexAdvisor(get_connection_pool(db_path), get_schema_catalog(db_path),
+                        auto_create=os.environ.get('BI_CHATBOT_AUTO_INDEX', '0') == '1')
+
+def split_sql_list(text: str) -> List[str]:
+    """Split a comma-separated SQL list, ignoring commas inside parentheses or quotes"""
+    items, depth, quote, current = [], 0, None, []
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    items.append(''.join(current).strip())
+    return [item for item in items if item]
+
+@dataclass
+class AggregateQuery:
+    """A single-table aggregate in the shape the NL-to-SQL layer generates:
+
+        SELECT [dimension [AS alias],] AGG(col) [AS alias], ...
+        FROM table [WHERE date >= <date expr>] [GROUP BY dimension]
+        [ORDER BY output [ASC|DESC]] [LIMIT n]
+
+    ``dimension`` is a column name, MONTH for the strftime('%Y-%m', date)
+    bucket, or None for a grand total.
+    """
+
+    MONTH = "strftime('%Y-%m', date)"
+
+    table: str
+    dimension: Optional[str]
+    dimension_alias: Optional[str]
+    aggregates: List[Tuple[str, str, str]]  # (function, column or '*' or 'DISTINCT col', output name)
+    date_from: Optional[str] = None
+    order_by: Optional[str] = None
+    descending: bool = False
+    limit: Optional[int] = None
+
+    _QUERY_RE = re.compile(
+        r"^select\s+(?P<select>.+?)\s+from\s+(?P<table>[A-Za-z_][A-Za-z0-9_]*)"
+        r"(?:\s+where\s+date\s*>=\s*(?P<date_from>date\(\s*'[^']*'(?:\s*,\s*'[^']*')*\s*\)|'\d{4}-\d{2}-\d{2}'|"
+        + re.escape(IntentEngine.QUARTER_START) + r"))?"
+        r"(?:\s+group\s+by\s+(?P<group>[A-Za-z_][A-Za-z0-9_]*|strftime\('%Y-%m',\s*date\)))?"
+        r"(?:\s+order\s+by\s+(?P<order>[A-Za-z_][A-Za-z0-9_]*)(?:\s+(?P<direction>asc|desc))?)?"
+        r"(?:\s+limit\s+(?P<limit>\d+))?$",
+        re.IGNORECASE | re.DOTALL
+    )
+    _AGGREGATE_RE = re.compile(
+        r"^(?P<func>sum|count|avg|min|max)\s*\(\s*(?P<arg>\*|(?:distinct\s+)?[A-Za-z_][A-Za-z0-9_]*)\s*\)"
+        r"(?:\s+as\s+(?P<alias>[A-Za-z_][A-Za-z0-9_]*))?$",
+        re.IGNORECASE
+    )
+    _DIMENSION_RE = re.compile(
+        r"^(?P<expr>[A-Za-z_][A-Za-z0-9_]*|strftime\('%Y-%m',\s*date\))(?:\s+as\s+(?P<alias>[A-Za-z_][A-Za-z0-9_]*))?$",
+        re.IGNORECASE
+    )
+
+    @classmethod
+    def parse(cls, sql_query: str) -> Optional['AggregateQuery']:
+        """Parse generated SQL, or return None for anything outside the supported shape"""
+        match = cls._QUERY_RE.match(QueryResultCache.normalize_sql(sql_query))
+        if not match:
+            return None
+
+        dimension, dimension_alias, aggregates = None, None, []
+        for item in split_sql_list(match.group('select')):
+            aggregate = cls._AGGREGATE_RE.match(item)
+            if aggregate:
+                arg = re.sub(r"\s+", " ", aggregate.group('arg'))
+                if arg.lower().startswith('distinct '):
+                    arg = 'DISTINCT ' + arg[9:]
+                aggregates.append((aggregate.group('func').upper(), arg, aggregate.group('alias') or item))
+                continue
+            dim = cls._DIMENSION_RE.match(item)
+            if not dim or dimension is not None:
+                return None
+            expr = dim.group('expr')
+            dimension = cls.MONTH if expr.lower().startswith('strftime') else expr
+            dimension_alias = dim.group('alias')
+
+        group = match.group('group')
+        if dimension is None and group is not None or not aggregates:
+            return None
+        if dimension is not None:
+            group_matches = group is not None and (
+                group == dimension_alias
+                or group == dimension
+                or (dimension == cls.MONTH and group.lower().startswith('strftime'))
+            )
+            if not group_matches:
+                return None
+
+        return cls(
+            table=match.group('table'),
+            dimension=dimension,
+            dimension_alias=dimension_alias,
+            aggregates=aggregates,
+            date_from=match.group('date_from'),
+            order_by=match.group('order'),
+            descending=(match.group('direction') or '').lower() == 'desc',
+            limit=int(match.group('limit')) if match.group('limit') else None
+        )
+
+    @property
+    def dimension_output(self) -> Optional[str]:
+        """Column name the dimension has in the result"""
+        if self.dimension is None:
+            return None
+        return self.dimension_alias or self.dimension
+
+    @property
+    def output_names(self) -> List[str]:
+        names = [self.dimension_output] if self.dimension is not None else []
+        return names + [alias for _, _, alias in self.aggregates]
+
+    def to_sql(self, predicates: Optional[List[str]] = None) -> str:
+        """Render back to SQL, ANDing extra WHERE predicates onto the date filter"""
+        select = []
+        if self.dimension is not None:
+            select.append(self.dimension + (f" as {self.dimension_alias}" if self.dimension_alias else ''))
+        for func, arg, alias in self.aggregates:
+            expression = f"{func}({arg})"
+            if alias != expression:
+                alias = alias if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", alias) else quote_identifier(alias)
+                expression += f" as {alias}"
+            select.append(expression)
+        where = ([f"date >= {self.date_from}"] if self.date_from else []) + list(predicates or [])
+
+        sql = f"SELECT {', '.join(select)} FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if self.dimension is not None:
+            sql += f" GROUP BY {self.dimension_output}"
+        if self.order_by:
+            sql += f" ORDER BY {self.order_by}{' DESC' if self.descending else ''}"
+        if self.limit is not None:
+            sql += f" LIMIT {self.limit}"
+        return sql
+
+class RollupManager:
+    """Materialized daily/monthly sales rollups, refreshed incrementally.
+
+    ``sales_rollup`` holds one row per (grain, dimension, key, bucket) with
+    revenue, quantity and order counts. New sales rows are folded in using a
+    high-water mark on ``sales.id``, so a refresh only reads the rows added
+    since the last one. ``sales`` is treated as append-only: call rebuild()
+    after updating or deleting existing rows.
+
+    route() rewrites generated aggregate SQL to read the rollup, so the
+    query cost depends on the number of buckets rather than the number of
+    sales rows.
+    """
+
+    DIMENSIONS = ['all', 'product_name', 'category', 'region', 'sales_rep', 'customer_name', 'customer_id']
+    # Rollup keys are stored as text; restore the source column's type on the way out
+    KEY_CASTS = {'customer_id': "CAST(NULLIF(key, '') AS INTEGER)"}
+    # (aggregate function, argument) -> expression over the rollup columns
+    MEASURES = {
+        ('SUM', 'amount'): "SUM(revenue)",
+        ('SUM', 'quantity'): "SUM(quantity)",
+        ('COUNT', '*'): "SUM(orders)",
+        ('COUNT', 'amount'): "SUM(amount_rows)",
+        ('AVG', 'amount'): "SUM(revenue) / NULLIF(SUM(amount_rows), 0)",
+    }
+    # Additive summary of every sales column the rollups read: if an id range still has
+    # the same shape after an external change, its rows were not edited in place
+    SHAPE_TERMS = [
+        "COUNT(*)", "COUNT(amount)", "TOTAL(amount)", "TOTAL(quantity)", "TOTAL(customer_id)",
+        # Days since 2000-01-01 keep the sum small enough for a one-day shift to register
+        "TOTAL(julianday(date) - 2451545)",
+    ] + [f"TOTAL(LENGTH({dimension}))" for dimension in ('product_name', 'category', 'region', 'sales_rep', 'customer_name')]
+
+    def __init__(self, pool: SQLiteConnectionPool):
+        self.pool = pool
+        self._refresh_lock = threading.Lock()
+        self._synced_version: Optional[tuple] = None
+        self._synced_max_id: Optional[int] = None
+        # SHAPE_TERMS over the sales rows folded so far
+        self._synced_shape: Optional[Tuple[float, ...]] = None
+        self.routed_queries = 0
+        self.rows_folded = 0
+        self.ensure_tables()
+
+    def ensure_tables(self):
+        with self.pool.reader() as conn:
+            exists = conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ('sales_rollup', 'rollup_state')"
+            ).fetchone()[0] == 2
+        if exists:
+            return
+        with self.pool.writer() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sales_rollup (
+                    grain TEXT NOT NULL,
+                    dimension TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    quantity INTEGER NOT NULL DEFAULT 0,
+                    orders INTEGER NOT NULL DEFAULT 0,
+                    amount_rows INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (grain, dimension, key, bucket)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_state (
+                    name TEXT PRIMARY KEY,
+                    high_water_id INTEGER NOT NULL
+                )
+            ''')
+
+    def _max_sales_id(self) -> int:
+        with self.pool.reader() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+
+    def _shape(self, after_id: int = 0, upto_id: Optional[int] = None) -> Tuple[float, ...]:
+        """SHAPE_TERMS over the sales rows with after_id < id <= upto_id"""
+        with self.pool.reader() as conn:
+            return tuple(conn.execute(
+                f"SELECT {', '.join(self.SHAPE_TERMS)} FROM sales WHERE id > ? AND id <= ?",
+                (after_id, upto_id if upto_id is not None else sys.maxsize)
+            ).fetchone())
+
+    def _changed_in_place(self, version: tuple, max_id: int) -> bool:
+        """Whether rows at or below the high-water mark were updated or deleted"""
+        epoch, sales_writes = version
+        synced_epoch, synced_writes = self._synced_version
+        # Our own writes to sales that added no ids (or removed some) must have touched existing rows
+        if sales_writes != synced_writes and max_id <= self._synced_max_id:
+            return True
+        if epoch == synced_epoch:
+            return False
+        # The epoch also moves for attached sources and other processes' commits to
+        # any table; only a different shape of the folded id range means sales changed
+        # Tight tolerance: a one-day date shift must stand out from rounding in the running sums
+        return not all(math.isclose(current, synced, rel_tol=1e-12, abs_tol=1e-6)
+                       for current, synced in zip(self._shape(0, self._synced_max_id), self._synced_shape))
+
+    def refresh(self) -> int:
+        """Fold sales rows added since the last refresh; returns the number of rows folded"""
+        with self._refresh_lock:
+            version = self.pool.data_version(['sales'])
+            max_id = self._max_sales_id()
+            if version == self._synced_version and max_id == self._synced_max_id:
+                return 0
+            if self._synced_version is not None and self._changed_in_place(version, max_id):
+                return self._rebuild_synced()
+            folded = self._fold_new_rows(max_id)
+            if self._synced_shape is None:
+                self._synced_shape = self._shape(0, max_id)
+            else:
+                delta = self._shape(self._synced_max_id, max_id)
+                self._synced_shape = tuple(synced + added for synced, added in zip(self._synced_shape, delta))
+            self._synced_version = version
+            self._synced_max_id = max_id
+            return folded
+
+    def rebuild(self) -> int:
+        """Drop and recompute every rollup bucket"""
+        with self._refresh_lock:
+            return self._rebuild_synced()
+
+    def _rebuild_synced(self) -> int:
+        # Caller must hold self._refresh_lock
+        version = self.pool.data_version(['sales'])
+        folded = self._rebuild_locked()
+        self._synced_version = version
+        self._synced_max_id = self._max_sales_id()
+        self._synced_shape = self._shape(0, self._synced_max_id)
+        return folded
+
+    def _rebuild_locked(self) -> int:
+        with self.pool.writer() as conn:
+            conn.execute("DELETE FROM sales_rollup")
+            conn.execute("DELETE FROM rollup_state WHERE name = 'sales'")
+        return self._fold_new_rows(self._max_sales_id())
+
+    def _fold_new_rows(self, max_id: int) -> int:
+        with self.pool.writer() as conn:
+            row = conn.execute("SELECT high_water_id FROM rollup_state WHERE name = 'sales'").fetchone()
+            high_water_id = row[0] if row else 0
+            if max_id <= high_water_id:
+                return 0
+
+            # Aggregate the new rows per day once, then upsert both grains from that
+            conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS rollup_delta (
+                    dimension TEXT, key TEXT, bucket TEXT,
+                    revenue REAL, quantity INTEGER, orders INTEGER, amount_rows INTEGER
+                )
+            ''')
+            conn.execute("DELETE FROM temp.rollup_delta")
+            for dimension in self.DIMENSIONS:
+                key_expr = "''" if dimension == 'all' else f"COALESCE({dimension}, '')"
+                conn.execute(f'''
+                    INSERT INTO temp.rollup_delta
+                    SELECT ?, {key_expr}, substr(date, 1, 10),
+                           COALESCE(SUM(amount), 0), COALESCE(SUM(quantity), 0), COUNT(*), COUNT(amount)
+                    FROM sales WHERE id > ? AND id <= ?
+                    GROUP BY 2, 3
+                ''', (dimension, high_water_id, max_id))
+
+            for grain, bucket_expr in (('day', 'bucket'), ('month', 'substr(bucket, 1, 7)')):
+                conn.execute(f'''
+                    INSERT INTO sales_rollup (grain, dimension, key, bucket, revenue, quantity, orders, amount_rows)
+                    SELECT ?, dimension, key, {bucket_expr},
+                           SUM(revenue), SUM(quantity), SUM(orders), SUM(amount_rows)
+                    FROM temp.rollup_delta WHERE true
+                    GROUP BY dimension, key, {bucket_expr}
+                    ON CONFLICT (grain, dimension, key, bucket) DO UPDATE SET
+                        revenue = revenue + excluded.revenue,
+                        quantity = quantity + excluded.quantity,
+                        orders = orders + excluded.orders,
+                        amount_rows = amount_rows + excluded.amount_rows
+                ''', (grain,))
+
+            folded = conn.execute(
+                "SELECT COALESCE(SUM(orders), 0) FROM temp.rollup_delta WHERE dimension = 'all'"
+            ).fetchone()[0]
+            conn.execute("DELETE FROM temp.rollup_delta")
+            conn.execute(
+                "INSERT INTO rollup_state (name, high_water_id) VALUES ('sales', ?) "
+                "ON CONFLICT (name) DO UPDATE SET high_water_id = excluded.high_water_id",
+                (max_id,)
+            )
+        self.rows_folded += folded
+        return folded
+
+    def rewrite(self, query: AggregateQuery) -> Optional[str]:
+        """SQL over sales_rollup equivalent to the parsed query, or None if it can't answer it"""
+        if query.table.lower() != 'sales':
+            return None
+
+        distinct_dimension = None
+        measures = []
+        for func, arg, alias in query.aggregates:
+            if func == 'COUNT' and arg.startswith('DISTINCT '):
+                column = arg[len('DISTINCT '):]
+                if query.dimension is not None or column not in self.DIMENSIONS[1:]:
+                    return None
+                distinct_dimension = column
+                expr = "COUNT(DISTINCT NULLIF(key, ''))"
+            else:
+                expr = self.MEASURES.get((func, arg))
+                if expr is None:
+                    return None
+            measures.append(f"{expr} AS {quote_identifier(alias)}")
+
+        # Grain: days when filtering by date, months otherwise (fewer buckets)
+        grain = 'day' if query.date_from else 'month'
+        select, group_by = [], None
+        if query.dimension == AggregateQuery.MONTH:
+            dimension = 'all'
+            bucket = 'bucket' if grain == 'month' else 'substr(bucket, 1, 7)'
+            select.append(f"{bucket} AS {quote_identifier(query.dimension_output)}")
+            group_by = bucket
+        elif query.dimension is not None:
+            if query.dimension not in self.DIMENSIONS[1:]:
+                return None
+            dimension = query.dimension
+            key = self.KEY_CASTS.get(dimension, "NULLIF(key, '')")
+            select.append(f"{key} AS {quote_identifier(query.dimension_output)}")
+            group_by = 'key'
+        else:
+            dimension = distinct_dimension or 'all'
+        if distinct_dimension and len(query.aggregates) > 1:
+            return None
+
+        if query.order_by is not None and query.order_by not in query.output_names:
+            return None
+
+        sql = f"SELECT {', '.join(select + measures)} FROM sales_rollup WHERE grain = '{grain}' AND dimension = '{dimension}'"
+        if query.date_from:
+            sql += f" AND bucket >= {query.date_from}"
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        if query.order_by:
+            sql += f" ORDER BY {quote_identifier(query.order_by)}{' DESC' if query.descending else ''}"
+        if query.limit is not None:
+            sql += f" LIMIT {query.limit}"
+        return sql
+
+    def route(self, sql_query: str) -> Optional[str]:
+        """Rewrite generated SQL onto the rollup (bringing it up to date first), if possible"""
+        query = AggregateQuery.parse(sql_query)
+        if query is None:
+            return None
+        rewritten = self.rewrite(query)
+        if rewritten is None:
+            return None
+        self.refresh()
+        self.routed_queries += 1
+        return rewritten
+
+    def stats(self) -> Dict[str, Any]:
+        with self.pool.reader() as conn:
+            buckets = conn.execute("SELECT COUNT(*) FROM sales_rollup").fetchone()[0]
+        return {
+            'buckets': buckets,
+            'high_water_id': self._synced_max_id,
+            'rows_folded': self.rows_folded,
+            'routed_queries': self.routed_queries,
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_rollup_manager(db_path: str) -> RollupManager:
+    """Rollup manager shared by every session reading this database"""
+    return RollupManager(get_connection_pool(db_path))
+
+@dataclass
+class Alert:
+    """A day whose revenue for one product, region or rep moved away from its baseline"""
+    dimension: str
+    key: str
+    day: str
+    value: float
+    baseline: float
+    change_pct: float
+    zscore: float
+    partial_day: bool = False
+    fired_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec='seconds'))
+
+    @property
+    def message(self) -> str:
+        direction = "up" if self.change_pct > 0 else "down"
+        label = {'product_name': 'product', 'sales_rep': 'sales rep'}.get(self.dimension, self.dimension)
+        partial = " so far" if self.partial_day else ""
+        return (f"Revenue for {label} '{self.key}' on {self.day}{partial} is {direction} "
+                f"{abs(self.change_pct):.0f}% vs. its recent average (${self.value:,.2f} vs ${self.baseline:,.2f}, "
+                f"z={self.zscore:+.1f})")
+
+class AlertSink:
+    """Destination for fired alerts"""
+
+    name = 'sink'
+
+    def send(self, alerts: List[Alert]):
+        raise NotImplementedError
+
+class FileAlertSink(AlertSink):
+    """Appends alerts to a JSONL file"""
+
+    name = 'file'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, alerts: List[Alert]):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as log:
+            for alert in alerts:
+                log.write(json.dumps({**asdict(alert), 'message': alert.message}) + '\n')
+
+class WebhookAlertSink(AlertSink):
+    """POSTs each batch as JSON; the ``text`` field makes it a valid Slack incoming-webhook payload"""
+
+    name = 'webhook'
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alerts: List[Alert]):
+        from urllib.request import Request, urlopen
+
+        payload = {
+            'text': "\n".join(f"🔔 {alert.message}" for alert in alerts),
+            'alerts': [asdict(alert) for alert in alerts],
+        }
+        request = Request(self.url, data=json.dumps(payload).encode('utf-8'),
+                          headers={'Content-Type': 'application/json'}, method='POST')
+        with urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+@dataclass
+class AlertBaseline:
+    """EWMA state of daily revenue for one (dimension, key)"""
+    dimension: str
+    key: str
+    mean: float = 0.0
+    var: float = 0.0
+    days: int = 0
+    last_day: Optional[str] = None  # last day folded into the EWMA
+    open_day: Optional[str] = None  # latest day seen, still accumulating
+    open_total: float = 0.0
+    alerted_day: Optional[str] = None
+
+class AlertEngine:
+    """Anomaly alerts on daily revenue per product, region and sales rep.
+
+    Each (dimension, key) keeps an exponentially weighted mean and variance
+    of its daily revenue. Evaluation reads only the sales rows added since a
+    high-water mark on ``sales.id``, so its cost follows new rows rather
+    than table size. A day is folded into the baseline once a later day has
+    sales anywhere (days with no sales for a key count as zero). An alert
+    fires when a completed day differs from the baseline by at least
+    ``threshold_pct`` percent and ``min_zscore`` standard deviations; the
+    still-open latest day can only grow, so it is checked for spikes only.
+    The first evaluation backfills history without alerting. Alerts go to
+    every configured sink; ``start()`` runs evaluations on a daemon thread.
+    """
+
+    DIMENSIONS = ['product_name', 'region', 'sales_rep']
+
+    def __init__(self, pool: SQLiteConnectionPool, sinks: Optional[List[AlertSink]] = None,
+                 threshold_pct: float = 20.0, min_zscore: float = 2.0, alpha: float = 0.2,
+                 warmup_days: int = 14, interval: float = 60.0, max_recent: int = 200):
+        self.pool = pool
+        self.sinks = list(sinks or [])
+        self.threshold_pct = threshold_pct
+        self.min_zscore = min_zscore
+        self.alpha = alpha
+        self.warmup_days = warmup_days
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._eval_lock = threading.Lock()
+        self._baselines: Optional[Dict[Tuple[str, str], AlertBaseline]] = None
+        self._high_water_id = 0
+        self._recent: deque = deque(maxlen=max_recent)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.evaluations = 0
+        self.rows_processed = 0
+        self.alerts_fired = 0
+        self.sink_errors = 0
+        self.last_evaluated: Optional[str] = None
+        self.ensure_tables()
+
+    def ensure_tables(self):
+        with self.pool.writer() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS alert_baselines (
+                    dimension TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    mean REAL NOT NULL,
+                    var REAL NOT NULL,
+                    days INTEGER NOT NULL,
+                    last_day TEXT,
+                    open_day TEXT,
+                    open_total REAL NOT NULL,
+                    alerted_day TEXT,
+                    PRIMARY KEY (dimension, key)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS alert_state (
+                    name TEXT PRIMARY KEY,
+                    high_water_id INTEGER NOT NULL
+                )
+            ''')
+
+    # -- configuration -----------------------------------------------------
+
+    @property
+    def webhook_url(self) -> Optional[str]:
+        for sink in self.sinks:
+            if isinstance(sink, WebhookAlertSink):
+                return sink.url
+        return None
+
+    def configure(self, threshold_pct: Optional[float] = None, webhook_url: Optional[str] = None):
+        """Update the threshold and replace (or remove, with an empty URL) the webhook sink"""
+        with self._lock:
+            if threshold_pct is not None:
+                self.threshold_pct = float(threshold_pct)
+            if webhook_url is not None and webhook_url != self.webhook_url:
+                self.sinks = [sink for sink in self.sinks if not isinstance(sink, WebhookAlertSink)]
+                if webhook_url:
+                    self.sinks.append(WebhookAlertSink(webhook_url))
+
+    # -- scheduling --------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self):
+        if self.running:
+            return
+        if self._thread is not None:
+            # A stopped thread may still be finishing its last evaluation
+            self._thread.join()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='bi-alerts', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.evaluate()
+            except Exception:
+                logger.exception("Alert evaluation failed")
+            self._stop.wait(self.interval)
+
+    # -- evaluation --------------------------------------------------------
+
+    def _load(self):
+        # Caller must hold self._eval_lock
+        with self.pool.reader() as conn:
+            row = conn.execute("SELECT high_water_id FROM alert_state WHERE name = 'sales'").fetchone()
+            rows = conn.execute(
+                "SELECT dimension, key, mean, var, days, last_day, open_day, open_total, alerted_day FROM alert_baselines"
+            ).fetchall()
+        self._high_water_id = row[0] if row else 0
+        self._baselines = {(r[0], r[1]): AlertBaseline(*r) for r in rows}
+
+    def _check(self, baseline: AlertBaseline, day: str, value: float, partial: bool) -> Optional[Alert]:
+        if baseline.days < self.warmup_days or baseline.mean <= 0 or baseline.alerted_day == day:
+            return None
+        change_pct = (value - baseline.mean) / baseline.mean * 100
+        std = math.sqrt(baseline.var)
+        zscore = (value - baseline.mean) / std if std > 0 else 0.0
+        if partial and change_pct <= 0:
+            return None
+        if abs(change_pct) < self.threshold_pct or abs(zscore) < self.min_zscore:
+            return None
+        baseline.alerted_day = day
+        return Alert(baseline.dimension, baseline.key, day, round(value, 2), round(baseline.mean, 2),
+                     round(change_pct, 1), round(zscore, 2), partial_day=partial)
+
+    def _fold(self, baseline: AlertBaseline, day: str, value: float, emit: bool) -> Optional[Alert]:
+        """Close one day: check it against the baseline, then update the EWMA"""
+        alert = self._check(baseline, day, value, partial=False) if emit else None
+        if baseline.days == 0:
+            baseline.mean, baseline.var = value, 0.0
+        else:
+            diff = value - baseline.mean
+            increment = self.alpha * diff
+            baseline.mean += increment
+            baseline.var = (1 - self.alpha) * (baseline.var + diff * increment)
+        baseline.days += 1
+        baseline.last_day = day
+        return alert
+
+    def _close_until(self, baseline: AlertBaseline, until: date, emit: bool) -> Optional[Alert]:
+        """Fold the open day and zero-revenue days up to (not including) ``until``"""
+        alert = None
+        if baseline.open_day is None:
+            return None
+        current = date.fromisoformat(baseline.open_day)
+        value = baseline.open_total
+        while current < until:
+            alert = self._fold(baseline, current.isoformat(), value, emit) or alert
+            current += timedelta(days=1)
+            value = 0.0
+        baseline.open_day, baseline.open_total = current.isoformat(), 0.0
+        return alert
+
+    def evaluate(self) -> List[Alert]:
+        """Fold new sales into the baselines and fire alerts for unusual days"""
+        with self._eval_lock:
+            if self._baselines is None:
+                self._load()
+            with self.pool.reader() as conn:
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+            if max_id < self._high_water_id:
+                # sales was rebuilt: start over
+                self._high_water_id, self._baselines = 0, {}
+            backfill = self._high_water_id == 0
+            alerts: Dict[Tuple[str, str], Alert] = {}
+            changed = set()
+
+            if max_id > self._high_water_id:
+                with self.pool.reader() as conn:
+                    new_rows = pd.read_sql_query(
+                        f"SELECT substr(date, 1, 10) AS day, {', '.join(self.DIMENSIONS)}, "
+                        "COALESCE(SUM(amount), 0) AS revenue FROM sales WHERE id > ? AND id <= ? "
+                        f"GROUP BY 1, {', '.join(str(i + 2) for i in range(len(self.DIMENSIONS)))}",
+                        conn, params=(self._high_water_id, max_id)
+                    )
+                new_rows = new_rows[pd.to_datetime(new_rows['day'], format='%Y-%m-%d', errors='coerce').notna()]
+                latest_day = new_rows['day'].max() if len(new_rows) else None
+
+                for dimension in self.DIMENSIONS:
+                    daily = new_rows.groupby([dimension, 'day'], sort=True)['revenue'].sum()
+                    for (key, day), revenue in daily.items():
+                        identity = (dimension, str(key))
+                        baseline = self._baselines.setdefault(identity, AlertBaseline(dimension, str(key)))
+                        changed.add(identity)
+                        if baseline.open_day is None or day > baseline.open_day:
+                            if baseline.open_day is not None:
+                                alert = self._close_until(baseline, date.fromisoformat(day), emit=not backfill)
+                                if alert is not None:
+                                    alerts[identity] = alert
+                            baseline.open_day, baseline.open_total = day, float(revenue)
+                        elif day == baseline.open_day:
+                            baseline.open_total += float(revenue)
+                        # Rows for days already folded are late; the EWMA can't take them back
+
+                # Keys with no sales on the latest day still close their earlier days
+                if latest_day is not None:
+                    until = date.fromisoformat(latest_day)
+                    for identity, baseline in self._baselines.items():
+                        if baseline.open_day is not None and baseline.open_day < latest_day:
+                            alert = self._close_until(baseline, until, emit=not backfill)
+                            changed.add(identity)
+                            if alert is not None:
+                                alerts[identity] = alert
+
+                if not backfill:
+                    for identity in changed:
+                        baseline = self._baselines[identity]
+                        alert = self._check(baseline, baseline.open_day, baseline.open_total, partial=True)
+                        if alert is not None:
+                            alerts[identity] = alert
+
+                self._persist(changed, max_id)
+                self.rows_processed += int(len(new_rows))
+
+            self.evaluations += 1
+            self.last_evaluated = datetime.now().isoformat(timespec='seconds')
+
+        fired = sorted(alerts.values(), key=lambda alert: abs(alert.change_pct), reverse=True)
+        if fired:
+            self._dispatch(fired)
+        return fired
+
+    def _persist(self, identities: set, high_water_id: int):
+        with self.pool.writer() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO alert_baselines
+                    (dimension, key, mean, var, days, last_day, open_day, open_total, alerted_day)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [tuple(asdict(self._baselines[identity]).values()) for identity in identities])
+            conn.execute(
+                "INSERT INTO alert_state (name, high_water_id) VALUES ('sales', ?) "
+                "ON CONFLICT (name) DO UPDATE SET high_water_id = excluded.high_water_id",
+                (high_water_id,)
+            )
+        self._high_water_id = high_water_id
+
+    def _dispatch(self, alerts: List[Alert]):
+        with self._lock:
+            self._recent.extend(alerts)
+            self.alerts_fired += len(alerts)
+            sinks = list(self.sinks)
+        for sink in sinks:
+            try:
+                sink.send(alerts)
+            except Exception as exc:
+                self.sink_errors += 1
+                logger.warning("Alert sink %s failed: %s", sink.name, exc)
+
+    # -- reporting ---------------------------------------------------------
+
+    def recent_alerts(self, limit: int = 20) -> List[Alert]:
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self.running, 'threshold_pct': self.threshold_pct, 'interval_s': self.interval,
+            'tracked_keys': len(self._baselines or {}), 'high_water_id': self._high_water_id,
+            'evaluations': self.evaluations, 'rows_processed': self.rows_processed,
+            'alerts_fired': self.alerts_fired, 'sink_errors': self.sink_errors,
+            'sinks': [sink.name for sink in self.sinks], 'last_evaluated': self.last_evaluated,
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_alert_engine(db_path: str) -> AlertEngine:
+    """Alert engine shared by every session; BI_CHATBOT_ALERTS=1 starts it with the app"""
+    sinks: List[AlertSink] = [FileAlertSink(os.path.join(cache_directory(db_path), 'alerts.jsonl'))]
+    webhook_url = os.environ.get('BI_CHATBOT_ALERT_WEBHOOK')
+    if webhook_url:
+        sinks.append(WebhookAlertSink(webhook_url))
+    engine = AlertEngine(
+        get_connection_pool(db_path), sinks=sinks,
+        threshold_pct=float(os.environ.get('BI_CHATBOT_ALERT_THRESHOLD', '20')),
+        interval=float(os.environ.get('BI_CHATBOT_ALERT_INTERVAL', '60'))
+    )
+    if os.environ.get('BI_CHATBOT_ALERTS') == '1':
+        engine.start()
+    return engine
+
+class ColumnarTable:
+    """One SQLite table mirrored as memory-mapped NumPy column files.
+
+    Numeric columns are stored as float64 (NaN for NULL). Text columns are
+    dictionary-encoded to int32 codes, with code 0 reserved for NULL. Rows
+    are appended in rowid order from a high-water mark, so like the rollups
+    the mirror assumes the table is append-only; rebuild() resyncs after
+    updates or deletes.
+    """
+
+    def __init__(self, pool: SQLiteConnectionPool, table: str, directory: str, batch_rows: int = 200000):
+        self.pool = pool
+        self.table = table
+        self.directory = directory
+        self.batch_rows = batch_rows
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()  # Guards the published state (rows, arrays, dictionaries)
+        self._sync_lock = threading.Lock()
+        self._synced_version: Optional[tuple] = None
+        self._arrays: Dict[str, np.ndarray] = {}
+        self.columns: Dict[str, Dict[str, str]] = {}  # name -> {'kind': 'number'|'text', 'affinity': ...}
+        self.dictionaries: Dict[str, List[Optional[str]]] = {}
+        self._codes: Dict[str, Dict[Optional[str], int]] = {}
+        self.rows = 0
+        self.high_water_rowid = 0
+        self._load_meta()
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, 'meta.json')
+
+    def _column_path(self, name: str) -> str:
+        kind = self.columns[name]['kind']
+        return os.path.join(self.directory, f"{hashlib.sha1(name.encode()).hexdigest()[:12]}.{'i32' if kind == 'text' else 'f64'}")
+
+    def _dtype(self, name: str):
+        return np.int32 if self.columns[name]['kind'] == 'text' else np.float64
+
+    def _source_columns(self) -> Dict[str, Dict[str, str]]:
+        with self.pool.reader() as conn:
+            info = conn.execute(f"PRAGMA table_info({quote_identifier(self.table)})").fetchall()
+        columns = {}
+        for row in info:
+            affinity = column_affinity(row[2])
+            if affinity == 'BLOB':
+                continue
+            columns[row[1]] = {'kind': 'text' if affinity == 'TEXT' else 'number', 'affinity': affinity}
+        return columns
+
+    def _load_meta(self):
+        if not os.path.exists(self._meta_path):
+            return
+        try:
+            with open(self._meta_path) as handle:
+                meta = json.load(handle)
+            self.columns = meta['columns']
+            self.dictionaries = meta['dictionaries']
+            self.rows = meta['rows']
+            self.high_water_rowid = meta['high_water_rowid']
+            for name in self.columns:
+                expected = self.rows * np.dtype(self._dtype(name)).itemsize
+                if not os.path.exists(self._column_path(name)) or os.path.getsize(self._column_path(name)) != expected:
+                    raise ValueError(f"column file for {name} is incomplete")
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Discarding columnar mirror of %s: %s", self.table, exc)
+            self._reset(self.columns or {})
+            return
+        self._codes = {name: {value: code for code, value in enumerate(values)}
+                       for name, values in self.dictionaries.items()}
+        self._map_arrays()
+
+    def _save_meta(self):
+        temp_path = self._meta_path + '.tmp'
+        with open(temp_path, 'w') as handle:
+            json.dump({'table': self.table, 'columns': self.columns, 'dictionaries': self.dictionaries,
+                       'rows': self.rows, 'high_water_rowid': self.high_water_rowid}, handle)
+        os.replace(temp_path, self._meta_path)
+
+    def _reset(self, columns: Dict[str, Dict[str, str]]):
+        for name in os.listdir(self.directory):
+            if name.endswith(('.i32', '.f64', '.json')):
+                os.remove(os.path.join(self.directory, name))
+        self.columns = columns
+        self.dictionaries = {name: [None] for name, spec in columns.items() if spec['kind'] == 'text'}
+        self._codes = {name: {None: 0} for name in self.dictionaries}
+        self.rows = 0
+        self.high_water_rowid = 0
+        self._arrays = {}
+
+    def _map_arrays(self):
+        self._arrays = {
+            name: (np.memmap(self._column_path(name), dtype=self._dtype(name), mode='r', shape=(self.rows,))
+                   if self.rows else np.empty(0, dtype=self._dtype(name)))
+            for name in self.columns
+        }
+
+    def _encode(self, name: str, values: pd.Series) -> np.ndarray:
+        """Dictionary-encode a text chunk, extending the dictionary with new values"""
+        inverse, uniques = pd.factorize(values, use_na_sentinel=True)
+        codes_for_uniques = np.empty(len(uniques) + 1, dtype=np.int32)
+        codes_for_uniques[-1] = 0  # factorize's -1 (NULL) indexes the last slot
+        dictionary, codes = self.dictionaries[name], self._codes[name]
+        for index, value in enumerate(uniques):
+            value = str(value)
+            code = codes.get(value)
+            if code is None:
+                code = len(dictionary)
+                dictionary.append(value)
+                codes[value] = code
+            codes_for_uniques[index] = code
+        return codes_for_uniques[inverse]
+
+    def sync(self, blocking: bool = True) -> Optional[int]:
+        """Append rows added since the last sync (rebuilding if rows changed in place).
+
+        Returns the number of rows added, or None when ``blocking`` is False and
+        another thread is already syncing.
+        """
+        if not self._sync_lock.acquire(blocking=blocking):
+            return None
+        try:
+            version = self.pool.data_version([self.table])
+            if version == self._synced_version:
+                return 0
+            columns = self._source_columns()
+            with self.pool.reader() as conn:
+                max_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {quote_identifier(self.table)}").fetchone()[0]
+            changed_in_place = self._synced_version is not None and columns == self.columns \
+                and self._changed_in_place(version, max_rowid)
+            if columns != self.columns or changed_in_place or max_rowid < self.high_water_rowid:
+                with self._lock:
+                    self._reset(columns)
+
+            rows, high_water_rowid = self.rows, self.high_water_rowid
+            select = ', '.join(quote_identifier(name) for name in self.columns)
+            try:
+                while high_water_rowid < max_rowid:
+                    with self.pool.reader() as conn:
+                        chunk = pd.read_sql_query(
+                            f"SELECT rowid AS __rowid, {select} FROM {quote_identifier(self.table)} "
+                            f"WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+                            conn, params=(high_water_rowid, max_rowid, self.batch_rows)
+                        )
+                    if chunk.empty:
+                        break
+                    for name, spec in self.columns.items():
+                        if spec['kind'] == 'text':
+                            data = self._encode(name, chunk[name])
+                        else:
+                            data = pd.to_numeric(chunk[name], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                        with open(self._column_path(name), 'ab') as handle:
+                            data.tofile(handle)
+                    rows += len(chunk)
+                    high_water_rowid = int(chunk['__rowid'].iat[-1])
+            except Exception:
+                # Drop the partial append so the files stay consistent with the published row count
+                for name in self.columns:
+                    if os.path.exists(self._column_path(name)):
+                        os.truncate(self._column_path(name), self.rows * np.dtype(self._dtype(name)).itemsize)
+                raise
+
+            added = rows - self.rows
+            if added or not os.path.exists(self._meta_path):
+                with self._lock:
+                    self.rows, self.high_water_rowid = rows, high_water_rowid
+                    self._map_arrays()
+                self._save_meta()
+            self._synced_version = version
+            return added
+        finally:
+            self._sync_lock.release()
+
+    def _changed_in_place(self, version: tuple, max_rowid: int) -> bool:
+        """Whether mirrored rows (rowid at or below the high-water mark) were updated or deleted"""
+        epoch, table_writes = version
+        synced_epoch, synced_writes = self._synced_version
+        # Our own writes to the table that added no rowids must have touched existing rows
+        if table_writes != synced_writes and max_rowid <= self.high_water_rowid:
+            return True
+        if epoch == synced_epoch:
+            return False
+        # The epoch also moves for attached sources and other processes' commits to any
+        # table, so compare the mirror with its source rather than re-mirroring blindly
+        return not self._matches_source()
+
+    def _matches_source(self) -> bool:
+        """Row count, numeric totals and text lengths of the mirror agree with the source rows"""
+        terms = ["COUNT(*)"] + [
+            f"TOTAL(LENGTH({quote_identifier(name)}))" if spec['kind'] == 'text' else f"TOTAL({quote_identifier(name)})"
+            for name, spec in self.columns.items()
+        ]
+        with self.pool.reader() as conn:
+            source = conn.execute(
+                f"SELECT {', '.join(terms)} FROM {quote_identifier(self.table)} WHERE rowid <= ?",
+                (self.high_water_rowid,)
+            ).fetchone()
+        rows, arrays, dictionaries = self.snapshot()
+        mirrored = [rows]
+        for name, spec in self.columns.items():
+            if spec['kind'] == 'text':
+                lengths = np.array([len(value) if value is not None else 0 for value in dictionaries[name]])
+                mirrored.append(float(lengths[arrays[name]].sum()))
+            else:
+                mirrored.append(float(np.nansum(arrays[name])))
+        return source[0] == mirrored[0] and all(
+            math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-6) for expected, actual in zip(source[1:], mirrored[1:]))
+
+    def rebuild(self) -> int:
+        with self._sync_lock:
+            with self._lock:
+                self._reset(self._source_columns())
+            self._synced_version = None
+        return self.sync()
+
+    def snapshot(self) -> Tuple[int, Dict[str, np.ndarray], Dict[str, List[Optional[str]]]]:
+        """Row count, column arrays and dictionaries as published; a sync in progress is not visible"""
+        with self._lock:
+            rows = self.rows
+            arrays = {name: array[:rows] for name, array in self._arrays.items()}
+            dictionaries = {name: values[:] for name, values in self.dictionaries.items()}
+        return rows, arrays, dictionaries
+
+class ColumnarStore:
+    """Optional analytics backend: answers AggregateQuery shapes from column files.
+
+    Group keys come from dictionary codes (or month buckets derived from the
+    date dictionary), and every aggregate is a bincount/ufunc.at kernel over
+    the filtered column arrays, so nothing is converted to Python objects
+    until the grouped result is built. execute() returns None for anything it
+    can't answer and the caller falls back to SQLite.
+    """
+
+    AGGREGATES = ('SUM', 'COUNT', 'AVG', 'MIN', 'MAX')
+
+    def __init__(self, pool: SQLiteConnectionPool, directory: str):
+        self.pool = pool
+        self.directory = directory
+        self._tables: Dict[str, ColumnarTable] = {}
+        self._lock = threading.Lock()
+        self.executed_queries = 0
+        self.fallbacks = 0
+
+    def table(self, name: str, blocking: bool = True) -> Optional[ColumnarTable]:
+        """The synced mirror of a table; None if not blocking and a sync is in progress"""
+        with self._lock:
+            mirror = self._tables.get(name)
+            if mirror is None:
+                mirror = ColumnarTable(self.pool, name, os.path.join(self.directory, name))
+                self._tables[name] = mirror
+        if mirror.sync(blocking=blocking) is None:
+            return None
+        return mirror
+
+    def warm(self, name: str):
+        """Build or catch up a table's mirror on a background thread"""
+        def run():
+            try:
+                self.table(name)
+            except Exception:
+                logger.exception("Columnar mirror of %s failed", name)
+        threading.Thread(target=run, name=f'bi-columnar-{name}', daemon=True).start()
+
+    def supports(self, query: AggregateQuery, columns: Dict[str, Dict[str, str]]) -> bool:
+        if query.dimension == AggregateQuery.MONTH or query.date_from:
+            if columns.get('date', {}).get('kind') != 'text':
+                return False
+        elif query.dimension is not None and query.dimension not in columns:
+            return False
+        for func, arg, _ in query.aggregates:
+            if func not in self.AGGREGATES:
+                return False
+            column = arg[len('DISTINCT '):] if arg.startswith('DISTINCT ') else arg
+            if column == '*':
+                if func != 'COUNT' or arg.startswith('DISTINCT '):
+                    return False
+            elif column not in columns:
+                return False
+            elif func in ('SUM', 'AVG', 'MIN', 'MAX') and columns[column]['kind'] != 'number':
+                return False
+        return query.order_by is None or query.order_by in query.output_names
+
+    def _date_cutoff(self, expression: str) -> Optional[str]:
+        with self.pool.reader() as conn:
+            return conn.execute(f"SELECT {expression}").fetchone()[0]
+
+    @staticmethod
+    def _factorize(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, list]:
+        """(group codes, present mask, labels) for a numeric column, NULL as its own group"""
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        labels = list(uniques)
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(labels), codes)
+            labels.append(None)
+        return codes, np.ones(len(codes), dtype=bool), labels
+
+    def execute(self, query: AggregateQuery) -> Optional[pd.DataFrame]:
+        """Run a parsed aggregate over the column files, or None to fall back to SQLite"""
+        try:
+            # Never wait on a mirror that is still being built
+            mirror = self.table(query.table, blocking=False)
+        except sqlite3.Error:
+            return None
+        if mirror is None:
+            self.fallbacks += 1
+            return None
+        if not self.supports(query, mirror.columns):
+            self.fallbacks += 1
+            return None
+        rows, arrays, dictionaries = mirror.snapshot()
+
+        mask = None
+        if query.date_from:
+            cutoff = self._date_cutoff(query.date_from)
+            if cutoff is None:
+                return None
+            # SQLite compares ISO date text; do the same once per dictionary entry
+            keep = np.array([value is not None and value >= cutoff for value in dictionaries['date']], dtype=bool)
+            mask = keep[arrays['date']]
+
+        # Group codes and their labels
+        if query.dimension is None:
+            group, labels = np.zeros(rows, dtype=np.int64), [None]
+        elif query.dimension == AggregateQuery.MONTH:
+            months = [value[:7] if value is not None and len(value) >= 7 else None for value in dictionaries['date']]
+            month_codes, month_labels = pd.factorize(pd.Series(months, dtype=object), use_na_sentinel=True)
+            labels = list(month_labels) + [None]
+            group = np.where(month_codes < 0, len(labels) - 1, month_codes)[arrays['date']]
+        elif mirror.columns[query.dimension]['kind'] == 'text':
+            group, labels = arrays[query.dimension], dictionaries[query.dimension]
+        else:
+            group, _, labels = self._factorize(arrays[query.dimension])
+
+        if mask is not None:
+            group = group[mask]
+        groups = len(labels)
+        counts = np.bincount(group, minlength=groups)
+
+        def column_values(name: str) -> np.ndarray:
+            values = arrays[name]
+            return values[mask] if mask is not None else values
+
+        outputs: Dict[str, np.ndarray] = {}
+        integer_outputs = set()
+        for func, arg, alias in query.aggregates:
+            if arg == '*':
+                outputs[alias] = counts.astype(np.float64)
+                integer_outputs.add(alias)
+                continue
+            if arg.startswith('DISTINCT '):
+                name = arg[len('DISTINCT '):]
+                values = column_values(name)
+                if mirror.columns[name]['kind'] == 'text':
+                    value_codes, present = values.astype(np.int64), values != 0
+                else:
+                    value_codes, uniques = pd.factorize(values, use_na_sentinel=True)
+                    present = value_codes >= 0
+                width = int(value_codes.max()) + 1 if len(value_codes) else 1
+                combined = np.unique(group[present].astype(np.int64) * width + value_codes[present])
+                outputs[alias] = np.bincount(combined // width, minlength=groups).astype(np.float64)
+                integer_outputs.add(alias)
+                continue
+
+            values = column_values(arg)
+            if mirror.columns[arg]['kind'] == 'text':
+                present = values != 0
+            else:
+                present = ~np.isnan(values)
+            non_null = np.bincount(group, weights=present, minlength=groups)
+            if func == 'COUNT':
+                outputs[alias] = non_null
+                integer_outputs.add(alias)
+                continue
+            if func in ('SUM', 'AVG'):
+                sums = np.bincount(group, weights=np.where(present, values, 0.0), minlength=groups)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = sums if func == 'SUM' else sums / non_null
+            else:
+                result = np.full(groups, np.inf if func == 'MIN' else -np.inf)
+                (np.minimum if func == 'MIN' else np.maximum).at(result, group[present], values[present])
+            outputs[alias] = np.where(non_null > 0, result, np.nan)
+            if func != 'AVG' and mirror.columns[arg]['affinity'] == 'INTEGER':
+                integer_outputs.add(alias)
+
+        present_groups = np.flatnonzero(counts > 0) if query.dimension is not None else np.arange(1)
+        data = {}
+        if query.dimension is not None:
+            label_array = np.array(labels, dtype=object)[present_groups]
+            if query.dimension != AggregateQuery.MONTH and mirror.columns[query.dimension]['affinity'] == 'INTEGER':
+                label_array = pd.array([None if label is None else int(label) for label in label_array], dtype='Int64')
+            data[query.dimension_output] = label_array
+        for _, _, alias in query.aggregates:
+            values = outputs[alias][present_groups]
+            if alias in integer_outputs and not np.isnan(values).any():
+                values = values.astype(np.int64)
+            data[alias] = values
+        result_df = pd.DataFrame(data)
+
+        if query.order_by is not None:
+            result_df = result_df.sort_values(query.order_by, ascending=not query.descending, kind='stable',
+                                              na_position='last' if query.descending else 'first')
+        elif query.dimension is not None:
+            # SQLite's GROUP BY returns groups in key order
+            result_df = result_df.sort_values(query.dimension_output, kind='stable', na_position='first')
+        if query.limit is not None:
+            result_df = result_df.head(query.limit)
+        self.executed_queries += 1
+        return result_df.reset_index(drop=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tables = {name: {'rows': mirror.rows, 'high_water_rowid': mirror.high_water_rowid,
+                             'columns': len(mirror.columns)} for name, mirror in self._tables.items()}
+        return {'tables': tables, 'executed_queries': self.executed_queries, 'fallbacks': self.fallbacks}
+
+@st.cache_resource(show_spinner=False)
+def get_columnar_store(db_path: str) -> ColumnarStore:
+    """Columnar mirror shared by every session reading this database"""
+    return ColumnarStore(get_connection_pool(db_path), os.path.join(cache_directory(db_path), 'columnar'))
+
+class _FileSlice(io.RawIOBase):
+    """Read-only view of bytes [start, end) of a file, hashing the bytes as they are read"""
+
+    def __init__(self, path: str, start: int, end: int, hasher=None):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+        self.hasher = hasher
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')[:self._remaining]
+        if not len(view):
+            return 0
+        count = self._file.readinto(view) or 0
+        if self.hasher is not None:
+            self.hasher.update(view[:count])
+        self._remaining -= count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+class DataConnectionRegistry:
+    """Extra data sources (CSV/Excel files, SQLite databases) attached to the app database.
+
+    Files are imported into indexed SQLite tables on a background thread.
+    CSVs are parsed in fixed-size chunks with column types fixed by the first
+    chunk, so memory stays bounded whatever the file size; every chunk lands
+    in a staging table that is swapped in once the load completes, so queries
+    keep seeing the previous data meanwhile. Re-imports are incremental:
+    files whose size and mtime are unchanged are skipped, CSVs that only grew
+    (the stored SHA-1 still matches their prefix) have just the new bytes
+    appended, and anything else is reloaded; a file whose import failed is
+    retried only once it changes. SQLite databases are ATTACHed
+    to the pool's readers and show up in the schema catalog as
+    ``alias.table``. Connections persist to ``connections.json``.
+    """
+
+    STAGING_PREFIX = '__staging_'
+    FILE_TYPES = {'.csv': 'csv', '.tsv': 'csv', '.txt': 'csv', '.xlsx': 'excel', '.xlsm': 'excel'}
+    SQLITE_HEADER = b'SQLite format 3\x00'
+    _DATE_RE = re.compile(r'^\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+    _NAME_RE = re.compile(r'\W+')
+
+    def __init__(self, pool: SQLiteConnectionPool, directory: str, chunk_rows: int = 100000,
+                 check_interval: float = 30.0, max_indexes: int = 6):
+        self.pool = pool
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.check_interval = check_interval
+        self.max_indexes = max_indexes
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, 'connections.json')
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._connections: Dict[str, BusinessDataConnection] = {}
+        self._pending: set = set()
+        self._progress: Dict[str, int] = {}
+        self._last_check = 0.0
+        self._workers = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bi-import')
+        self.imports = 0
+        self.appends = 0
+        self.skipped = 0
+        self.rows_imported = 0
+        self._load()
+
+    # -- persistence -------------------------------------------------------
+
+    def _load(self):
+        try:
+            with open(self._path) as handle:
+                records = json.load(handle)
+        except (OSError, ValueError):
+            return
+        for record in records:
+            connection = BusinessDataConnection(**record)
+            self._connections[connection.name] = connection
+            if connection.type == 'sqlite' and os.path.exists(connection.connection_string):
+                self.pool.attach(connection.name, connection.connection_string)
+
+    def _save(self):
+        # The import worker and script threads both save
+        with self._save_lock:
+            with self._lock:
+                records = [asdict(connection) for connection in self._connections.values()]
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'w') as handle:
+                json.dump(records, handle, indent=2)
+            os.replace(temp_path, self._path)
+
+    # -- registration ------------------------------------------------------
+
+    @classmethod
+    def sql_name(cls, text: str) -> str:
+        """Lower-case identifier safe to use unquoted"""
+        name = cls._NAME_RE.sub('_', text).strip('_').lower() or 'data'
+        return f"t_{name}" if name[0].isdigit() else name
+
+    def connections(self) -> List[BusinessDataConnection]:
+        with self._lock:
+            return list(self._connections.values())
+
+    def save_upload(self, filename: str, source) -> str:
+        """Stream an uploaded file object to the uploads directory and return its path"""
+        stem, extension = os.path.splitext(os.path.basename(filename))
+        upload_dir = os.path.join(self.directory, 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        path = os.path.join(upload_dir, self.sql_name(stem) + extension.lower())
+        with open(path + '.tmp', 'wb') as handle:
+            shutil.copyfileobj(source, handle, 1024 * 1024)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def add(self, path: str, name: Optional[str] = None) -> BusinessDataConnection:
+        """Register a file or SQLite database; file imports start in the background"""
+        path = os.path.abspath(os.path.expanduser(path))
+        if not os.path.isfile(path):
+            raise ValueError(f"File not found: {path}")
+        with open(path, 'rb') as handle:
+            is_sqlite = handle.read(len(self.SQLITE_HEADER)) == self.SQLITE_HEADER
+        name = self.sql_name(name or os.path.splitext(os.path.basename(path))[0])
+        if is_sqlite:
+            return self.attach_sqlite(path, name)
+
+        file_type = self.FILE_TYPES.get(os.path.splitext(path)[1].lower())
+        if file_type is None:
+            raise ValueError(f"Unsupported file type: {os.path.basename(path)} (use CSV, TSV, XLSX or a SQLite database)")
+        with self._lock:
+            existing = self._connections.get(name)
+        if existing is not None and existing.connection_string != path:
+            raise ValueError(f"A connection named '{name}' already exists")
+        if existing is None:
+            with self.pool.reader() as conn:
+                taken = conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = ?", (name,)).fetchone()
+            if taken:
+                raise ValueError(f"Table '{name}' already exists in the database; choose another name")
+
+        connection = existing or BusinessDataConnection(
+            name=name, type=file_type, connection_string=path, tables=[name],
+            description=f"{file_type.upper()} import of {os.path.basename(path)}", status='queued'
+        )
+        with self._lock:
+            self._connections[name] = connection
+        self._save()
+        self._queue(connection, full=existing is None)
+        return connection
+
+    def attach_sqlite(self, path: str, alias: str) -> BusinessDataConnection:
+        if alias in ('main', 'temp') or alias in self.pool.attachments:
+            raise ValueError(f"Database alias '{alias}' is already in use")
+        tables, rows = self._describe_sqlite(path)
+        connection = BusinessDataConnection(
+            name=alias, type='sqlite', connection_string=path, tables=[f"{alias}.{table}" for table in tables],
+            description=f"Attached SQLite database {os.path.basename(path)}", rows=rows,
+            state={'mtime_ns': os.stat(path).st_mtime_ns}
+        )
+        with self._lock:
+            self._connections[alias] = connection
+        self.pool.attach(alias, path)
+        self._save()
+        return connection
+
+    @staticmethod
+    def _describe_sqlite(path: str) -> Tuple[List[str], int]:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+            rows = sum(conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}").fetchone()[0] for table in tables)
+        finally:
+            conn.close()
+        return tables, rows
+
+    def remove(self, name: str, drop_tables: bool = False):
+        with self._lock:
+            connection = self._connections.pop(name, None)
+        if connection is None:
+            return
+        if connection.type == 'sqlite':
+            self.pool.detach(name)
+        elif drop_tables:
+            with self.pool.writer() as conn:
+                for table in connection.tables:
+                    conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table)}")
+        self._save()
+
+    # -- change detection --------------------------------------------------
+
+    def maybe_refresh(self):
+        """Check sources for changes at most every ``check_interval`` seconds"""
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+
+    def refresh(self, force: bool = False):
+        """Queue re-imports for changed files and invalidate changed attached databases"""
+        self._last_check = time.monotonic()
+        changed = False
+        for connection in self.connections():
+            path = connection.connection_string
+            try:
+                stat = os.stat(path)
+            except OSError:
+                connection.status, connection.error = 'error', f"Source missing: {path}"
+                connection.state.pop('failed_on', None)
+                changed = True
+                continue
+            if connection.type == 'sqlite':
+                if force or stat.st_mtime_ns != connection.state.get('mtime_ns'):
+                    tables, connection.rows = self._describe_sqlite(path)
+                    connection.tables = [f"{connection.name}.{table}" for table in tables]
+                    connection.state['mtime_ns'] = stat.st_mtime_ns
+                    connection.status, connection.error = 'ready', ''
+                    self.pool.note_external_change(schema_changed=True)
+                    changed = True
+            elif connection.status in ('error', 'queued', 'importing') and connection.name not in self._pending:
+                # Interrupted imports start over; a failed one only once its file changes (or on force)
+                if force or connection.status != 'error' or \
+                        connection.state.get('failed_on') != [stat.st_size, stat.st_mtime_ns]:
+                    self._queue(connection, full=True)
+            elif force or (stat.st_size, stat.st_mtime_ns) != (connection.state.get('size'), connection.state.get('mtime_ns')):
+                self._queue(connection, full=False)
+        if changed:
+            self._save()
+
+    def _queue(self, connection: BusinessDataConnection, full: bool):
+        with self._lock:
+            if connection.name in self._pending:
+                return
+            self._pending.add(connection.name)
+            connection.status = 'queued'
+        self._workers.submit(self._run_import, connection.name, full)
+
+    def _run_import(self, name: str, full: bool):
+        with self._lock:
+            connection = self._connections.get(name)
+        if connection is None:
+            self._pending.discard(name)
+            return
+        connection.status, connection.error = 'importing', ''
+        try:
+            if connection.type == 'csv':
+                self._import_csv(connection, full)
+            else:
+                self._import_excel(connection, full)
+            connection.status = 'ready'
+            connection.state.pop('failed_on', None)
+        except Exception as exc:
+            logger.exception("Import of %s failed", connection.connection_string)
+            connection.status, connection.error = 'error', str(exc)
+            # Remember which version of the file failed so polling doesn't retry it forever
+            try:
+                stat = os.stat(connection.connection_string)
+                connection.state['failed_on'] = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                connection.state.pop('failed_on', None)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+                self._progress.pop(name, None)
+            self._save()
+
+    # -- loading -----------------------------------------------------------
+
+    @staticmethod
+    def _hash_prefix(path: str, length: int):
+        hasher = hashlib.sha1()
+        with _FileSlice(path, 0, length) as source:
+            for block in iter(lambda: source.read(1024 * 1024), b''):
+                hasher.update(block)
+        return hasher
+
+    @staticmethod
+    def _settled_end(path: str, stat: os.stat_result) -> int:
+        """Bytes safe to import: stop at the last newline while the file is still being written"""
+        if time.time() - stat.st_mtime > 2.0:
+            return stat.st_size
+        with open(path, 'rb') as handle:
+            tail_start = max(0, stat.st_size - 65536)
+            handle.seek(tail_start)
+            cut = handle.read(stat.st_size - tail_start).rfind(b'\n')
+        return tail_start + cut + 1 if cut >= 0 else stat.st_size
+
+    def _column_types(self, chunk: pd.DataFrame) -> Dict[str, str]:
+        """SQL type per column, decided once from the first chunk"""
+        types = {}
+        for column in chunk.columns:
+            series = chunk[column]
+            if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+                types[column] = 'INTEGER'
+            elif pd.api.types.is_float_dtype(series):
+                values = series.dropna()
+                types[column] = 'INTEGER' if len(values) and (values == values.round()).all() else 'REAL'
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                values = series.dropna()
+                types[column] = 'DATETIME' if (values != values.dt.normalize()).any() else 'DATE'
+            else:
+                sample = series.dropna().astype(str).head(1000)
+                if len(sample) and sample.str.match(self._DATE_RE).mean() >= 0.95:
+                    has_time = sample.str.contains(':').any()
+                    types[column] = 'DATETIME' if has_time else 'DATE'
+                else:
+                    types[column] = 'TEXT'
+        return types
+
+    @staticmethod
+    def _typed_rows(chunk: pd.DataFrame, types: Dict[str, str]):
+        for column, sql_type in types.items():
+            if sql_type in ('DATE', 'DATETIME'):
+                fmt = '%Y-%m-%d %H:%M:%S' if sql_type == 'DATETIME' else '%Y-%m-%d'
+                chunk[column] = pd.to_datetime(chunk[column], errors='coerce').dt.strftime(fmt)
+        return chunk.itertuples(index=False, name=None)
+
+    def _index_columns(self, chunk: pd.DataFrame, types: Dict[str, str]) -> List[str]:
+        """Dates, ids and low-cardinality text columns: the usual filter and GROUP BY targets"""
+        columns = [col for col, sql_type in types.items() if sql_type in ('DATE', 'DATETIME')]
+        columns += [col for col in types if col == 'id' or col.endswith('_id')]
+        for col, sql_type in types.items():
+            if sql_type == 'TEXT' and col not in columns and len(chunk):
+                if chunk[col].nunique() <= max(50, len(chunk) // 100):
+                    columns.append(col)
+        return columns[:self.max_indexes]
+
+    def _write_chunk(self, table: str, columns: List[str], rows) -> int:
+        placeholders = ', '.join('?' * len(columns))
+        sql = f"INSERT INTO {quote_identifier(table)} VALUES ({placeholders})"
+        with self.pool.bulk_writer() as conn:
+            conn.execute("BEGIN")
+            cursor = conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        return cursor.rowcount
+
+    def _load_chunks(self, connection: BusinessDataConnection, chunks, append: bool) -> int:
+        """Stream chunks into a staging table, then swap or append it into the target in one transaction"""
+        table = connection.tables[0]
+        staging = self.STAGING_PREFIX + table
+        state = connection.state
+        with self.pool.writer() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging)}")
+
+        rows = 0
+        index_columns = state.get('index_columns', [])
+        for chunk in chunks:
+            if not append and rows == 0:
+                source_columns = [str(col) for col in chunk.columns]
+                columns, seen = [], set()
+                for source in source_columns:
+                    column = self.sql_name(source)
+                    while column in seen:
+                        column += '_'
+                    seen.add(column)
+                    columns.append(column)
+                chunk.columns = columns
+                types = self._column_types(chunk)
+                index_columns = self._index_columns(chunk, types)
+                state.update(source_columns=source_columns, columns=columns, types=types)
+            else:
+                chunk.columns = state['columns']
+            if rows == 0:
+                definitions = ', '.join(f"{quote_identifier(col)} {state['types'][col]}" for col in state['columns'])
+                with self.pool.writer() as conn:
+                    conn.execute(f"CREATE TABLE {quote_identifier(staging)} ({definitions})")
+            rows += self._write_chunk(staging, state['columns'], self._typed_rows(chunk, state['types']))
+            self._progress[connection.name] = rows
+        if rows == 0 and not append:
+            raise ValueError(f"No rows found in {os.path.basename(connection.connection_string)}")
+
+        quoted_table, quoted_staging = quote_identifier(table), quote_identifier(staging)
+        with self.pool.writer() as conn:
+            if append:
+                if rows:
+                    conn.execute(f"INSERT INTO {quoted_table} SELECT * FROM {quoted_staging}")
+                conn.execute(f"DROP TABLE IF EXISTS {quoted_staging}")
+            else:
+                conn.execute(f"DROP TABLE IF EXISTS {quoted_table}")
+                conn.execute(f"ALTER TABLE {quoted_staging} RENAME TO {quoted_table}")
+                for column in index_columns:
+                    conn.execute(f"CREATE INDEX {quote_identifier(f'idx_{table}_{column}')} "
+                                 f"ON {quoted_table} ({quote_identifier(column)})")
+                state['index_columns'] = index_columns
+            connection.rows = conn.execute(f"SELECT COUNT(*) FROM {quoted_table}").fetchone()[0]
+        self.rows_imported += rows
+        return rows
+
+    def _import_csv(self, connection: BusinessDataConnection, full: bool):
+        path = connection.connection_string
+        state = connection.state
+        stat = os.stat(path)
+        if not full and (stat.st_size, stat.st_mtime_ns) == (state.get('size'), state.get('mtime_ns')):
+            self.skipped += 1
+            return
+        end = self._settled_end(path, stat)
+        start, hasher = 0, hashlib.sha1()
+        if not full and state.get('sha1') and end >= state.get('size', 0):
+            prefix = self._hash_prefix(path, state['size'])
+            if prefix.hexdigest() == state['sha1']:
+                start, hasher = state['size'], prefix
+        if start and start == end:
+            # Touched but not modified
+            state['mtime_ns'] = stat.st_mtime_ns
+            self.skipped += 1
+            return
+
+        options = dict(sep='\t' if path.lower().endswith('.tsv') else ',', chunksize=self.chunk_rows)
+        if start:
+            # Text columns stay text in the appended rows too
+            options.update(header=None, names=state['source_columns'], dtype={
+                source: str for source, column in zip(state['source_columns'], state['columns'])
+                if state['types'][column] != 'INTEGER' and state['types'][column] != 'REAL'
+            })
+        with _FileSlice(path, start, end, hasher) as source:
+            text = io.TextIOWrapper(io.BufferedReader(source, 1024 * 1024), encoding='utf-8', errors='replace', newline='')
+            self._load_chunks(connection, pd.read_csv(text, **options), append=bool(start))
+        state.update(size=end, mtime_ns=stat.st_mtime_ns, sha1=hasher.hexdigest())
+        if start:
+            self.appends += 1
+        else:
+            self.imports += 1
+
+    def _import_excel(self, connection: BusinessDataConnection, full: bool):
+        """Excel workbooks are rewritten on save, so a changed file is always reloaded"""
+        from openpyxl import load_workbook
+
+        path = connection.connection_string
+        state = connection.state
+        stat = os.stat(path)
+        if not full and (stat.st_size, stat.st_mtime_ns) == (state.get('size'), state.get('mtime_ns')):
+            self.skipped += 1
+            return
+        digest = self._hash_prefix(path, stat.st_size).hexdigest()
+        if not full and digest == state.get('sha1'):
+            state['mtime_ns'] = stat.st_mtime_ns
+            self.skipped += 1
+            return
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(value) if value is not None else f"column_{i + 1}" for i, value in enumerate(next(rows, ()))]
+
+            def chunks():
+                while True:
+                    block = [row[:len(header)] for row in itertools.islice(rows, self.chunk_rows)]
+                    if not block:
+                        return
+                    yield pd.DataFrame.from_records(block, columns=header).infer_objects()
+
+            self._load_chunks(connection, chunks(), append=False)
+        finally:
+            workbook.close()
+        state.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha1=digest)
+        self.imports += 1
+
+    # -- reporting ---------------------------------------------------------
+
+    def status_frame(self) -> pd.DataFrame:
+        records = []
+        for connection in self.connections():
+            detail = connection.error
+            if connection.status == 'importing':
+                detail = f"{self._progress.get(connection.name, 0):,} rows loaded"
+            records.append({
+                'name': connection.name, 'type': connection.type,
+                'source': os.path.basename(connection.connection_string),
+                'tables': ', '.join(connection.tables), 'rows': connection.rows,
+                'status': connection.status, 'detail': detail
+            })
+        return pd.DataFrame(records)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'connections': len(self._connections), 'pending_imports': len(self._pending),
+            'imports': self.imports, 'appends': self.appends, 'skipped': self.skipped,
+            'rows_imported': self.rows_imported,
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_data_connection_registry(db_path: str) -> DataConnectionRegistry:
+    """Data source registry shared by every session using this database"""
+    return DataConnectionRegistry(get_connection_pool(db_path), os.path.join(cache_directory(db_path), 'connections'))
+
+def result_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of a result frame (columns and values)"""
+    digest = hashlib.sha1(json.dumps([str(col) for col in df.columns]).encode('utf-8'))
+    if len(df):
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:20]
+
+class StreamingExporter:
+    """Writes query results to CSV, JSON, NDJSON, Parquet, Arrow or Excel in batches.
+
+    Results are read from an SQLite cursor (or sliced from a DataFrame)
+    ``batch_rows`` at a time and appended to a spooled temporary file that
+    moves to disk past ``spool_max_bytes``, so peak memory is one batch no
+    matter how many rows are exported. Encoded DataFrame exports are
+    memoized by result fingerprint so reruns don't re-encode them.
+    """
+
+    # format -> (mime type, file extension)
+    FORMATS = {
+        'csv': ('text/csv', 'csv'),
+        'json': ('application/json', 'json'),
+        'ndjson': ('application/x-ndjson', 'ndjson'),
+        'parquet': ('application/vnd.apache.parquet', 'parquet'),
+        'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+        'excel': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    }
+    EXCEL_MAX_ROWS = 1048575  # per sheet, excluding the header row
+
+    def __init__(self, pool: SQLiteConnectionPool, batch_rows: int = 50000,
+                 spool_max_bytes: int = 32 * 1024 * 1024, memo_max_bytes: int = 64 * 1024 * 1024):
+        self.pool = pool
+        self.batch_rows = batch_rows
+        self.spool_max_bytes = spool_max_bytes
+        self.memo_max_bytes = memo_max_bytes
+
+        self._memo: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._memo_bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def available_formats(cls) -> List[str]:
+        """Formats whose optional dependencies are installed"""
+        formats = ['csv', 'json', 'ndjson']
+        try:
+            import pyarrow  # noqa: F401
+            formats += ['parquet', 'arrow']
+        except ImportError:
+            pass
+        try:
+            import openpyxl  # noqa: F401
+            formats.append('excel')
+        except ImportError:
+            pass
+        return formats
+
+    def _query_batches(self, sql_query: str, params: tuple = ()) -> Iterator[pd.DataFrame]:
+        with self.pool.reader() as conn:
+            cursor = conn.execute(sql_query, params)
+            columns = [col[0] for col in cursor.description]
+            try:
+                first = True
+                while True:
+                    rows = cursor.fetchmany(self.batch_rows)
+                    if not rows and not first:
+                        break
+                    first = False
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+                    if not rows:
+                        break
+            finally:
+                cursor.close()
+
+    def _frame_batches(self, df: pd.DataFrame) -> Iterator[pd.DataFrame]:
+        if df.empty:
+            yield df
+        for start in range(0, len(df), self.batch_rows):
+            yield df.iloc[start:start + self.batch_rows]
+
+    def write(self, batches: Iterator[pd.DataFrame], format_type: str, out):
+        """Stream batches into a binary file object"""
+        if format_type not in self.FORMATS:
+            raise ValueError(f"Unsupported export format: {format_type}")
+        writer = getattr(self, f"_write_{format_type}")
+        writer(batches, out)
+
+    def _write_csv(self, batches, out):
+        text = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+        for i, batch in enumerate(batches):
+            batch.to_csv(text, index=False, header=(i == 0))
+        text.detach()
+
+    def _write_ndjson(self, batches, out):
+        for batch in batches:
+            if len(batch):
+                out.write(batch.to_json(orient='records', lines=True).rstrip('\n').encode('utf-8'))
+                out.write(b'\n')
+
+    def _write_json(self, batches, out):
+        out.write(b'[')
+        first = True
+        for batch in batches:
+            if not len(batch):
+                continue
+            records = batch.to_json(orient='records')[1:-1]
+            out.write((records if first else ',' + records).encode('utf-8'))
+            first = False
+        out.write(b']')
+
+    def _arrow_tables(self, batches):
+        import pyarrow as pa
+        schema = None
+        for batch in batches:
+            if schema is None:
+                table = pa.Table.from_pandas(batch, preserve_index=False)
+                # Columns that are all NULL in the first batch fall back to strings
+                schema = pa.schema([
+                    f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema
+                ]).remove_metadata()
+                yield schema, table.cast(schema)
+            else:
+                yield schema, pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+
+    def _write_parquet(self, batches, out):
+        import pyarrow.parquet as pq
+        writer = None
+        for schema, table in self._arrow_tables(batches):
+            if writer is None:
+                writer = pq.ParquetWriter(out, schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+
+    def _write_arrow(self, batches, out):
+        import pyarrow as pa
+        writer = None
+        for schema, table in self._arrow_tables(batches):
+            if writer is None:
+                writer = pa.ipc.new_file(out, schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+
+    def _write_excel(self, batches, out):
+        from openpyxl import Workbook
+        # Write-only workbooks stream rows to disk instead of keeping cells in memory
+        workbook = Workbook(write_only=True)
+        sheet, sheet_rows, columns = None, 0, None
+        for batch in batches:
+            if columns is None:
+                columns = [str(col) for col in batch.columns]
+            values = batch.astype(object).where(batch.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                if sheet is None or sheet_rows >= self.EXCEL_MAX_ROWS:
+                    sheet = workbook.create_sheet(f"Results {len(workbook.worksheets) + 1}")
+                    sheet.append(columns)
+                    sheet_rows = 0
+                sheet.append(list(row))
+                sheet_rows += 1
+        if sheet is None:
+            sheet = workbook.create_sheet("Results 1")
+            sheet.append(columns or [])
+        workbook.save(out)
+
+    def export_query(self, sql_query: str, format_type: str = 'csv', params: tuple = ()):
+        """Stream a query's rows into a spooled temp file, rewound and ready to read"""
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        try:
+            self.write(self._query_batches(sql_query, params), format_type, spool)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
+
+    def export_query_to_path(self, sql_query: str, path: str, format_type: str = 'csv', params: tuple = ()):
+        """Stream a query's rows straight into a file on disk"""
+        with open(path, 'wb') as out:
+            self.write(self._query_batches(sql_query, params), format_type, out)
+
+    def export_dataframe(self, df: pd.DataFrame, format_type: str = 'csv') -> bytes:
+        """Encode an in-memory result, memoized by fingerprint and format"""
+        key = (result_fingerprint(df), format_type)
+        with self._lock:
+            data = self._memo.get(key)
+            if data is not None:
+                self._memo.move_to_end(key)
+                return data
+
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes) as spool:
+            self.write(self._frame_batches(df), format_type, spool)
+            spool.seek(0)
+            data = spool.read()
+
+        if len(data) <= self.memo_max_bytes // 4:
+            with self._lock:
+                if key not in self._memo:
+                    self._memo[key] = data
+                    self._memo_bytes += len(data)
+                while self._memo_bytes > self.memo_max_bytes:
+                    _, evicted = self._memo.popitem(last=False)
+                    self._memo_bytes -= len(evicted)
+        return data
+
+@st.cache_resource(show_spinner=False)
+def get_streaming_exporter(db_path: str) -> StreamingExporter:
+    """Exporter shared by every session reading this database"""
+    return StreamingExporter(get_connection_pool(db_path))
+
+def column_affinity(declared_type: str) -> str:
+    """SQLite type affinity for a declared column type"""
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type:
+        return 'INTEGER'
+    if any(token in declared_type for token in ('CHAR', 'CLOB', 'TEXT')):
+        return 'TEXT'
+    if not declared_type or 'BLOB' in declared_type:
+        return 'BLOB'
+    if any(token in declared_type for token in ('REAL', 'FLOA', 'DOUB')):
+        return 'REAL'
+    return 'NUMERIC'
+
+class TableBrowser:
+    """Server-side table browsing for the Data Explorer.
+
+    Pages are fetched with keyset pagination on rowid (on the primary key
+    for WITHOUT ROWID tables), so page N costs the same as page 1; tables
+    with neither fall back to LIMIT/OFFSET. Column projection and filters
+    are pushed into the SQL, and summary statistics are computed by SQL
+    aggregates over the whole (filtered) table, or from a random rowid
+    sample in approximate mode.
+    Both kinds of statistics go through the result cache, so they are
+    recomputed only when the table's version changes.
+    """
+
+    FILTER_OPERATORS = ['=', '!=', '>', '>=', '<', '<=', 'contains', 'starts with']
+
+    def __init__(self, pool: SQLiteConnectionPool, catalog: SchemaCatalog, result_cache: QueryResultCache):
+        self.pool = pool
+        self.catalog = catalog
+        self.result_cache = result_cache
+
+    def _table(self, table_name: str) -> TableInfo:
+        info = self.catalog.table(table_name)
+        if info is None:
+            raise ValueError(f"Unknown table: {table_name}")
+        return info
+
+    @staticmethod
+    def _coerce(value: Any, column: ColumnInfo) -> Any:
+        affinity = column_affinity(column.type)
+        if isinstance(value, str) and affinity in ('INTEGER', 'REAL', 'NUMERIC'):
+            try:
+                return int(value) if affinity == 'INTEGER' else float(value)
+            except ValueError:
+                return value
+        return value
+
+    def _where(self, info: TableInfo, filters: Optional[List[Tuple[str, str, Any]]]) -> Tuple[List[str], List[Any]]:
+        """Validated WHERE terms and parameters for (column, operator, value) filters"""
+        columns = {col.name: col for col in info.columns}
+        clauses, params = [], []
+        for column, operator, value in filters or []:
+            if column not in columns or operator not in self.FILTER_OPERATORS:
+                raise ValueError(f"Invalid filter: {column} {operator}")
+            quoted = quote_identifier(column)
+            if operator in ('contains', 'starts with'):
+                escaped = str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                clauses.append(f"{quoted} LIKE ? ESCAPE '\\'")
+                params.append(('%' if operator == 'contains' else '') + escaped + '%')
+            else:
+                clauses.append(f"{quoted} {operator} ?")
+                params.append(self._coerce(value, columns[column]))
+        return clauses, params
+
+    def _projection(self, info: TableInfo, columns: Optional[List[str]]) -> List[str]:
+        selected = columns or info.column_names
+        unknown = [col for col in selected if col not in info.column_names]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        return selected
+
+    @staticmethod
+    def page_key(info: TableInfo) -> List[str]:
+        """Columns pages are keyed on; empty when the table can only be paged by offset"""
+        return ['rowid'] if info.has_rowid else [quote_identifier(col) for col in info.key_columns]
+
+    def fetch_page(self, table_name: str, columns: Optional[List[str]] = None,
+                   filters: Optional[List[Tuple[str, str, Any]]] = None, page_size: int = 100,
+                   after: Optional[tuple] = None) -> Tuple[pd.DataFrame, Optional[tuple], bool]:
+        """One page of rows after the ``after`` key; returns (rows, last key, has more pages)"""
+        info = self._table(table_name)
+        selected = self._projection(info, columns)
+        clauses, params = self._where(info, filters)
+        key = self.page_key(info)
+        if after is not None and key:
+            clauses.insert(0, f"({', '.join(key)}) > ({', '.join('?' * len(key))})")
+            params[:0] = list(after)
+
+        key_select = [f"{expr} AS __key{i}__" for i, expr in enumerate(key)]
+        sql = (f"SELECT {', '.join(key_select + [quote_identifier(col) for col in selected])} "
+               f"FROM {quote_table(table_name)}")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if key:
+            sql += f" ORDER BY {', '.join(key)} LIMIT ?"
+            params.append(page_size + 1)
+        else:
+            offset = after[0] if after is not None else 0
+            sql += " LIMIT ? OFFSET ?"
+            params += [page_size + 1, offset]
+        with self.pool.reader() as conn:
+            page = pd.read_sql_query(sql, conn, params=params)
+
+        has_more = len(page) > page_size
+        page = page.iloc[:page_size]
+        key_names = [f"__key{i}__" for i in range(len(key))]
+        last_key = None
+        if len(page):
+            if key:
+                last_key = tuple(value.item() if hasattr(value, 'item') else value
+                                 for value in page[key_names].iloc[-1])
+            else:
+                last_key = (offset + len(page),)
+        return page.drop(columns=key_names).reset_index(drop=True), last_key, has_more
+
+    def _cached(self, sql: str, params: Any, key_params: Optional[tuple] = None) -> pd.DataFrame:
+        """Run through the result cache.
+
+        ``key_params`` stands in for bulky parameters in the cache key; ``params``
+        may then be a callable so they are only built on a miss.
+        """
+        key_params = params if key_params is None else key_params
+        cached = self.result_cache.get(sql, key_params)
+        if cached is not None:
+            return cached
+        if callable(params):
+            params = params()
+        version = self.result_cache.version_for(sql)
+        with self.pool.reader() as conn:
+            result = pd.read_sql_query(sql, conn, params=params)
+        self.result_cache.put(sql, result, version, key_params)
+        return result
+
+    def count_rows(self, table_name: str, filters: Optional[List[Tuple[str, str, Any]]] = None) -> int:
+        info = self._table(table_name)
+        clauses, params = self._where(info, filters)
+        sql = f"SELECT COUNT(*) AS n FROM {quote_table(table_name)}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return int(self._cached(sql, tuple(params)).iloc[0]['n'])
+
+    def numeric_columns(self, table_name: str, columns: Optional[List[str]] = None) -> List[str]:
+        info = self._table(table_name)
+        selected = set(self._projection(info, columns))
+        return [
+            col.name for col in info.columns
+            if col.name in selected and column_affinity(col.type) in ('INTEGER', 'REAL', 'NUMERIC')
+        ]
+
+    def summary_statistics(self, table_name: str, columns: Optional[List[str]] = None,
+                           filters: Optional[List[Tuple[str, str, Any]]] = None,
+                           approximate: bool = False, sample_rows: int = 100000) -> pd.DataFrame:
+        """describe()-style statistics for the numeric columns of the whole table (always exact without a rowid)"""
+        info = self._table(table_name)
+        numeric = self.numeric_columns(table_name, columns)
+        if not numeric:
+            return pd.DataFrame()
+        clauses, params = self._where(info, filters)
+        table = quote_table(table_name)
+
+        if approximate and info.has_rowid:
+            # Random rowids are looked up through the rowid b-tree, so the sample
+            # costs O(sample log n) instead of a full scan
+            with self.pool.reader() as conn:
+                low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+            if low is None:
+                return pd.DataFrame(columns=numeric)
+            sample_size = min(sample_rows, high - low + 1)
+
+            def sample_params():
+                rowids = np.unique(np.random.default_rng(0).integers(low, high + 1, sample_size))
+                return tuple([json.dumps(rowids.tolist())] + params)
+
+            sql = f"SELECT {', '.join(quote_identifier(col) for col in numeric)} FROM {table} WHERE rowid IN (SELECT value FROM json_each(?))"
+            if clauses:
+                sql += " AND " + " AND ".join(clauses)
+            # The sample is fully determined by the rowid range and size
+            sample = self._cached(sql, sample_params,
+                                  key_params=tuple([f"sample:{low}:{high}:{sample_rows}"] + params))
+            return sample.apply(pd.to_numeric, errors='coerce').describe()
+
+        select = []
+        for i, col in enumerate(numeric):
+            quoted = quote_identifier(col)
+            select += [
+                f"COUNT({quoted}) AS c{i}", f"AVG({quoted}) AS m{i}", f"AVG({quoted} * {quoted}) AS q{i}",
+                f"MIN({quoted}) AS lo{i}", f"MAX({quoted}) AS hi{i}"
+            ]
+        sql = f"SELECT {', '.join(select)} FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        row = self._cached(sql, tuple(params)).iloc[0]
+
+        stats = {}
+        for i, col in enumerate(numeric):
+            count, mean, mean_sq = row[f"c{i}"], row[f"m{i}"], row[f"q{i}"]
+            std = np.nan
+            if count > 1 and mean is not None and not pd.isna(mean):
+                std = float(np.sqrt(max(mean_sq - mean * mean, 0.0) * count / (count - 1)))
+            stats[col] = {'count': count, 'mean': mean, 'std': std, 'min': row[f"lo{i}"], 'max': row[f"hi{i}"]}
+        return pd.DataFrame(stats)
+
+@st.cache_resource(show_spinner=False)
+def get_table_browser(db_path: str) -> TableBrowser:
+    """Table browser shared by every session reading this database"""
+    return TableBrowser(get_connection_pool(db_path), get_schema_catalog(db_path), get_query_result_cache(db_path))
+
+class QueryExecutionError(Exception):
+    """A query stopped by the executor before it produced a result"""
+
+class QueryTimeoutError(QueryExecutionError):
+    pass
+
+class QueryCancelledError(QueryExecutionError):
+    pass
+
+class QueryLimitExceededError(QueryExecutionError):
+    pass
+
+class QueryHandle:
+    """A submitted query: poll it, wait for it or cancel it"""
+
+    def __init__(self, sql_query: str, future: Optional[Future] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.sql = sql_query
+        self.future = future if future is not None else Future()
+        self.submitted_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        # How it ended: one of the executor's counter names ('completed', 'timed_out', ...)
+        self.outcome: Optional[str] = None
+        self._cancel_event = threading.Event()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+
+    @classmethod
+    def completed(cls, sql_query: str, result_df: pd.DataFrame) -> 'QueryHandle':
+        """A handle for a result that is already available (e.g. from the cache)"""
+        handle = cls(sql_query)
+        handle.future.set_result(result_df)
+        handle.finished_at = handle.submitted_at
+        handle.outcome = 'completed'
+        return handle
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.submitted_at
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> pd.DataFrame:
+        return self.future.result(timeout)
+
+    def cancel(self) -> bool:
+        """Stop the query: skipped if still queued, interrupted if running.
+
+        Returns True when the query was still queued, so it will never run.
+        """
+        self._cancel_event.set()
+        if self.future.cancel():
+            self.finished_at = time.monotonic()
+            return True
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.interrupt()
+        return False
+
+class QueryExecutor:
+    """Runs queries on a worker pool, off the Streamlit script thread.
+
+    Each query gets a time budget, counted from when it starts running and
+    enforced by an SQLite progress handler, can be cancelled from any thread (including a later rerun, via its
+    handle id), and is streamed with fetchmany so queries returning more
+    than ``max_rows`` rows or roughly ``max_bytes`` bytes are rejected
+    before a DataFrame is built.
+    """
+
+    def __init__(self, pool: SQLiteConnectionPool, max_workers: int = 4, default_timeout: float = 30.0,
+                 max_rows: int = 1000000, max_bytes: int = 512 * 1024 * 1024,
+                 batch_rows: int = 10000, progress_interval: int = 10000):
+        self.pool = pool
+        self.default_timeout = default_timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.batch_rows = batch_rows
+        self.progress_interval = progress_interval
+
+        self._workers = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bi-query')
+        self._lock = threading.Lock()
+        self._handles: Dict[str, QueryHandle] = {}
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'cancelled': 0, 'rejected': 0}
+
+    def submit(self, sql_query: str, params: tuple = (), timeout: Optional[float] = None,
+               max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+               on_complete: Optional[Callable[[pd.DataFrame], None]] = None) -> QueryHandle:
+        """Queue a query; returns immediately with its handle"""
+        handle = QueryHandle(sql_query)
+        limits = (
+            self.default_timeout if timeout is None else timeout,
+            self.max_rows if max_rows is None else max_rows,
+            self.max_bytes if max_bytes is None else max_bytes
+        )
+        # Publish the handle only once it holds the real future, so a cancel can't hit the placeholder
+        handle.future = self._workers.submit(self._run, handle, params, limits, on_complete)
+        with self._lock:
+            self._prune()
+            self._handles[handle.id] = handle
+            self.counters['submitted'] += 1
+        return handle
+
+    def get(self, handle_id: str) -> Optional[QueryHandle]:
+        with self._lock:
+            return self._handles.get(handle_id)
+
+    def cancel(self, handle_id: str) -> bool:
+        """Cancel a query by id; returns False if it is unknown or already finished"""
+        handle = self.get(handle_id)
+        if handle is None or handle.done():
+            return False
+        if handle.cancel():
+            # A queued query never reaches _run, so count it here
+            self._count('cancelled', handle)
+        return True
+
+    def _prune(self, keep_seconds: float = 300):
+        # Caller must hold self._lock
+        now = time.monotonic()
+        for handle_id in [h.id for h in self._handles.values() if h.done() and now - h.submitted_at > keep_seconds]:
+            del self._handles[handle_id]
+
+    @staticmethod
+    def _estimate_bytes(rows: list) -> int:
+        """Rough in-memory size of a batch, extrapolated from its first rows"""
+        if not rows:
+            return 0
+        probe = rows[:50]
+        probe_bytes = sum(sys.getsizeof(value) for row in probe for value in row)
+        return int(probe_bytes * len(rows) / len(probe))
+
+    def _run(self, handle: QueryHandle, params: tuple, limits: tuple, on_complete) -> pd.DataFrame:
+        timeout, max_rows, max_bytes = limits
+        # The budget starts when the query does; time spent queued behind others isn't charged to it
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            if handle.cancelled:
+                raise QueryCancelledError("Query was cancelled before it started")
+            with self.pool.reader() as conn:
+                with handle._conn_lock:
+                    handle._conn = conn
+
+                def check_budget():
+                    # Non-zero aborts the running statement with "interrupted"
+                    return 1 if handle.cancelled or (deadline and time.monotonic() > deadline) else 0
+
+                conn.set_progress_handler(check_budget, self.progress_interval)
+                try:
+                    cursor = conn.execute(handle.sql, params)
+                    columns = [col[0] for col in cursor.description] if cursor.description else []
+                    rows, total_bytes = [], 0
+                    while True:
+                        batch = cursor.fetchmany(self.batch_rows)
+                        if not batch:
+                            break
+                        rows.extend(batch)
+                        total_bytes += self._estimate_bytes(batch)
+                        if len(rows) > max_rows:
+                            raise QueryLimitExceededError(f"Query returned more than {max_rows:,} rows")
+                        if total_bytes > max_bytes:
+                            raise QueryLimitExceededError(f"Query result exceeds {max_bytes / 1e6:,.0f} MB")
+                    cursor.close()
+                except sqlite3.OperationalError as e:
+                    if 'interrupted' not in str(e):
+                        raise
+                    if handle.cancelled:
+                        raise QueryCancelledError("Query was cancelled") from e
+                    raise QueryTimeoutError(f"Query exceeded its {timeout:g}s time budget") from e
+                finally:
+                    conn.set_progress_handler(None, 0)
+                    with handle._conn_lock:
+                        handle._conn = None
+
+            result_df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            if on_complete is not None:
+                on_complete(result_df)
+            self._count('completed', handle)
+            return result_df
+        except QueryTimeoutError:
+            self._count('timed_out', handle)
+            raise
+        except QueryCancelledError:
+            self._count('cancelled', handle)
+            raise
+        except QueryLimitExceededError:
+            self._count('rejected', handle)
+            raise
+        except Exception:
+            self._count('failed', handle)
+            raise
+        finally:
+            handle.finished_at = time.monotonic()
+
+    def _count(self, counter: str, handle: QueryHandle):
+        handle.outcome = counter
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for h in self._handles.values() if not h.done())
+            return dict(self.counters, running=running)
+
+    def shutdown(self):
+        with self._lock:
+            handles = list(self._handles.values())
+        for handle in handles:
+            self.cancel(handle.id)
+        self._workers.shutdown(wait=False)
+
+@st.cache_resource(show_spinner=False)
+def get_query_executor(db_path: str) -> QueryExecutor:
+    """Query worker pool shared by every session reading this database"""
+    return QueryExecutor(
+        get_connection_pool(db_path),
+        default_timeout=float(os.environ.get('BI_CHATBOT_QUERY_TIMEOUT', '30')),
+        max_rows=int(os.environ.get('BI_CHATBOT_MAX_ROWS', '1000000'))
+    )
+
+class Span:
+    """One timed stage of the question pipeline"""
+
+    def __init__(self, stage: str, trace_id: Optional[str], attributes: Dict[str, Any]):
+        self.stage = stage
+        self.trace_id = trace_id
+        self.attributes = dict(attributes)
+        self.started_at = time.time()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stage': self.stage,
+            'trace_id': self.trace_id,
+            'started_at': self.started_at,
+            'duration_ms': round((self.duration or 0.0) * 1000, 3),
+            **self.attributes
+        }
+
+class PipelineTracer:
+    """Tracing spans and latency histograms for each stage of the question pipeline.
+
+    Stages (interpret, execute, insights, visualization) record their
+    duration plus attributes such as row counts, result bytes and cache
+    hits. Histograms export as Prometheus text and recent spans as JSONL.
+    Optional hooks: cProfile for selected stages (``profile_stages``) and a
+    slow-query log for spans slower than ``slow_query_seconds``.
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, max_spans: int = 10000, slow_query_seconds: Optional[float] = None,
+                 slow_log_path: Optional[str] = None, profile_stages: Optional[List[str]] = None,
+                 profile_dir: Optional[str] = None):
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_log_path = slow_log_path
+        self.profile_stages = set(profile_stages or [])
+        self.profile_dir = profile_dir
+
+        self._lock = threading.Lock()
+        self._spans: deque = deque(maxlen=max_spans)
+        self._histograms: Dict[str, Dict[str, Any]] = {}
+        self._hooks: List[Callable[[Span], None]] = []
+        self._local = threading.local()
+        self._server = None
+
+    @contextmanager
+    def trace(self, trace_id: Optional[str] = None) -> Iterator[str]:
+        """Group the spans recorded on this thread under one trace id"""
+        previous = getattr(self._local, 'trace_id', None)
+        self._local.trace_id = trace_id or uuid.uuid4().hex[:12]
+        try:
+            yield self._local.trace_id
+        finally:
+            self._local.trace_id = previous
+
+    @property
+    def current_trace_id(self) -> Optional[str]:
+        return getattr(self._local, 'trace_id', None)
+
+    @contextmanager
+    def span(self, stage: str, **attributes) -> Iterator[Span]:
+        """Time a block as one stage; attributes can be added with span.set()"""
+        span = Span(stage, self.current_trace_id, attributes)
+        profiler = cProfile.Profile() if stage in self.profile_stages else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            span.duration = time.perf_counter() - start
+            if profiler is not None:
+                self._dump_profile(span, profiler)
+            self._finish(span)
+
+    def record(self, stage: str, duration: float, trace_id: Optional[str] = None, **attributes) -> Span:
+        """Record a span measured elsewhere (e.g. on a worker thread)"""
+        span = Span(stage, trace_id if trace_id is not None else self.current_trace_id, attributes)
+        span.started_at -= duration
+        span.duration = duration
+        self._finish(span)
+        return span
+
+    def add_hook(self, hook: Callable[[Span], None]):
+        """Call ``hook(span)`` for every finished span"""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            histogram = self._histograms.setdefault(
+                span.stage, {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+            )
+            for i, bound in enumerate(self.BUCKETS):
+                if span.duration <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += span.duration
+            histogram['count'] += 1
+            hooks = list(self._hooks)
+
+        if self.slow_query_seconds is not None and span.duration >= self.slow_query_seconds:
+            self._log_slow(span)
+        for hook in hooks:
+            try:
+                hook(span)
+            except Exception:
+                logger.exception("Tracing hook failed")
+
+    def _log_slow(self, span: Span):
+        record = span.to_dict()
+        logger.warning("Slow %s stage: %.1f ms %s", span.stage, record['duration_ms'], span.attributes.get('sql', ''))
+        if self.slow_log_path:
+            with self._lock, open(self.slow_log_path, 'a', encoding='utf-8') as log:
+                log.write(json.dumps(record, default=str) + '\n')
+
+    def _dump_profile(self, span: Span, profiler: cProfile.Profile):
+        directory = self.profile_dir or tempfile.gettempdir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{span.stage}_{int(span.started_at * 1000)}_{uuid.uuid4().hex[:6]}.prof")
+        profiler.dump_stats(path)
+        span.set(profile=path)
+
+    def spans(self, stage: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            return [span for span in self._spans if stage is None or span.stage == stage]
+
+    def stage_summary(self) -> pd.DataFrame:
+        """Count and p50/p95/p99 latency (ms) per stage over the retained spans"""
+        rows = []
+        by_stage: Dict[str, List[float]] = {}
+        for span in self.spans():
+            by_stage.setdefault(span.stage, []).append(span.duration * 1000)
+        for stage, durations in by_stage.items():
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            rows.append({'stage': stage, 'count': len(durations), 'p50_ms': p50, 'p95_ms': p95,
+                         'p99_ms': p99, 'max_ms': max(durations)})
+        return pd.DataFrame(rows)
+
+    def to_prometheus(self) -> str:
+        """Latency histograms in the Prometheus text exposition format"""
+        name = 'bi_chatbot_stage_duration_seconds'
+        lines = [f"# HELP {name} Duration of question pipeline stages.", f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in self.spans())
+
+    def export_jsonl(self, path: str):
+        with open(path, 'w', encoding='utf-8') as out:
+            out.write(self.to_jsonl())
+
+    def serve_metrics(self, port: int, host: str = '127.0.0.1'):
+        """Serve /metrics (Prometheus) and /spans (JSONL) from a background thread"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics'):
+                    body, content_type = tracer.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path.startswith('/spans'):
+                    body, content_type = tracer.to_jsonl(), 'application/x-ndjson'
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, name='bi-metrics', daemon=True).start()
+        return self._server
+
+@st.cache_resource(show_spinner=False)
+def get_pipeline_tracer() -> PipelineTracer:
+    """Process-wide tracer, configured from BI_CHATBOT_* environment variables"""
+    slow_ms = os.environ.get('BI_CHATBOT_SLOW_QUERY_MS')
+    profile_stages = os.environ.get('BI_CHATBOT_PROFILE_STAGES', '')
+    tracer = PipelineTracer(
+        slow_query_seconds=float(slow_ms) / 1000 if slow_ms else None,
+        slow_log_path=os.environ.get('BI_CHATBOT_SLOW_QUERY_LOG'),
+        profile_stages=[stage.strip() for stage in profile_stages.split(',') if stage.strip()],
+        profile_dir=os.environ.get('BI_CHATBOT_PROFILE_DIR')
+    )
+    metrics_port = os.environ.get('BI_CHATBOT_METRICS_PORT')
+    if metrics_port:
+        tracer.serve_metrics(int(metrics_port))
+    return tracer
+
+class ChartRenderer:
+    """Plotly figures sized for the browser, cached by result fingerprint.
+
+    Long series are reduced to ``max_points`` with LTTB (largest triangle three
+    buckets), after a min/max pre-pass for very long inputs; categories beyond
+    ``max_categories`` fold into an "Other" bar. Series that still exceed
+    ``webgl_threshold`` points render as WebGL traces. Rendered figures are
+    kept as JSON, so history reruns skip Plotly Express entirely.
+    """
+
+    TIME_HINTS = ('date', 'month', 'time')
+
+    def __init__(self, max_points: int = 2000, max_categories: int = 20, webgl_threshold: int = 1000,
+                 max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_points = max_points
+        self.max_categories = max_categories
+        self.webgl_threshold = webgl_threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[str, str]' = OrderedDict()
+        self._bytes = 0
+        self._counters = {'hits': 0, 'misses': 0, 'downsampled': 0, 'bucketed': 0, 'webgl': 0}
+
+    @staticmethod
+    def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+        """Indices of each bucket's min and max (plus both endpoints), fully vectorized"""
+        n = len(y)
+        size = int(np.ceil(n / buckets))
+        padded = np.full(size * buckets, np.nan)
+        padded[:n] = y
+        blocks = padded.reshape(buckets, size)
+        offsets = np.arange(buckets) * size
+        valid = ~np.all(np.isnan(blocks), axis=1)
+        blocks = np.where(np.isnan(blocks[valid]), np.nanmean(y), blocks[valid])
+        lows = offsets[valid] + blocks.argmin(axis=1)
+        highs = offsets[valid] + blocks.argmax(axis=1)
+        return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+    @staticmethod
+    def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+        """Largest-triangle-three-buckets: keep the points that preserve the visual shape"""
+        n = len(x)
+        if threshold >= n or threshold < 3:
+            return np.arange(n)
+        # Bucket i covers [edges[i], edges[i + 1]); the first and last points are always kept
+        edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+        edges[-1] = n - 1
+        selected = np.empty(threshold, dtype=np.int64)
+        selected[0], selected[-1] = 0, n - 1
+        previous = 0
+        for bucket in range(threshold - 2):
+            start, end = edges[bucket], edges[bucket + 1]
+            next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+            mean_x, mean_y = x[end:next_end].mean(), y[end:next_end].mean()
+            bucket_x, bucket_y = x[start:end], y[start:end]
+            areas = np.abs((x[previous] - mean_x) * (bucket_y - y[previous])
+                           - (x[previous] - bucket_x) * (mean_y - y[previous]))
+            previous = start + int(areas.argmax())
+            selected[bucket + 1] = previous
+        return selected
+
+    def downsample(self, df: pd.DataFrame, x_column: str, y_column: str) -> pd.DataFrame:
+        """Sort a series by x and reduce it to at most max_points rows"""
+        x_values = df[x_column]
+        if not pd.api.types.is_numeric_dtype(x_values):
+            parsed = pd.to_datetime(x_values, errors='coerce')
+            x_values = parsed if parsed.notna().all() else pd.Series(np.arange(len(df)), index=df.index)
+        x = x_values.to_numpy(dtype=np.float64) if pd.api.types.is_numeric_dtype(x_values) \
+            else x_values.to_numpy().astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+        if not np.all(x[1:] >= x[:-1]):
+            order = np.argsort(x, kind='stable')
+            df, x = df.iloc[order], x[order]
+        if len(df) <= self.max_points:
+            return df
+
+        y = df[y_column].to_numpy(dtype=np.float64, na_value=np.nan)
+        y = np.where(np.isnan(y), 0.0, y)
+        candidates = np.arange(len(df))
+        if len(df) > self.max_points * 50:
+            # MinMax pre-selection keeps LTTB's Python loop over a bounded input
+            candidates = self.minmax_indices(y, self.max_points * 4)
+        keep = candidates[self.lttb_indices(x[candidates], y[candidates], self.max_points)]
+        return df.iloc[keep]
+
+    def bucket_categories(self, df: pd.DataFrame, label_column: str, value_column: str) -> pd.DataFrame:
+        """Keep the top categories by value and fold the rest into 'Other'"""
+        grouped = df[[label_column, value_column]]
+        additive = InsightEngine.is_additive(value_column, InsightEngine.column_kind(value_column))
+        if not grouped[label_column].is_unique:
+            grouped = grouped.groupby(label_column, as_index=False, sort=False)[value_column].agg(
+                'sum' if additive else 'mean')
+        if len(grouped) <= self.max_categories:
+            return grouped
+        keep = self.max_categories - 1
+        ranked = grouped.sort_values(value_column, ascending=False, kind='stable')
+        rest = ranked[value_column].iloc[keep:]
+        other = pd.DataFrame({label_column: [f"Other ({len(rest):,})"],
+                              value_column: [rest.sum() if additive else rest.mean()]})
+        return pd.concat([ranked.iloc[:keep], other], ignore_index=True)
+
+    def chart_spec(self, df: pd.DataFrame) -> Optional[Tuple[str, str, str]]:
+        """(kind, x column, y column) for the result shape, or None when nothing fits"""
+        if df.empty or len(df.columns) < 2:
+            return None
+
+        numeric_cols = df.select_dtypes(include=[np.number]).columns
+        categorical_cols = df.select_dtypes(exclude=[np.number]).columns
+
+        # Time series detection
+        date_cols = [col for col in df.columns if any(hint in col.lower() for hint in self.TIME_HINTS)]
+
+        if len(date_cols) > 0 and len(numeric_cols) > 0:
+            return 'line', date_cols[0], numeric_cols[0]
+        if len(categorical_cols) > 0 and len(numeric_cols) > 0:
+            return 'bar', categorical_cols[0], numeric_cols[0]
+        return None
+
+    def build(self, df: pd.DataFrame, spec: Tuple[str, str, str]) -> "go.Figure":
+        """Build the chart for a spec from reduced data"""
+        import plotly.express as px
+
+        kind, x_column, y_column = spec
+        if kind == 'line':
+            plot_df = self.downsample(df[[x_column, y_column]], x_column, y_column)
+            if len(plot_df) < len(df):
+                self._count('downsampled')
+            render_mode = 'webgl' if len(plot_df) > self.webgl_threshold else 'svg'
+            if render_mode == 'webgl':
+                self._count('webgl')
+            return px.line(plot_df, x=x_column, y=y_column, render_mode=render_mode,
+                           title=f"{y_column.replace('_', ' ').title()} Over Time")
+
+        plot_df = self.bucket_categories(df, x_column, y_column)
+        if len(plot_df) < len(df):
+            self._count('bucketed')
+        fig = px.bar(plot_df, x=x_column, y=y_column,
+                     title=f"{y_column.replace('_', ' ').title()} by {x_column.replace('_', ' ').title()}")
+        fig.update_xaxes(tickangle=45)
+        return fig
+
+    def render(self, df: pd.DataFrame) -> Tuple[Optional["go.Figure"], bool]:
+        """Figure for a result and whether it came from the cache"""
+        import plotly.io as pio
+
+        spec = self.chart_spec(df)
+        if spec is None:
+            return None, False
+        # Only the plotted columns affect the figure, so only they are hashed
+        key = f"{spec[0]}:{result_fingerprint(df[list(spec[1:])])}"
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._counters['hits'] += 1
+        if cached is not None:
+            return pio.from_json(cached), True
+
+        fig = self.build(df, spec)
+        payload = fig.to_json()
+        with self._lock:
+            self._counters['misses'] += 1
+            if key not in self._cache and len(payload) <= self.max_bytes:
+                self._cache[key] = payload
+                self._bytes += len(payload)
+                while len(self._cache) > self.max_entries or self._bytes > self.max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._bytes -= len(evicted)
+        return fig, False
+
+    def _count(self, counter: str):
+        # Renders run concurrently across sessions (and benchmark threads)
+        with self._lock:
+            self._counters[counter] += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._cache), 'bytes': self._bytes, **self._counters}
+
+@st.cache_resource(show_spinner=False)
+def get_chart_renderer() -> ChartRenderer:
+    """Figure cache shared by every session"""
+    return ChartRenderer()
+
+class ResultFrameStore:
+    """Process-wide home for result frames referenced from conversation history.
+
+    Frames are written through to ``directory`` (Parquet when pyarrow is
+    installed, pickle otherwise) under their result fingerprint, and a
+    memory-budgeted LRU keeps recently used ones loaded. Anything evicted from
+    memory is read back from disk on demand; the disk cache has its own budget,
+    oldest files first.
+    """
+
+    def __init__(self, directory: str, memory_budget_bytes: int = 256 * 1024 * 1024,
+                 disk_budget_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.use_parquet = 'parquet' in StreamingExporter.available_formats()
+        self._lock = threading.Lock()
+        self._frames: 'OrderedDict[str, Tuple[pd.DataFrame, int]]' = OrderedDict()
+        self._memory_bytes = 0
+        self._counters = {'puts': 0, 'memory_hits': 0, 'disk_loads': 0, 'misses': 0, 'spilled_bytes': 0,
+                          'memory_evictions': 0, 'disk_evictions': 0}
+
+    @staticmethod
+    def frame_bytes(df: pd.DataFrame) -> int:
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.{'parquet' if self.use_parquet else 'pkl'}")
+
+    def _write(self, key: str, df: pd.DataFrame):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        if self.use_parquet:
+            df.to_parquet(temp_path, index=False)
         else:
-            return "SELECT * FROM sales LIMIT 10"
-    
-    def generate_insights(self, query_result: pd.DataFrame, original_query: str) -> str:
-        """Generate natural language insights from query results"""
-        if query_result.empty:
-            return "No data found for your query."
-        
-        insights = []
-        
-        # Check for trends in numerical data
-        numeric_cols = query_result.select_dtypes(include=[np.number]).columns
-        if len(numeric_cols) > 0:
-            for col in numeric_cols:
-                total = query_result[col].sum()
-                avg = query_result[col].mean()
-                insights.append(f"Total {col.replace('_', ' ')}: ${total:,.2f}")
-                insights.append(f"Average {col.replace('_', ' ')}: ${avg:,.2f}")
-        
-        # Check for top performers
-        if len(query_result) > 1:
-            first_row = query_result.iloc[0]
-            if 'name' in str(first_row.index).lower() or 'customer' in str(first_row.index).lower():
-                name_col = [col for col in query_result.columns if 'name' in col.lower() or 'customer' in col.lower()]
-                if name_col:
-                    top_performer = first_row[name_col[0]]
-                    insights.append(f"Top performer: {top_performer}")
-        
-        return "\\n".join(insights) if insights else "Data retrieved successfully."
+            df.to_pickle(temp_path)
+        os.replace(temp_path, path)
+        self._counters['spilled_bytes'] += os.path.getsize(path)
+        self._enforce_disk_budget()
+
+    def _enforce_disk_budget(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(('.parquet', '.pkl')):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_budget_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self._counters['disk_evictions'] += 1
+
+    def _remember(self, key: str, df: pd.DataFrame, size: int):
+        """Add to the in-memory LRU; caller holds the lock"""
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return
+        self._frames[key] = (df, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_budget_bytes and len(self._frames) > 1:
+            _, (_, evicted_size) = self._frames.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._counters['memory_evictions'] += 1
+
+    def put(self, df: pd.DataFrame) -> Tuple[str, int]:
+        """Store a frame and return (key, in-memory size)"""
+        key = result_fingerprint(df)
+        size = self.frame_bytes(df)
+        self._write(key, df)
+        with self._lock:
+            self._counters['puts'] += 1
+            self._remember(key, df, size)
+        return key, size
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """A stored frame (do not mutate it), loading it from disk if it was evicted"""
+        with self._lock:
+            cached = self._frames.get(key)
+            if cached is not None:
+                self._frames.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return cached[0]
+        path = self._path(key)
+        if not os.path.exists(path):
+            with self._lock:
+                self._counters['misses'] += 1
+            return None
+        df = pd.read_parquet(path) if self.use_parquet else pd.read_pickle(path)
+        with self._lock:
+            self._counters['disk_loads'] += 1
+            self._remember(key, df, self.frame_bytes(df))
+        return df
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'frames_in_memory': len(self._frames), 'memory_bytes': self._memory_bytes,
+                    'memory_budget_bytes': self.memory_budget_bytes, **self._counters}
+
+@st.cache_resource(show_spinner=False)
+def get_result_frame_store(db_path: str) -> ResultFrameStore:
+    """Result frame store shared by every session reading this database"""
+    return ResultFrameStore(
+        os.path.join(cache_directory(db_path), 'results'),
+        memory_budget_bytes=int(float(os.environ.get('BI_CHATBOT_RESULT_MEMORY_MB', '256')) * 1024 * 1024),
+        disk_budget_bytes=int(float(os.environ.get('BI_CHATBOT_RESULT_DISK_MB', '1024')) * 1024 * 1024)
+    )
 
 @dataclass
-class BusinessDataConnection:
-    name: str
-    type: str  # 'sqlite', 'csv', 'api'
-    connection_string: str
-    tables: List[str]
-    description: str
+class HistoryEntry:
+    """What a session keeps per question: text plus a key into the ResultFrameStore"""
+    query: str
+    sql: str
+    insights: str
+    timestamp: datetime
+    rows: int
+    columns: List[str]
+    result_key: Optional[str] = None
+    result_bytes: int = 0
+
+class ConversationHistory:
+    """Per-session question history holding compact entries instead of frames.
+
+    At most ``max_entries`` entries are kept. Once the results they reference
+    exceed ``result_budget_bytes``, the oldest entries drop their result key
+    and keep only the question, SQL and insights.
+    """
+
+    def __init__(self, store: ResultFrameStore, max_entries: int = 50,
+                 result_budget_bytes: int = 64 * 1024 * 1024):
+        self.store = store
+        self.max_entries = max_entries
+        self.result_budget_bytes = result_budget_bytes
+        self.entries: List[HistoryEntry] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, query: str, sql_query: str, results_df: pd.DataFrame, insights: str) -> HistoryEntry:
+        result_key, result_bytes = self.store.put(results_df)
+        entry = HistoryEntry(query=query, sql=sql_query, insights=insights, timestamp=datetime.now(),
+                             rows=len(results_df), columns=[str(col) for col in results_df.columns],
+                             result_key=result_key, result_bytes=result_bytes)
+        self.entries.append(entry)
+        del self.entries[:-self.max_entries]
+        retained = 0
+        for older in reversed(self.entries):
+            retained += older.result_bytes
+            if older.result_key is not None and retained > self.result_budget_bytes and older is not entry:
+                older.result_key, older.result_bytes = None, 0
+        return entry
+
+    def recent(self, count: int = 5) -> List[HistoryEntry]:
+        """Newest first"""
+        return list(reversed(self.entries[-count:]))
+
+    def load(self, entry: HistoryEntry) -> Optional[pd.DataFrame]:
+        if entry.result_key is None:
+            return None
+        return self.store.get(entry.result_key)
+
+    def clear(self):
+        self.entries = []
+
+@dataclass
+class ResultFilter:
+    """A refinement predicate: a column in (or not in) a set of values, or compared with a number"""
+
+    column: str
+    operator: str  # 'in', 'not in', '>', '>=', '<' or '<='
+    value: Any     # list of values for in / not in, a number otherwise
+
+    COMPARISONS = {'>': pd.Series.gt, '>=': pd.Series.ge, '<': pd.Series.lt, '<=': pd.Series.le}
+
+    def sql(self) -> str:
+        column = quote_identifier(self.column)
+        if self.operator in ('in', 'not in'):
+            return f"{column} {self.operator.upper()} ({', '.join(sql_literal(value) for value in self.value)})"
+        return f"{column} {self.operator} {sql_literal(self.value)}"
+
+    def mask(self, df: pd.DataFrame) -> pd.Series:
+        series = df[self.column]
+        if self.operator == 'in':
+            return series.isin(self.value)
+        if self.operator == 'not in':
+            return ~series.isin(self.value)
+        return self.COMPARISONS[self.operator](series, self.value)
+
+    def describe(self) -> str:
+        if self.operator in ('in', 'not in'):
+            values = ' or '.join(str(value) for value in self.value)
+            return f"{self.column} {'is' if self.operator == 'in' else 'is not'} {values}"
+        return f"{self.column} {self.operator} {self.value:,}"
+
+@dataclass
+class ContextTurn:
+    """An answer a follow-up can refine: its SQL, how it was built and where its rows live"""
+    sql: str
+    query: Optional[AggregateQuery] = None  # structured form when the answer is a generated aggregate
+    filters: Dict[str, ResultFilter] = field(default_factory=dict)  # value filters on top of ``query``, by column
+    # The rows are the first ``limit`` by ``order_by`` (no limit: all of them, in that order)
+    order_by: Optional[str] = None
+    ascending: bool = False
+    limit: Optional[int] = None
+    # Re-sorted after the limit was applied ("top 3", then "sort alphabetically")
+    sort_by: Optional[str] = None
+    sort_ascending: bool = False
+    description: str = ''
+    entry: Optional[HistoryEntry] = None
+    frame: Optional[pd.DataFrame] = None  # set when a refinement was answered from the previous rows
+
+class ConversationContext:
+    """Per-session memory of the last answer, so follow-ups refine it instead of starting over.
+
+    A follow-up ("now only the North region", "just the top 3", "break it
+    down by rep") is parsed into filters, an ordering, a limit, a new
+    grouping or a new date range relative to the previous answer. When the
+    previous rows already contain the answer, it is computed from them in
+    memory. Otherwise a generated aggregate is rebuilt with the filters in its
+    WHERE clause, or the previous SQL is queried as a subquery. Values are
+    matched against the previous rows and the schema catalog's samples.
+    """
+
+    # Where "drill into <value>" goes when no grouping is named
+    DRILL_PATH = {'category': 'product_name', 'region': 'sales_rep', 'sales_rep': 'customer_name'}
+    THRESHOLD_OPERATORS = {
+        'over': '>', 'above': '>', 'more than': '>', 'greater than': '>', 'exceeding': '>', 'at least': '>=',
+        'under': '<', 'below': '<', 'less than': '<', 'fewer than': '<', 'at most': '<=',
+    }
+    SCALES = {'k': 1e3, 'thousand': 1e3, 'm': 1e6, 'million': 1e6}
+
+    _FOLLOW_UP_RE = re.compile(
+        r"^(?:and|but|now|then|also|same|instead|what about|how about|show only|keep|filter|sort|drill|dig|zoom|"
+        r"break|split|narrow|by|per)\b|\b(?:only|just|instead|those|these|them|exclude|excluding|except|without)\b"
+    )
+    _NEGATION_RE = re.compile(r"\b(?:not|exclude|excluding|except|without|other than|apart from)\s+(?:(?:the|for|in)\s+)?$")
+    _THRESHOLD_RE = re.compile(
+        r"\b(" + '|'.join(THRESHOLD_OPERATORS) + r")\s+\$?(\d[\d,]*(?:\.\d+)?)\s*(k|m|thousand|million)?\b"
+    )
+    _SORT_RE = re.compile(r"\b(?:sort|sorted|rank|ranked|arrange|order by|ordered by)\b")
+    _SORT_ASCENDING_RE = re.compile(r"\b(?:asc|ascending|increasing|alphabetical|alphabetically|a to z|lowest first|smallest first)\b")
+    _ALPHABETICAL_RE = re.compile(r"\b(?:alphabetical|alphabetically|a to z)\b")
+    _DRILL_RE = re.compile(r"\b(?:drill|dig|zoom)\b")
+
+    def __init__(self, history: ConversationHistory, catalog: SchemaCatalog, engine: IntentEngine,
+                 max_values_per_column: int = 500):
+        self.history = history
+        self.catalog = catalog
+        self.engine = engine
+        self.max_values_per_column = max_values_per_column
+        self.turn: Optional[ContextTurn] = None
+
+    def remember(self, sql_query: str, entry: HistoryEntry, turn: Optional[ContextTurn] = None):
+        """Make an answer (a refinement's turn, or a fresh query's SQL) the one follow-ups refine"""
+        if turn is None:
+            turn = ContextTurn(sql=sql_query, query=AggregateQuery.parse(sql_query))
+            if turn.query is not None:
+                turn.order_by, turn.ascending, turn.limit = (
+                    turn.query.order_by, not turn.query.descending, turn.query.limit)
+        turn.entry = entry
+        turn.frame = None  # the history's result store keeps the rows
+        self.turn = turn
+
+    def clear(self):
+        self.turn = None
+
+    def refine(self, question: str) -> Optional[ContextTurn]:
+        """Answer a follow-up relative to the last answer, or None when it reads as a new question"""
+        turn = self.turn
+        if turn is None or turn.entry is None:
+            return None
+        text = self.engine.normalize(question)
+        slots = self.engine.extract_slots(question)
+        if not self._FOLLOW_UP_RE.search(text):
+            # Without a cue word, only questions naming no metric, grouping or period are follow-ups
+            if 'metric' in slots or slots['dimensions'] or 'period' in slots:
+                return None
+        elif 'metric' in slots and self._metric_column(turn, slots['metric']) is None:
+            return None
+
+        frame = self.history.load(turn.entry)
+        columns = turn.entry.columns
+        measure = self._measure(turn, frame)
+        values = self._match_values(text, turn, frame)
+        thresholds = self._match_thresholds(question.lower(), slots, turn, measure)
+        limit = slots.get('limit')
+        order_by, ascending = self._match_order(text, slots, turn, measure, limit is not None)
+
+        dimension = None if self._SORT_RE.search(text) else self.engine.grouping_dimension(question)
+        if dimension is None and values and self._DRILL_RE.search(text):
+            dimension = self.DRILL_PATH.get(values[0].column)
+        if dimension is not None and turn.query is not None and turn.query.dimension == (
+                AggregateQuery.MONTH if dimension == 'month' else dimension):
+            dimension = None
+        period = slots.get('period')
+        if not (values or thresholds or order_by or dimension or period):
+            return None
+
+        filters = dict(turn.filters)
+        filters.update((value_filter.column, value_filter) for value_filter in values)
+        # "what about the South" after "only the North" replaces a filter the previous rows already applied
+        replaced = any(value_filter.column in turn.filters for value_filter in values)
+        missing = any(predicate.column not in columns for predicate in values + thresholds)
+        truncated = turn.limit is not None and limit is not None and (
+            limit > turn.limit or order_by != turn.order_by or ascending != turn.ascending)
+        if not (dimension or period or replaced or missing or truncated):
+            return self._refine_rows(turn, frame, values + thresholds, filters, order_by, ascending, limit)
+        if turn.query is None:
+            return None
+        return self._rebuild(turn, filters, thresholds, order_by, ascending, limit, dimension, period)
+
+    def _refine_rows(self, turn: ContextTurn, frame: Optional[pd.DataFrame], predicates: List[ResultFilter],
+                     filters: Dict[str, ResultFilter], order_by: Optional[str], ascending: bool,
+                     limit: Optional[int]) -> ContextTurn:
+        """Filter, sort and cut the previous rows (or, if they were evicted, its SQL as a subquery)"""
+        source_columns = self._source_columns(turn)
+        refined = ContextTurn(
+            sql=self.wrap_sql(turn.sql, predicates, order_by, ascending, limit),
+            query=turn.query,
+            filters={column: value_filter for column, value_filter in filters.items() if column in source_columns},
+            order_by=turn.order_by, ascending=turn.ascending, limit=turn.limit,
+            sort_by=turn.sort_by, sort_ascending=turn.sort_ascending,
+            description=self._describe(predicates, None, None, order_by, ascending, limit)
+        )
+        if limit is not None or (order_by and turn.limit is None):
+            refined.order_by, refined.ascending, refined.sort_by = order_by, ascending, None
+            if limit is not None:
+                refined.limit = limit
+        elif order_by:
+            refined.sort_by, refined.sort_ascending = order_by, ascending
+        if frame is not None:
+            for predicate in predicates:
+                frame = frame[predicate.mask(frame)]
+            if order_by:
+                frame = frame.sort_values(order_by, ascending=ascending, kind='stable')
+            if limit is not None:
+                frame = frame.head(limit)
+            refined.frame = frame.reset_index(drop=True)
+        return refined
+
+    def _rebuild(self, turn: ContextTurn, filters: Dict[str, ResultFilter], thresholds: List[ResultFilter],
+                 order_by: Optional[str], ascending: bool, limit: Optional[int], dimension: Optional[str],
+                 period: Optional[str]) -> Optional[ContextTurn]:
+        """Re-render the previous aggregate with the filters pushed below its GROUP BY.
+
+        The previous answer's ordering and limit carry over unless the
+        follow-up regroups or sets its own.
+        """
+        source_columns = self._source_columns(turn)
+        if any(column not in source_columns for column in filters):
+            return None
+        query = turn.query
+        if turn.order_by is not None or turn.limit is not None:
+            query = replace(query, order_by=turn.order_by, descending=not turn.ascending, limit=turn.limit)
+        sort_by, sort_ascending = turn.sort_by, turn.sort_ascending
+        if dimension is not None:
+            sort_by = None
+            if dimension == 'month':
+                query = replace(query, dimension=AggregateQuery.MONTH, dimension_alias='month',
+                                order_by='month', descending=False, limit=None)
+            elif dimension in source_columns:
+                query = replace(query, dimension=dimension, dimension_alias=None,
+                                order_by=query.aggregates[0][2], descending=True, limit=None)
+            else:
+                return None
+        if period is not None:
+            query = replace(query, date_from=period)
+        if order_by is not None and (limit is not None or dimension is None):
+            if limit is not None or query.limit is None:
+                query = replace(query, order_by=order_by, descending=not ascending,
+                                limit=limit if limit is not None else query.limit)
+                sort_by = None
+            else:
+                # Re-sorting a top N keeps the same N rows
+                sort_by, sort_ascending = order_by, ascending
+
+        predicates = [value_filter.sql() for value_filter in filters.values()]
+        if thresholds:
+            # Thresholds apply to the aggregated values, before the ordering and limit
+            inner = replace(query, order_by=None, descending=False, limit=None).to_sql(predicates)
+            sql = self.wrap_sql(inner, thresholds, query.order_by, not query.descending, query.limit)
+        else:
+            sql = query.to_sql(predicates)
+        if sort_by:
+            sql = self.wrap_sql(sql, [], sort_by, sort_ascending)
+        return ContextTurn(
+            sql=sql, query=query, filters=filters,
+            order_by=query.order_by, ascending=not query.descending, limit=query.limit,
+            sort_by=sort_by, sort_ascending=sort_ascending,
+            description=self._describe(list(filters.values()) + thresholds, dimension, period,
+                                       order_by, ascending, limit)
+        )
+
+    @staticmethod
+    def wrap_sql(sql_query: str, predicates: List[ResultFilter], order_by: Optional[str] = None,
+                 ascending: bool = False, limit: Optional[int] = None) -> str:
+        """Refine a previous query by selecting from it as a subquery"""
+        sql = f"SELECT * FROM ({QueryResultCache.normalize_sql(sql_query)}) AS previous"
+        if predicates:
+            sql += " WHERE " + " AND ".join(predicate.sql() for predicate in predicates)
+        if order_by:
+            sql += f" ORDER BY {quote_identifier(order_by)}{'' if ascending else ' DESC'}"
+        if limit is not None:
+            sql += f" LIMIT {limit}"
+        return sql
+
+    def _source_columns(self, turn: ContextTurn) -> set:
+        table = self.catalog.table(turn.query.table) if turn.query is not None else None
+        return set(table.column_names) if table is not None else set()
+
+    def _metric_column(self, turn: ContextTurn, metric: str) -> Optional[str]:
+        """Output column of the previous aggregate that computes an intent engine metric"""
+        if turn.query is None:
+            return None
+        expression = self.engine.METRICS[metric][0]
+        for func, arg, alias in turn.query.aggregates:
+            if f"{func}({arg})".lower() == expression.lower():
+                return alias
+        return None
+
+    def _measure(self, turn: ContextTurn, frame: Optional[pd.DataFrame]) -> Optional[str]:
+        """The column thresholds and top/bottom limits apply to by default"""
+        if turn.query is not None:
+            aliases = [alias for _, _, alias in turn.query.aggregates]
+            return turn.query.order_by if turn.query.order_by in aliases else aliases[0]
+        if frame is not None:
+            numeric = frame.select_dtypes(include=[np.number]).columns
+            return str(numeric[-1]) if len(numeric) else None
+        return None
+
+    def _match_values(self, text: str, turn: ContextTurn, frame: Optional[pd.DataFrame]) -> List[ResultFilter]:
+        """Values named in the question, from the previous rows and the catalog's column samples"""
+        candidates: Dict[str, List[Tuple[str, Any]]] = {}
+
+        def add(column: str, value: Any):
+            phrase = self.engine.normalize(value) if isinstance(value, str) else ''
+            if phrase and (column, value) not in candidates.setdefault(phrase, []):
+                candidates[phrase].append((column, value))
+
+        if frame is not None:
+            for column in frame.columns:
+                if not pd.api.types.is_numeric_dtype(frame[column]):
+                    for value in frame[column].dropna().unique()[:self.max_values_per_column]:
+                        add(str(column), value)
+        table = self.catalog.table(turn.query.table) if turn.query is not None else None
+        for col in (table.columns if table is not None else []):
+            for value in col.samples:
+                add(col.name, value)
+        if not candidates:
+            return []
+
+        grouped: Dict[Tuple[str, str], List[Any]] = {}
+        for start, _, phrase in KeywordAutomaton(list(candidates)).find_longest(text):
+            # A value can occur in several columns; prefer one the previous answer shows
+            matches = candidates[phrase]
+            column, value = next(((col, val) for col, val in matches if col in turn.entry.columns), matches[0])
+            operator = 'not in' if self._NEGATION_RE.search(text[:start]) else 'in'
+            values = grouped.setdefault((column, operator), [])
+            if value not in values:
+                values.append(value)
+        return [ResultFilter(column, operator, values) for (column, operator), values in grouped.items()]
+
+    def _match_thresholds(self, text: str, slots: Dict[str, Any], turn: ContextTurn,
+                          measure: Optional[str]) -> List[ResultFilter]:
+        column = (self._metric_column(turn, slots['metric']) if 'metric' in slots else None) or measure
+        if column is None:
+            return []
+        thresholds = []
+        for word, number, scale in self._THRESHOLD_RE.findall(text):
+            value = float(number.replace(',', '')) * self.SCALES.get(scale, 1)
+            thresholds.append(ResultFilter(column, self.THRESHOLD_OPERATORS[word], int(value) if value.is_integer() else value))
+        return thresholds
+
+    def _match_order(self, text: str, slots: Dict[str, Any], turn: ContextTurn, measure: Optional[str],
+                     limited: bool) -> Tuple[Optional[str], bool]:
+        """Column and direction to sort by: explicit "sort by ...", or the measure for top/bottom N"""
+        ascending = bool(slots.get('ascending'))
+        if not self._SORT_RE.search(text):
+            return (measure, ascending) if limited else (None, False)
+        ascending = ascending or bool(self._SORT_ASCENDING_RE.search(text))
+        columns = turn.entry.columns
+        if 'metric' in slots:
+            return self._metric_column(turn, slots['metric']) or measure, ascending
+        for dimension in slots['dimensions']:
+            if dimension in columns:
+                return dimension, ascending
+        for column in columns:
+            if f" {self.engine.normalize(column)} " in f" {text} ":
+                return column, ascending
+        if self._ALPHABETICAL_RE.search(text):
+            labels = [column for column in columns if column != measure]
+            return (labels[0] if labels else measure), True
+        return measure, ascending
+
+    @staticmethod
+    def _describe(predicates: List[ResultFilter], dimension: Optional[str], period: Optional[str],
+                  order_by: Optional[str], ascending: bool, limit: Optional[int]) -> str:
+        parts = [predicate.describe() for predicate in predicates]
+        if dimension:
+            parts.append(f"grouped by {dimension}")
+        if period:
+            parts.append("new date range")
+        if limit is not None:
+            parts.append(f"{'bottom' if ascending else 'top'} {limit} by {order_by}")
+        elif order_by:
+            parts.append(f"sorted by {order_by}{'' if ascending else ' (descending)'}")
+        return "; ".join(parts)
+
+# Demo dataset: (name, category, price, cost, stock_quantity, supplier)
+DEMO_PRODUCTS = [
+    ('Laptop Pro', 'Electronics', 1299.99, 800.00, 45, 'TechSupply Inc'),
+    ('Wireless Mouse', 'Electronics', 29.99, 15.00, 120, 'TechSupply Inc'),
+    ('Office Chair', 'Furniture', 249.99, 150.00, 30, 'FurnCorp'),
+    ('Desk Lamp', 'Furniture', 89.99, 45.00, 75, 'LightCo'),
+    ('Coffee Maker', 'Appliances', 129.99, 80.00, 25, 'ApplianceWorld'),
+    ('Water Bottle', 'Accessories', 19.99, 8.00, 200, 'LifeStyle Ltd'),
+    ('Notebook Set', 'Office Supplies', 24.99, 12.00, 150, 'PaperCorp'),
+    ('Smartphone', 'Electronics', 899.99, 600.00, 60, 'TechSupply Inc'),
+    ('Standing Desk', 'Furniture', 599.99, 350.00, 15, 'FurnCorp'),
+    ('Headphones', 'Electronics', 199.99, 120.00, 80, 'AudioTech')
+]
+
+DEMO_CUSTOMER_NAMES = [
+    'Acme Corporation', 'Global Solutions LLC', 'TechStart Inc', 'Creative Agency',
+    'Retail Plus', 'Manufacturing Corp', 'Service Pro', 'Innovation Labs',
+    'Digital Marketing Co', 'Consulting Group', 'Local Restaurant',
+    'Healthcare Partners', 'Education Foundation', 'Non-Profit Org',
+    'Construction Company', 'Real Estate Group', 'Financial Services',
+    'Transportation LLC', 'Energy Solutions', 'Food Distribution'
+]
+
+DEMO_CUSTOMER_TYPES = ['Enterprise', 'Small Business', 'Startup', 'Non-Profit']
+DEMO_SALES_REPS = ['Alice Johnson', 'Bob Smith', 'Carol Williams', 'David Brown']
+DEMO_REGIONS = ['North', 'South', 'East', 'West']
 
 class BusinessDataBot:
-    def __init__(self, db_path="business_data.db"):
+    # Sales rows per generated block; also the unit of one seed transaction
+    SEED_BLOCK_ROWS = 50000
+    # Stored in PRAGMA user_version once the demo schema is created and seeded
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path="business_data.db", seed_scale_factor: Optional[float] = None,
+                 llm_client: Optional[LLMClient] = None, seed_end_date: Optional[str] = None):
         self.db_path = db_path
-        self.llm_client = MockOpenAI()  # Replace with OpenAI() when API key available
+        # Scale factor 1.0 seeds 1,000 sales rows; BI_CHATBOT_SEED_SCALE overrides it
+        self.seed_scale_factor = seed_scale_factor if seed_scale_factor is not None else float(
+            os.environ.get('BI_CHATBOT_SEED_SCALE', '1'))
+        # Last day of seeded sales (default today); pin it for reproducible benchmarks
+        self.seed_end_date = seed_end_date
+        self.pool = get_connection_pool(db_path)
+        self.result_cache = get_query_result_cache(db_path)
+        # Default backend; sessions with an API key pass their own client per call
+        self.llm_client = llm_client or MockOpenAI()
         self.init_demo_database()
-        self.conversation_history = []
+        self.schema_catalog = get_schema_catalog(db_path)
+        self.index_advisor = get_index_advisor(db_path)
+        self.index_advisor.ensure_default_indexes()
+        self.rollups = get_rollup_manager(db_path)
+        self.rollups.refresh()
+        self.exporter = get_streaming_exporter(db_path)
+        self.table_browser = get_table_browser(db_path)
+        self.executor = get_query_executor(db_path)
+        self.tracer = get_pipeline_tracer()
+        self.semantic_cache = get_semantic_cache(db_path)
+        self.chart_renderer = get_chart_renderer()
+        self.result_store = get_result_frame_store(db_path)
+        self.data_connections = get_data_connection_registry(db_path)
+        self.alerts = get_alert_engine(db_path)
+        # Optional columnar mirror for aggregates the rollups can't answer
+        self.columnar = None
+        if os.environ.get('BI_CHATBOT_ANALYTICS_BACKEND', 'sqlite') == 'columnar':
+            self.columnar = get_columnar_store(db_path)
+            self.columnar.warm('sales')
+        # Pushes insight statistics into SQL for results too large to load
+        self.insight_engine = InsightEngine(run_query=lambda sql: self.executor.submit(sql).result())
+    
+    def refresh(self):
+        """Per-rerun upkeep: fold new sales into the rollups and poll attached data sources"""
+        self.rollups.refresh()
+        self.data_connections.maybe_refresh()
     
     def init_demo_database(self):
-        """Initialize demo business database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Initialize demo business database (first boot only)"""
+        with self.pool.reader() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+                return
         
+        with self.pool.writer() as conn:
+            needs_seed = self._create_demo_schema(conn.cursor())
+        
+        if needs_seed:
+            self.generate_demo_business_data(scale_factor=self.seed_scale_factor, end_date=self.seed_end_date)
+        # Only marked after seeding; an interrupted seed resumes from demo_seed on the next boot
+        with self.pool.writer() as conn:
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _create_demo_schema(self, cursor):
+        """Create demo tables; returns True when the sales table still needs seeding"""
         # Create sales table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sales (
@@ -131,177 +5562,265 @@ class BusinessDataBot:
             )
         ''')
         
-        # Generate demo data if tables are empty
-        cursor.execute("SELECT COUNT(*) FROM sales")
-        if cursor.fetchone()[0] == 0:
-            self.generate_demo_business_data(cursor)
-        
-        conn.commit()
-        conn.close()
-    
-    def generate_demo_business_data(self, cursor):
-        """Generate realistic demo business data"""
-        np.random.seed(42)
-        
-        # Products
-        products = [
-            ('Laptop Pro', 'Electronics', 1299.99, 800.00, 45, 'TechSupply Inc'),
-            ('Wireless Mouse', 'Electronics', 29.99, 15.00, 120, 'TechSupply Inc'),
-            ('Office Chair', 'Furniture', 249.99, 150.00, 30, 'FurnCorp'),
-            ('Desk Lamp', 'Furniture', 89.99, 45.00, 75, 'LightCo'),
-            ('Coffee Maker', 'Appliances', 129.99, 80.00, 25, 'ApplianceWorld'),
-            ('Water Bottle', 'Accessories', 19.99, 8.00, 200, 'LifeStyle Ltd'),
-            ('Notebook Set', 'Office Supplies', 24.99, 12.00, 150, 'PaperCorp'),
-            ('Smartphone', 'Electronics', 899.99, 600.00, 60, 'TechSupply Inc'),
-            ('Standing Desk', 'Furniture', 599.99, 350.00, 15, 'FurnCorp'),
-            ('Headphones', 'Electronics', 199.99, 120.00, 80, 'AudioTech')
-        ]
-        
-        for product in products:
-            cursor.execute('''
-                INSERT INTO products (name, category, price, cost, stock_quantity, supplier)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', product)
-        
-        # Customers
-        customer_names = [
-            'Acme Corporation', 'Global Solutions LLC', 'TechStart Inc', 'Creative Agency',
-            'Retail Plus', 'Manufacturing Corp', 'Service Pro', 'Innovation Labs',
-            'Digital Marketing Co', 'Consulting Group', 'Local Restaurant',
-            'Healthcare Partners', 'Education Foundation', 'Non-Profit Org',
-            'Construction Company', 'Real Estate Group', 'Financial Services',
-            'Transportation LLC', 'Energy Solutions', 'Food Distribution'
-        ]
-        
-        customer_types = ['Enterprise', 'Small Business', 'Startup', 'Non-Profit']
-        
-        for i, name in enumerate(customer_names):
-            cursor.execute('''
-                INSERT INTO customers (name, email, phone, registration_date, customer_type, credit_limit)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                name,
-                f"contact@{name.lower().replace(' ', '').replace(',', '')}.com",
-                f"555-{1000+i:04d}",
-                (datetime.now() - timedelta(days=np.random.randint(30, 730))).strftime('%Y-%m-%d'),
-                np.random.choice(customer_types),
-                np.random.randint(5000, 50000)
-            ))
-        
-        # Generate sales data for the last 12 months
-        sales_reps = ['Alice Johnson', 'Bob Smith', 'Carol Williams', 'David Brown']
-        regions = ['North', 'South', 'East', 'West']
+        # Seed plan and progress, so an interrupted seed resumes where it stopped
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS demo_seed (
+                name TEXT PRIMARY KEY,
+                seed INTEGER NOT NULL,
+                total_rows INTEGER NOT NULL,
+                end_date TEXT NOT NULL,
+                blocks_done INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
         
-        for _ in range(1000):  # 1000 sales records
-            # Random date in the last 12 months
-            random_days_ago = np.random.randint(0, 365)
-            sale_date = (datetime.now() - timedelta(days=random_days_ago)).strftime('%Y-%m-%d')
-            
-            customer_id = np.random.randint(1, 21)  # 20 customers
-            product_id = np.random.randint(1, 11)   # 10 products
-            quantity = np.random.randint(1, 10)
-            
-            # Get product info
-            cursor.execute("SELECT name, category, price FROM products WHERE id = ?", (product_id,))
-            product_info = cursor.fetchone()
-            
-            # Get customer info
-            cursor.execute("SELECT name FROM customers WHERE id = ?", (customer_id,))
-            customer_name = cursor.fetchone()[0]
-            
-            amount = product_info[2] * quantity * np.random.uniform(0.8, 1.0)  # Some discount variation
-            
-            cursor.execute('''
-                INSERT INTO sales (date, customer_id, customer_name, product_name, category, 
-                                 amount, quantity, sales_rep, region)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                sale_date, customer_id, customer_name, product_info[0], product_info[1],
-                round(amount, 2), quantity, np.random.choice(sales_reps), np.random.choice(regions)
-            ))
+        # Generate demo data if tables are empty or an earlier seed didn't finish
+        plan = cursor.execute("SELECT total_rows, blocks_done FROM demo_seed WHERE name = 'sales'").fetchone()
+        if plan is not None:
+            return plan[1] < -(-plan[0] // self.SEED_BLOCK_ROWS)
+        cursor.execute("SELECT COUNT(*) FROM sales")
+        return cursor.fetchone()[0] == 0
     
+    def generate_demo_business_data(self, scale_factor: float = 1.0, seed: int = 42,
+                                    end_date: Optional[str] = None):
+        """Generate realistic demo business data, vectorized and in bounded memory.
+
+        ``scale_factor`` 1.0 produces 1,000 sales rows (10,000 -> 10M). Rows are
+        generated in fixed-size NumPy blocks, each from its own child seed, so
+        the same seed, scale and end date always produce the same data. The
+        plan is stored in demo_seed and every block commits together with its
+        progress, so an interrupted seed resumes with the next block and the
+        original plan.
+        """
+        with self.pool.bulk_writer() as conn:
+            cursor = conn.cursor()
+            conn.execute("BEGIN")
+
+            plan = cursor.execute(
+                "SELECT seed, total_rows, end_date, blocks_done FROM demo_seed WHERE name = 'sales'").fetchone()
+            if plan is None:
+                plan = (seed, int(round(1000 * scale_factor)), end_date or datetime.now().strftime('%Y-%m-%d'), 0)
+                cursor.execute("INSERT INTO demo_seed (name, seed, total_rows, end_date, blocks_done) "
+                               "VALUES ('sales', ?, ?, ?, ?)", plan)
+            elif plan[3]:
+                logger.info("Resuming the demo seed at block %d", plan[3])
+            seed, total_rows, end_date, blocks_done = plan
+            end_day = np.datetime64(end_date, 'D')
+            # spawn() advances the SeedSequence, so draw every child stream in one call
+            n_blocks = -(-total_rows // self.SEED_BLOCK_ROWS)
+            children = np.random.SeedSequence(seed).spawn(n_blocks + 1)
+            attribute_rng = np.random.default_rng(children[0])
+
+            # Products
+            if cursor.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 0:
+                cursor.executemany('''
+                    INSERT INTO products (name, category, price, cost, stock_quantity, supplier)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', DEMO_PRODUCTS)
+
+            # Customers
+            if cursor.execute("SELECT COUNT(*) FROM customers").fetchone()[0] == 0:
+                n_customers = len(DEMO_CUSTOMER_NAMES)
+                registration_dates = (end_day - attribute_rng.integers(30, 730, n_customers).astype('timedelta64[D]')).astype(str)
+                customer_types = attribute_rng.choice(DEMO_CUSTOMER_TYPES, n_customers)
+                credit_limits = attribute_rng.integers(5000, 50000, n_customers)
+                cursor.executemany('''
+                    INSERT INTO customers (name, email, phone, registration_date, customer_type, credit_limit)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [
+                    (
+                        name,
+                        f"contact@{name.lower().replace(' ', '').replace(',', '')}.com",
+                        f"555-{1000+i:04d}",
+                        str(registration_dates[i]),
+                        str(customer_types[i]),
+                        int(credit_limits[i])
+                    )
+                    for i, name in enumerate(DEMO_CUSTOMER_NAMES)
+                ])
+            conn.execute("COMMIT")
+
+            # Dimension attributes as arrays, joined to sales rows by index
+            product_rows = cursor.execute("SELECT name, category, price FROM products ORDER BY id").fetchall()
+            product_names = np.array([row[0] for row in product_rows], dtype=object)
+            product_categories = np.array([row[1] for row in product_rows], dtype=object)
+            product_prices = np.array([row[2] or 0.0 for row in product_rows], dtype=float)
+            customer_rows = cursor.execute("SELECT id, name FROM customers ORDER BY id").fetchall()
+            customer_ids = np.array([row[0] for row in customer_rows], dtype=np.int64)
+            customer_names = np.array([row[1] for row in customer_rows], dtype=object)
+            sales_reps = np.array(DEMO_SALES_REPS, dtype=object)
+            regions = np.array(DEMO_REGIONS, dtype=object)
+
+            # Generate sales data for the last 12 months
+            for block, block_seed in enumerate(children[1:]):
+                if block < blocks_done:
+                    continue
+                rng = np.random.default_rng(block_seed)
+                n = min(self.SEED_BLOCK_ROWS, total_rows - block * self.SEED_BLOCK_ROWS)
+
+                sale_dates = (end_day - rng.integers(0, 365, n).astype('timedelta64[D]')).astype(str)
+                customer_idx = rng.integers(0, len(customer_ids), n)
+                product_idx = rng.integers(0, len(product_names), n)
+                quantities = rng.integers(1, 10, n)
+                # Some discount variation
+                amounts = np.round(product_prices[product_idx] * quantities * rng.uniform(0.8, 1.0, n), 2)
+                rep_idx = rng.integers(0, len(sales_reps), n)
+                region_idx = rng.integers(0, len(regions), n)
+
+                conn.execute("BEGIN")
+                cursor.executemany('''
+                    INSERT INTO sales (date, customer_id, customer_name, product_name, category, 
+                                     amount, quantity, sales_rep, region)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', zip(
+                    sale_dates.tolist(), customer_ids[customer_idx].tolist(), customer_names[customer_idx].tolist(),
+                    product_names[product_idx].tolist(), product_categories[product_idx].tolist(),
+                    amounts.tolist(), quantities.tolist(), sales_reps[rep_idx].tolist(), regions[region_idx].tolist()
+                ))
+                cursor.execute("UPDATE demo_seed SET blocks_done = ? WHERE name = 'sales'", (block + 1,))
+                conn.execute("COMMIT")
+
     def get_table_schema(self) -> Dict[str, List[str]]:
         """Get database schema for query generation"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return self.schema_catalog.as_dict()
+    
+    def llm_client_for(self, api_key: Optional[str]) -> LLMClient:
+        """OpenAI-compatible client for an API key, or the default backend without one"""
+        if not api_key:
+            return self.llm_client
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            logger.warning("httpx is not installed; ignoring the API key and using the built-in engine")
+            return self.llm_client
+        return get_llm_client(
+            api_key,
+            os.environ.get('BI_CHATBOT_LLM_MODEL', 'gpt-4o-mini'),
+            os.environ.get('BI_CHATBOT_LLM_BASE_URL', 'https://api.openai.com/v1'),
+            os.path.join(cache_directory(self.db_path), 'prompt_cache.db')
+        )
+
+    def interpret_business_query(self, natural_language_query: str, llm_client: Optional[LLMClient] = None) -> str:
+        """Convert natural language to SQL query"""
+        client = llm_client or self.llm_client
+        with self.tracer.span('interpret_business_query', backend=client.name) as span:
+            self.schema_catalog.ensure_current()
+            schema_fingerprint = self.schema_catalog.fingerprint
+            sql_query = self.semantic_cache.lookup(natural_language_query, schema_fingerprint, scope=client.name)
+            span.set(semantic_hit=sql_query is not None)
+            if sql_query is None:
+                schema = self.get_table_schema()
+                try:
+                    sql_query = client.generate_sql_query(natural_language_query, schema)
+                except LLMError as exc:
+                    # Keep answering with the built-in intent engine while the backend is down
+                    logger.warning("LLM backend %s failed, using intent engine: %s", client.name, exc)
+                    span.set(llm_error=str(exc))
+                    client = MockOpenAI()
+                    sql_query = client.generate_sql_query(natural_language_query, schema)
+                self.semantic_cache.store(natural_language_query, sql_query, schema_fingerprint, scope=client.name)
+            span.set(sql=sql_query)
+        return sql_query
+    
+    def submit_query(self, sql_query: str, timeout: Optional[float] = None) -> QueryHandle:
+        """Start a query on the worker pool (or serve it from the cache) and return its handle"""
+        start = time.perf_counter()
+        trace_id = self.tracer.current_trace_id
+        cacheable = self.result_cache.is_cacheable(sql_query)
+        on_complete = None
+        if cacheable:
+            cached_df = self.result_cache.get(sql_query)
+            if cached_df is not None:
+                self.tracer.record('execute_query', time.perf_counter() - start, trace_id=trace_id, sql=sql_query,
+                                   cache_hit=True, rows=len(cached_df),
+                                   result_bytes=int(cached_df.memory_usage(index=True).sum()))
+                return QueryHandle.completed(sql_query, cached_df)
+            version = self.result_cache.version_for(sql_query)
+            
+            def on_complete(result_df):
+                self.result_cache.put(sql_query, result_df, version)
         
-        schema = {}
+        # Aggregates over sales are answered from the rollup when it can
+        executed_sql = (self.rollups.route(sql_query) if cacheable else None) or sql_query
         
-        # Get table names
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
+        # Then by the columnar backend, if enabled; anything else falls through to SQLite
+        if cacheable and self.columnar is not None and executed_sql == sql_query:
+            aggregate = AggregateQuery.parse(sql_query)
+            result_df = self.columnar.execute(aggregate) if aggregate is not None else None
+            if result_df is not None:
+                on_complete(result_df)
+                self.tracer.record('execute_query', time.perf_counter() - start, trace_id=trace_id, sql=sql_query,
+                                   cache_hit=False, backend='columnar', rows=len(result_df),
+                                   result_bytes=int(result_df.memory_usage(index=True).sum()))
+                return QueryHandle.completed(sql_query, result_df)
         
-        for table in tables:
-            table_name = table[0]
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = [col[1] for col in cursor.fetchall()]
-            schema[table_name] = columns
+        if cacheable:
+            self.index_advisor.observe(executed_sql)
         
-        conn.close()
-        return schema
-    
-    def interpret_business_query(self, natural_language_query: str) -> str:
-        """Convert natural language to SQL query"""
-        schema = self.get_table_schema()
-        sql_query = self.llm_client.generate_sql_query(natural_language_query, schema)
-        return sql_query
+        handle = self.executor.submit(executed_sql, timeout=timeout, on_complete=on_complete)
+        
+        def record_span(future):
+            attributes = {'sql': sql_query, 'cache_hit': False, 'routed': executed_sql != sql_query}
+            if future.cancelled() or future.exception() is not None:
+                attributes['error'] = 'CancelledError' if future.cancelled() else type(future.exception()).__name__
+            else:
+                result_df = future.result()
+                attributes.update(rows=len(result_df), result_bytes=int(result_df.memory_usage(index=True).sum()))
+            self.tracer.record('execute_query', time.perf_counter() - start, trace_id=trace_id, **attributes)
+        
+        handle.future.add_done_callback(record_span)
+        return handle
     
     def execute_query(self, sql_query: str) -> pd.DataFrame:
         """Execute SQL query and return results"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            result_df = pd.read_sql_query(sql_query, conn)
-            conn.close()
-            return result_df
+            return self.submit_query(sql_query).result()
         except Exception as e:
             st.error(f"Query execution error: {str(e)}")
             return pd.DataFrame()
     
-    def generate_business_insights(self, query_result: pd.DataFrame, original_query: str) -> str:
+    def generate_business_insights(self, query_result: pd.DataFrame, original_query: str,
+                                   llm_client: Optional[LLMClient] = None) -> str:
         """Generate natural language insights from query results"""
-        return self.llm_client.generate_insights(query_result, original_query)
+        client = llm_client or self.llm_client
+        with self.tracer.span('generate_business_insights', rows=len(query_result), backend=client.name) as span:
+            try:
+                return client.generate_insights(query_result, original_query)
+            except LLMError as exc:
+                logger.warning("LLM backend %s failed, using built-in insights: %s", client.name, exc)
+                span.set(llm_error=str(exc))
+                return MockOpenAI().generate_insights(query_result, original_query)
+    
+    def summarize_query(self, sql_query: str) -> str:
+        """Insights for a result too large to return, computed by the database"""
+        with self.tracer.span('generate_business_insights', pushdown=True):
+            return self.insight_engine.summarize_query(sql_query)
     
-    def create_visualization(self, df: pd.DataFrame, query: str) -> Optional[go.Figure]:
+    def create_visualization(self, df: pd.DataFrame, query: str) -> Optional["go.Figure"]:
         """Auto-generate appropriate visualization for the data"""
-        if df.empty or len(df.columns) < 2:
-            return None
-        
-        numeric_cols = df.select_dtypes(include=[np.number]).columns
-        categorical_cols = df.select_dtypes(exclude=[np.number]).columns
-        
-        # Time series detection
-        date_cols = [col for col in df.columns if 'date' in col.lower() or 'month' in col.lower() or 'time' in col.lower()]
-        
-        if len(date_cols) > 0 and len(numeric_cols) > 0:
-            # Time series plot
-            fig = px.line(df, x=date_cols[0], y=numeric_cols[0], 
-                         title=f"{numeric_cols[0].replace('_', ' ').title()} Over Time")
-            return fig
-        
-        elif len(categorical_cols) > 0 and len(numeric_cols) > 0:
-            # Bar chart
-            if len(df) <= 20:  # Limit for readability
-                fig = px.bar(df, x=categorical_cols[0], y=numeric_cols[0],
-                           title=f"{numeric_cols[0].replace('_', ' ').title()} by {categorical_cols[0].replace('_', ' ').title()}")
-                fig.update_xaxis(tickangle=45)
-                return fig
-        
-        return None
+        with self.tracer.span('create_visualization', rows=len(df)) as span:
+            fig, cache_hit = self.chart_renderer.render(df)
+            span.set(chart=fig is not None, cache_hit=cache_hit)
+        return fig
     
     def export_results(self, df: pd.DataFrame, format_type: str = 'csv') -> bytes:
         """Export query results to various formats"""
-        if format_type == 'csv':
-            return df.to_csv(index=False).encode('utf-8')
-        elif format_type == 'excel':
-            # For demo purposes, return CSV (would need openpyxl for Excel)
-            return df.to_csv(index=False).encode('utf-8')
-        else:
-            return df.to_json(orient='records').encode('utf-8')
+        return self.exporter.export_dataframe(df, format_type)
+    
+    def export_query(self, sql_query: str, format_type: str = 'csv') -> bytes:
+        """Encode a query's full result straight from the cursor, without building a DataFrame"""
+        with self.exporter.export_query(sql_query, format_type) as spool:
+            return spool.read()
+
+@st.cache_resource(show_spinner=False)
+def get_business_bot(db_path: str) -> BusinessDataBot:
+    """One bot per database and process; reruns and sessions share it"""
+    return BusinessDataBot(db_path)
 
 class BusinessIntelligenceChatbotApp:
     def __init__(self):
-        self.bot = BusinessDataBot()
         self.setup_page_config()
+        self.bot = get_business_bot(os.environ.get('BI_CHATBOT_DB_PATH', 'business_data.db'))
+        self.bot.refresh()
     
     def setup_page_config(self):
         st.set_page_config(
@@ -326,6 +5845,9 @@ class BusinessIntelligenceChatbotApp:
             "Show sales by region"
         ]
         
+        st.sidebar.caption("Follow up on an answer with e.g. \"only the North region\", "
+                           "\"just the top 3\" or \"break it down by rep\".")
+        
         for query in sample_queries:
             if st.sidebar.button(query, key=f"sample_{hash(query)}"):
                 return query
@@ -336,27 +5858,38 @@ class BusinessIntelligenceChatbotApp:
         """Display overview of available data"""
         st.sidebar.markdown("### 📊 Available Data")
         
-        conn = sqlite3.connect(self.bot.db_path)
-        
-        # Sales summary
-        sales_count = pd.read_sql_query("SELECT COUNT(*) as count FROM sales", conn).iloc[0]['count']
-        customer_count = pd.read_sql_query("SELECT COUNT(*) as count FROM customers", conn).iloc[0]['count']
-        product_count = pd.read_sql_query("SELECT COUNT(*) as count FROM products", conn).iloc[0]['count']
+        # Row counts come from the schema catalog instead of COUNT(*) per rerun
+        catalog = self.bot.schema_catalog
+        sales_count = catalog.row_count('sales')
+        customer_count = catalog.row_count('customers')
+        product_count = catalog.row_count('products')
         
         st.sidebar.metric("Sales Records", f"{sales_count:,}")
         st.sidebar.metric("Customers", f"{customer_count:,}")
         st.sidebar.metric("Products", f"{product_count:,}")
-        
-        conn.close()
     
     def main_chat_interface(self):
         """Main chat interface"""
         st.title("💬 Business Intelligence Chatbot")
         st.markdown("*Ask questions about your business data in plain English*")
         
-        # Initialize chat history in session state
+        # Initialize chat history in session state (summaries only; frames live in the result store)
         if 'chat_history' not in st.session_state:
-            st.session_state.chat_history = []
+            st.session_state.chat_history = ConversationHistory(
+                self.bot.result_store,
+                result_budget_bytes=int(float(os.environ.get('BI_CHATBOT_SESSION_RESULT_MB', '64')) * 1024 * 1024)
+            )
+        # What the last answer was, so follow-ups ("just the top 3") refine it
+        if 'conversation_context' not in st.session_state:
+            st.session_state.conversation_context = ConversationContext(
+                st.session_state.chat_history, self.bot.schema_catalog, get_intent_engine())
+        
+        # A click on "Cancel query" reruns the script; stop the query it belonged to
+        active_query_id = st.session_state.get('active_query_id')
+        if active_query_id and st.session_state.get(f"cancel_{active_query_id}"):
+            if self.bot.executor.cancel(active_query_id):
+                st.warning("⏹️ Query cancelled.")
+            st.session_state.active_query_id = None
         
         # Sample query selection
         sample_query = self.display_sample_queries()
@@ -381,8 +5914,9 @@ class BusinessIntelligenceChatbotApp:
             clear_button = st.button("🗑️ Clear History")
         
         if clear_button:
-            st.session_state.chat_history = []
-            st.experimental_rerun()
+            st.session_state.chat_history.clear()
+            st.session_state.conversation_context.clear()
+            st.rerun()
         
         # Process query
         if ask_button and query_input.strip():
@@ -393,24 +5927,34 @@ class BusinessIntelligenceChatbotApp:
             st.markdown("---")
             st.subheader("💬 Conversation History")
             
-            for i, chat in enumerate(reversed(st.session_state.chat_history[-5:])):  # Show last 5
-                with st.expander(f"Q: {chat['query'][:50]}...", expanded=(i == 0)):
-                    st.markdown(f"**Question:** {chat['query']}")
+            history = st.session_state.chat_history
+            for i, chat in enumerate(history.recent(5)):  # Show last 5
+                with st.expander(f"Q: {chat.query[:50]}...", expanded=(i == 0)):
+                    st.markdown(f"**Question:** {chat.query}")
                     
-                    if not chat['results'].empty:
-                        st.markdown(f"**Answer:** {chat['insights']}")
+                    if chat.rows:
+                        st.markdown(f"**Answer:** {chat.insights}")
+                        
+                        # Older results load from the result store only when asked for
+                        if i > 0 and not st.toggle(f"Show {chat.rows:,} result rows", key=f"show_results_{i}"):
+                            continue
+                        results = history.load(chat)
+                        if results is None:
+                            st.caption("This result is no longer cached. Ask the question again to see it.")
+                            continue
                         
                         # Show data
-                        st.dataframe(chat['results'], use_container_width=True)
+                        st.dataframe(results, use_container_width=True)
                         
-                        # Show visualization if available
-                        if chat['visualization']:
-                            st.plotly_chart(chat['visualization'], use_container_width=True)
+                        # Show visualization if available (served from the figure cache)
+                        chart, _ = self.bot.chart_renderer.render(results)
+                        if chart:
+                            st.plotly_chart(chart, use_container_width=True)
                         
-                        # Export options
+                        # Export options (encoded only when clicked)
                         st.download_button(
                             "📊 Download as CSV",
-                            data=self.bot.export_results(chat['results'], 'csv'),
+                            data=partial(self.bot.export_results, results, 'csv'),
                             file_name=f"query_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                             mime="text/csv",
                             key=f"download_{i}"
@@ -420,32 +5964,44 @@ class BusinessIntelligenceChatbotApp:
     
     def process_business_query(self, user_query: str):
         """Process user query and display results"""
-        with st.spinner("🤖 Analyzing your question..."):
+        with st.spinner("🤖 Analyzing your question..."), self.bot.tracer.trace():
             try:
-                # Convert to SQL
-                sql_query = self.bot.interpret_business_query(user_query)
+                llm_client = self.bot.llm_client_for(
+                    st.session_state.get('openai_api_key') or os.environ.get('OPENAI_API_KEY'))
+                
+                # Follow-ups refine the previous answer; anything else is converted to SQL
+                context = st.session_state.conversation_context
+                with self.bot.tracer.span('refine_query') as span:
+                    follow_up = context.refine(user_query)
+                    span.set(refined=follow_up is not None,
+                             in_memory=follow_up is not None and follow_up.frame is not None)
+                if follow_up is not None:
+                    sql_query = follow_up.sql
+                    st.caption(f"↪️ Refining the previous answer: {follow_up.description}")
+                else:
+                    sql_query = self.bot.interpret_business_query(user_query, llm_client=llm_client)
                 
                 st.code(sql_query, language='sql')
                 
-                # Execute query
-                results_df = self.bot.execute_query(sql_query)
+                if follow_up is not None and follow_up.frame is not None:
+                    # Answered from the previous rows without querying the database
+                    results_df = follow_up.frame
+                else:
+                    # Execute query off the script thread so it can be cancelled
+                    results_df = self.wait_for_query(self.bot.submit_query(sql_query))
+                if results_df is None:
+                    return
                 
                 if not results_df.empty:
                     # Generate insights
-                    insights = self.bot.generate_business_insights(results_df, user_query)
+                    insights = self.bot.generate_business_insights(results_df, user_query, llm_client=llm_client)
                     
                     # Create visualization
                     chart = self.bot.create_visualization(results_df, user_query)
                     
                     # Store in chat history
-                    st.session_state.chat_history.append({
-                        'query': user_query,
-                        'sql': sql_query,
-                        'results': results_df,
-                        'insights': insights,
-                        'visualization': chart,
-                        'timestamp': datetime.now()
-                    })
+                    entry = st.session_state.chat_history.add(user_query, sql_query, results_df, insights)
+                    context.remember(sql_query, entry, follow_up)
                     
                     # Display results
                     st.success("✅ Query executed successfully!")
@@ -458,13 +6014,13 @@ class BusinessIntelligenceChatbotApp:
                     if chart:
                         st.plotly_chart(chart, use_container_width=True)
                     
-                    # Export options
+                    # Export options (encoded only when clicked)
                     col1, col2, col3 = st.columns(3)
                     
                     with col1:
                         st.download_button(
                             "📊 Download CSV",
-                            data=self.bot.export_results(results_df, 'csv'),
+                            data=partial(self.bot.export_results, results_df, 'csv'),
                             file_name=f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                             mime="text/csv"
                         )
@@ -472,17 +6028,71 @@ class BusinessIntelligenceChatbotApp:
                     with col2:
                         st.download_button(
                             "📈 Download JSON",
-                            data=self.bot.export_results(results_df, 'json'),
+                            data=partial(self.bot.export_results, results_df, 'json'),
                             file_name=f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                             mime="application/json"
                         )
                     
+                    if 'excel' in StreamingExporter.available_formats():
+                        with col3:
+                            st.download_button(
+                                "📗 Download Excel",
+                                data=partial(self.bot.export_results, results_df, 'excel'),
+                                file_name=f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                                mime=StreamingExporter.FORMATS['excel'][0]
+                            )
+                    
                 else:
                     st.warning("No results found for your query. Try rephrasing your question.")
                     
             except Exception as e:
                 st.error(f"Error processing query: {str(e)}")
     
+    def wait_for_query(self, handle: QueryHandle) -> Optional[pd.DataFrame]:
+        """Show progress and a cancel button until the query finishes"""
+        if not handle.done():
+            st.session_state.active_query_id = handle.id
+            status = st.empty()
+            st.button("⏹️ Cancel query", key=f"cancel_{handle.id}")
+            while not handle.done():
+                status.caption(f"⏳ Running query... {handle.elapsed:.1f}s")
+                time.sleep(0.1)
+            status.empty()
+            st.session_state.active_query_id = None
+        
+        try:
+            return handle.result()
+        except CancelledError:
+            st.warning("⏹️ Query cancelled.")
+        except Exception as e:
+            # Branch on the handle's outcome rather than the exception class: the executor is
+            # cached across reruns, so it raises the classes defined by the run that created it
+            self.show_query_error(handle, e)
+        return None
+
+    def show_query_error(self, handle: QueryHandle, error: Exception):
+        """Explain why a query produced no result"""
+        if handle.outcome == 'timed_out':
+            st.error(f"⏱️ {str(error)}. Try narrowing the question (e.g. a shorter date range).")
+        elif handle.outcome == 'cancelled':
+            st.warning("⏹️ Query cancelled.")
+        elif handle.outcome == 'rejected':
+            st.error(f"📏 {str(error)}. Try a more specific question or use an aggregate.")
+            try:
+                st.markdown(f"**Insights (computed in the database):** {self.bot.summarize_query(handle.sql)}")
+            except Exception as exc:
+                logger.warning("In-database insights failed: %s", exc)
+            # Too big to load here, but it can still be streamed from the cursor when clicked
+            st.download_button(
+                "📥 Download full result (CSV)",
+                data=partial(self.bot.export_query, handle.sql, 'csv'),
+                file_name=f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime=StreamingExporter.FORMATS['csv'][0],
+                key=f"download_full_{handle.id}"
+            )
+        else:
+            st.error(f"Query execution error: {str(error)}")
+    
     def run_app(self):
         """Run the main application"""
         
@@ -502,61 +6112,210 @@ class BusinessIntelligenceChatbotApp:
         """Data exploration interface"""
         st.header("📊 Data Explorer")
         
-        # Table selector
-        conn = sqlite3.connect(self.bot.db_path)
-        tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table'", conn)['name'].tolist()
+        # Table selector; opens on the sales data rather than the first table alphabetically
+        tables = list(self.bot.schema_catalog.user_tables)
         
-        selected_table = st.selectbox("Select Table to Explore:", tables)
+        selected_table = st.selectbox("Select Table to Explore:", tables,
+                                      index=tables.index('sales') if 'sales' in tables else 0)
         
         if selected_table:
-            # Show table preview
-            sample_data = pd.read_sql_query(f"SELECT * FROM {selected_table} LIMIT 100", conn)
-            st.subheader(f"Sample Data from {selected_table}")
-            st.dataframe(sample_data, use_container_width=True)
+            browser = self.bot.table_browser
+            table_info = self.bot.schema_catalog.table(selected_table)
+            
+            # Column projection, filter and page size are all pushed into the SQL
+            selected_columns = st.multiselect(
+                "Columns:", table_info.column_names, default=table_info.column_names,
+                key=f"explorer_columns_{selected_table}"
+            )
+            filter_col1, filter_col2, filter_col3, filter_col4 = st.columns([2, 1, 2, 1])
+            with filter_col1:
+                filter_column = st.selectbox("Filter column:", ["(none)"] + table_info.column_names,
+                                             key=f"explorer_filter_column_{selected_table}")
+            with filter_col2:
+                filter_operator = st.selectbox("Operator:", TableBrowser.FILTER_OPERATORS,
+                                               key=f"explorer_filter_operator_{selected_table}")
+            with filter_col3:
+                filter_value = st.text_input("Value:", key=f"explorer_filter_value_{selected_table}")
+            with filter_col4:
+                page_size = st.selectbox("Rows per page:", [25, 50, 100, 250, 500], index=2,
+                                         key=f"explorer_page_size_{selected_table}")
+            
+            filters = []
+            if filter_column != "(none)" and filter_value != "":
+                filters.append((filter_column, filter_operator, filter_value))
+            
+            # Keyset pagination: remember the last key of every page visited
+            view_key = (selected_table, tuple(selected_columns), tuple(filters), page_size)
+            if st.session_state.get('explorer_view') != view_key:
+                st.session_state.explorer_view = view_key
+                st.session_state.explorer_page_starts = [None]
+            page_starts = st.session_state.explorer_page_starts
+            
+            try:
+                page, last_key, has_more = browser.fetch_page(
+                    selected_table, selected_columns or None, filters, page_size, page_starts[-1]
+                )
+                total_rows = browser.count_rows(selected_table, filters)
+            except (ValueError, sqlite3.Error, pd.errors.DatabaseError) as e:
+                st.error(f"Could not load table: {str(e)}")
+                return
+            
+            st.subheader(f"Data from {selected_table}")
+            st.caption(f"Page {len(page_starts)} · {total_rows:,} matching rows")
+            st.dataframe(page, use_container_width=True)
             
-            # Basic statistics for numeric columns
-            numeric_cols = sample_data.select_dtypes(include=[np.number]).columns
-            if len(numeric_cols) > 0:
+            nav_col1, nav_col2, _ = st.columns([1, 1, 4])
+            with nav_col1:
+                if st.button("◀ Previous", disabled=len(page_starts) == 1, key="explorer_prev"):
+                    page_starts.pop()
+                    st.rerun()
+            with nav_col2:
+                if st.button("Next ▶", disabled=not has_more, key="explorer_next"):
+                    page_starts.append(last_key)
+                    st.rerun()
+            
+            # Statistics over the full table rather than the visible page
+            if browser.numeric_columns(selected_table, selected_columns or None):
                 st.subheader("📈 Summary Statistics")
-                st.dataframe(sample_data[numeric_cols].describe())
-        
-        conn.close()
+                stats_mode = st.radio("Statistics mode:", ["Exact (SQL aggregates)", "Approximate (sampled)"],
+                                      horizontal=True, key="explorer_stats_mode")
+                approximate = stats_mode.startswith("Approximate")
+                st.dataframe(browser.summary_statistics(
+                    selected_table, selected_columns or None, filters, approximate=approximate
+                ))
+    
+    def apply_alert_setting(self, setting: str):
+        """on_change callback: push one edited alert setting to the shared engine"""
+        alerts = self.bot.alerts
+        if setting == 'enabled':
+            if st.session_state.alert_enabled:
+                alerts.start()
+            else:
+                alerts.stop()
+        elif setting == 'threshold':
+            alerts.configure(threshold_pct=st.session_state.alert_threshold)
+        elif setting == 'webhook':
+            alerts.configure(webhook_url=st.session_state.alert_webhook.strip())
     
     def settings_tab(self):
         """Settings and configuration"""
         st.header("⚙️ Settings")
         
         st.markdown("### 🔌 Data Connections")
-        st.info("Currently using demo SQLite database. In production, you can connect to:")
-        
-        connection_types = [
-            "🗃️ SQLite Database",
-            "🐘 PostgreSQL", 
-            "🟦 MySQL",
-            "📊 Excel Files",
-            "📄 CSV Files",
-            "☁️ Google Sheets",
-            "🛒 Shopify API",
-            "📈 Google Analytics",
-            "💰 Stripe API"
-        ]
+        registry = self.bot.data_connections
+        connections = registry.connections()
+        if connections:
+            st.dataframe(registry.status_frame(), use_container_width=True, hide_index=True)
+        else:
+            st.info("Only the built-in business database is connected. Add CSV/Excel files or other SQLite databases below.")
+        
+        with st.expander("➕ Add a data source"):
+            uploaded = st.file_uploader("Upload a CSV, Excel or SQLite file:", key="connection_upload",
+                                        type=['csv', 'tsv', 'txt', 'xlsx', 'xlsm', 'db', 'sqlite', 'sqlite3'])
+            source_path = st.text_input("...or a file path on the server:", key="connection_path",
+                                        help="Large exports import faster from a path, without going through the browser")
+            source_name = st.text_input("Table name / database alias (optional):", key="connection_name")
+            if st.button("🔌 Connect", key="connection_add"):
+                try:
+                    path = registry.save_upload(uploaded.name, uploaded) if uploaded is not None else source_path.strip()
+                    if not path:
+                        st.warning("Choose a file to upload or enter a path.")
+                    else:
+                        connection = registry.add(path, source_name.strip() or None)
+                        if connection.type == 'sqlite':
+                            st.success(f"✅ Attached {len(connection.tables)} tables as {connection.name}.*")
+                        else:
+                            st.success(f"✅ Importing into table {connection.name} in the background")
+                except (ValueError, OSError, sqlite3.Error) as e:
+                    st.error(f"Could not connect: {str(e)}")
         
-        for conn_type in connection_types:
-            st.markdown(f"- {conn_type}")
+        if connections:
+            refresh_col, remove_col = st.columns(2)
+            with refresh_col:
+                if st.button("🔄 Check sources for changes"):
+                    registry.refresh(force=True)
+                    st.rerun()
+            with remove_col:
+                remove_name = st.selectbox("Connection:", [connection.name for connection in connections])
+                if st.button("🗑️ Remove connection"):
+                    registry.remove(remove_name, drop_tables=True)
+                    st.rerun()
         
         st.markdown("### 🤖 AI Configuration")
-        api_key = st.text_input("OpenAI API Key:", type="password", help="Enter your OpenAI API key for enhanced natural language processing")
+        api_key = st.text_input("OpenAI API Key:", type="password", key="openai_api_key",
+                                help="Enter your OpenAI API key for enhanced natural language processing")
         
-        if api_key:
-            st.success("✅ API key configured (would connect to real OpenAI in production)")
+        if api_key or os.environ.get('OPENAI_API_KEY'):
+            llm_client = self.bot.llm_client_for(api_key or os.environ.get('OPENAI_API_KEY'))
+            st.success(f"✅ API key configured for this session ({llm_client.name})")
+            st.caption("LLM backend")
+            st.json(llm_client.stats())
         
         st.markdown("### 📊 Export Settings")
         default_format = st.selectbox("Default Export Format:", ["CSV", "Excel", "JSON", "PDF Report"])
         
         st.markdown("### 🔔 Alert Settings") 
-        st.checkbox("Email alerts for unusual data patterns")
-        st.checkbox("Slack notifications for query results")
-        st.number_input("Alert threshold (% change):", min_value=0, max_value=100, value=20)
+        alerts = self.bot.alerts
+        # The engine is shared by every session: show its current settings, and apply
+        # only the setting this session's user just edited
+        st.session_state.alert_enabled = alerts.running
+        st.session_state.alert_threshold = int(alerts.threshold_pct)
+        st.session_state.alert_webhook = alerts.webhook_url or ""
+        st.checkbox("Scheduled alerts for unusual data patterns", key="alert_enabled",
+                    on_change=self.apply_alert_setting, args=('enabled',),
+                    help="Checks daily revenue per product, region and sales rep in the background")
+        st.number_input("Alert threshold (% change):", min_value=0, max_value=100, key="alert_threshold",
+                        on_change=self.apply_alert_setting, args=('threshold',))
+        st.text_input("Webhook URL for alerts (Slack-compatible, optional):", key="alert_webhook",
+                      on_change=self.apply_alert_setting, args=('webhook',))
+        
+        if st.button("🔎 Check for anomalies now"):
+            fired = alerts.evaluate()
+            st.info(f"{len(fired)} new alert(s)" if fired else "No unusual patterns in the new sales")
+        recent_alerts = alerts.recent_alerts()
+        if recent_alerts:
+            st.caption("Recent alerts")
+            for alert in recent_alerts:
+                st.markdown(f"- 🔔 {alert.message}")
+        
+        st.markdown("### ⚡ Performance")
+        st.caption("Connection pool utilization and wait times")
+        st.json(self.bot.pool.stats())
+        st.caption("Query result cache")
+        st.json(self.bot.result_cache.stats())
+        st.caption("Semantic question cache")
+        st.json(self.bot.semantic_cache.stats())
+        st.caption("Chart renderer")
+        st.json(self.bot.chart_renderer.stats())
+        st.caption("Data connections")
+        st.json(self.bot.data_connections.stats())
+        st.caption("Alert engine")
+        st.json(self.bot.alerts.stats())
+        st.caption("Result frame store (conversation history)")
+        st.json(self.bot.result_store.stats())
+        st.caption("Sales rollups")
+        st.json(self.bot.rollups.stats())
+        if self.bot.columnar is not None:
+            st.caption("Columnar analytics backend")
+            st.json(self.bot.columnar.stats())
+        st.caption("Query executor")
+        st.json(self.bot.executor.stats())
+        
+        stage_summary = self.bot.tracer.stage_summary()
+        if not stage_summary.empty:
+            st.caption("Pipeline stage latency (ms)")
+            st.dataframe(stage_summary, use_container_width=True)
+            metrics_col1, metrics_col2 = st.columns(2)
+            with metrics_col1:
+                st.download_button("📉 Prometheus metrics", data=self.bot.tracer.to_prometheus(),
+                                   file_name="bi_chatbot_metrics.prom", mime="text/plain")
+            with metrics_col2:
+                st.download_button("🧾 Spans (JSONL)", data=self.bot.tracer.to_jsonl(),
+                                   file_name="bi_chatbot_spans.jsonl", mime="application/x-ndjson")
+        advisor_report = self.bot.index_advisor.report()
+        if advisor_report:
+            st.caption("Query shapes and index advice")
+            st.dataframe(pd.DataFrame(advisor_report), use_container_width=True)
 
 if __name__ == "__main__":
     app = BusinessIntelligenceChatbotApp()
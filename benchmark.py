@@ -0,0 +1,430 @@
+"""
+Benchmark harness for the ML Business Intelligence Chatbot
+
+Usage:
+    python benchmark.py intents [--repeat 200] [--intents 100 500 1000] [--json out.json]
+    python benchmark.py startup [--repeat 5] [--reruns 20] [--scale 1] [--json out.json]
+    python benchmark.py pipeline [--scales 1 10 100] [--repeat 5] [--workers 1 4 8]
+                                 [--end-date YYYY-MM-DD] [--json out.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional
+
+from app import Intent, IntentEngine
+
+# Questions replayed by every benchmark; the first block mirrors the sidebar samples
+QUESTION_CORPUS = [
+    "Show me sales for last month",
+    "What's our revenue by product?",
+    "How many customers do we have this year?",
+    "Who are our top 10 customers?",
+    "Show monthly sales trends",
+    "Which products are selling best?",
+    "What's our average order value?",
+    "Show sales by region",
+    "Top 5 products by revenue this quarter",
+    "Bottom 3 sales reps by units sold last 2 quarters",
+    "How many orders did we take this week?",
+    "Count customers by region",
+    "Revenue per category over the past 3 weeks",
+    "Which region sold the most last year?",
+    "Average order value by sales rep",
+    "Monthly units sold trend for the past 6 months",
+    "Total revenue year to date",
+    "Worst performing categories",
+    "Show me some recent transactions",
+    "What is the weather like today?",
+]
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def synthetic_intents(count: int) -> List[Intent]:
+    """Distinct multi-word intents, standing in for a large template library"""
+    words = ['churn', 'margin', 'backlog', 'refund', 'pipeline', 'quota', 'inventory', 'stockout',
+             'discount', 'shipment', 'invoice', 'renewal', 'forecast', 'cohort', 'retention', 'supplier']
+    intents = []
+    for i in range(count):
+        first, second = words[i % len(words)], words[(i // len(words)) % len(words)]
+        intents.append(Intent(
+            name=f'custom_{i}',
+            keywords=[f'{first} {second} report {i}', f'{first} {second} kpi {i}'],
+            sql=f"SELECT * FROM sales LIMIT {{limit}}",
+            defaults={'limit': 10}
+        ))
+    return intents
+
+def time_engine(engine: IntentEngine, questions: List[str], repeat: int) -> Dict[str, float]:
+    engine.compile()
+    samples = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            engine.generate_sql(question)
+            samples.append((time.perf_counter() - start) * 1e6)
+    return {
+        'questions': len(questions),
+        'samples': len(samples),
+        'mean_us': round(statistics.fmean(samples), 2),
+        'p50_us': round(percentile(samples, 50), 2),
+        'p95_us': round(percentile(samples, 95), 2),
+        'p99_us': round(percentile(samples, 99), 2),
+    }
+
+def run_intents(args) -> Dict:
+    results = {'corpus': {}, 'scaling': []}
+    engine = IntentEngine()
+    for question in QUESTION_CORPUS:
+        match = engine.match(question)
+        results['corpus'][question] = {'intent': match.intent, 'sql': engine.build_sql(match)}
+
+    results['scaling'].append(dict(intents=len(engine.intents), **time_engine(engine, QUESTION_CORPUS, args.repeat)))
+    for count in args.intents:
+        engine = IntentEngine(IntentEngine.DEFAULT_INTENTS + synthetic_intents(count))
+        start = time.perf_counter()
+        engine.compile()
+        compile_ms = (time.perf_counter() - start) * 1000
+        row = dict(intents=len(engine.intents), compile_ms=round(compile_ms, 2),
+                   **time_engine(engine, QUESTION_CORPUS, args.repeat))
+        results['scaling'].append(row)
+
+    for question, match in results['corpus'].items():
+        print(f"{(match['intent'] or '-'):<10} {question}\n{'':<10} {match['sql']}")
+    print()
+    print(f"{'intents':>8} {'compile ms':>11} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}")
+    for row in results['scaling']:
+        print(f"{row['intents']:>8} {row.get('compile_ms', 0):>11} {row['mean_us']:>9} "
+              f"{row['p50_us']:>9} {row['p95_us']:>9} {row['p99_us']:>9}")
+    return results
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# Runs in a fresh interpreter so module imports are really cold
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if len(sys.argv) > 1:
+    app.BusinessDataBot(sys.argv[1])
+ready = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'boot_ms': (ready - imported) * 1000,
+                  'plotly_express_loaded': 'plotly.express' in sys.modules}))
+"""
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        'samples': len(samples),
+        'mean_ms': round(statistics.fmean(samples), 2),
+        'p50_ms': round(percentile(samples, 50), 2),
+        'p95_ms': round(percentile(samples, 95), 2),
+    }
+
+def startup_probe(env: Dict[str, str], db_path: Optional[str] = None) -> Dict:
+    command = [sys.executable, '-c', STARTUP_PROBE] + ([db_path] if db_path else [])
+    output = subprocess.run(command, env=env, cwd=os.path.dirname(APP_PATH), capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def time_reruns(db_path: str, reruns: int) -> Dict:
+    """Script runs through Streamlit's test harness: the first builds the shared bot, later ones reuse it.
+
+    The harness recompiles the script on every run while the server caches
+    the bytecode, so the compile time is measured on its own and subtracted.
+    """
+    from streamlit.runtime.scriptrunner import magic
+    from streamlit.testing.v1 import AppTest
+
+    with open(APP_PATH) as handle:
+        source = handle.read()
+    start = time.perf_counter()
+    compile(magic.add_magic(source, APP_PATH), APP_PATH, 'exec')
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    os.environ['BI_CHATBOT_DB_PATH'] = db_path
+    cwd = os.getcwd()
+    # Run beside the database so the repo's server config isn't picked up
+    os.chdir(os.path.dirname(db_path))
+    try:
+        app_test = AppTest.from_file(APP_PATH, default_timeout=300)
+        start = time.perf_counter()
+        app_test.run()
+        first_ms = (time.perf_counter() - start) * 1000
+        samples = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            app_test.run()
+            samples.append((time.perf_counter() - start) * 1000 - compile_ms)
+    finally:
+        os.chdir(cwd)
+    if app_test.exception:
+        raise RuntimeError(f"App raised during reruns: {app_test.exception[0].message}")
+    return {'first_run_ms': round(first_ms, 2), 'script_compile_ms': round(compile_ms, 2), **summarize(samples)}
+
+def run_startup(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix='bi_startup_')
+    db_path = os.path.join(workdir, 'business_data.db')
+    env = dict(os.environ, BI_CHATBOT_SEED_SCALE=str(args.scale), BI_CHATBOT_DB_PATH=db_path)
+    try:
+        imports = [startup_probe(env) for _ in range(args.repeat)]
+        first_boot = startup_probe(env, db_path)
+        warm_boots = [startup_probe(env, db_path) for _ in range(args.repeat)]
+        results = {
+            'scale': args.scale,
+            'import': summarize([probe['import_ms'] for probe in imports]),
+            'plotly_express_loaded_at_import': any(probe['plotly_express_loaded'] for probe in imports),
+            'first_boot_ms': round(first_boot['boot_ms'], 2),
+            'warm_boot': summarize([probe['boot_ms'] for probe in warm_boots]),
+            'rerun': time_reruns(db_path, args.reruns),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'stage':<22} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for label, row in (('import app', results['import']), ('boot (existing db)', results['warm_boot']),
+                       ('rerun (shared bot)', results['rerun'])):
+        print(f"{label:<22} {row['mean_ms']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9}")
+    print(f"{'first boot (new db)':<22} {results['first_boot_ms']:>9}")
+    print(f"{'first script run':<22} {results['rerun']['first_run_ms']:>9}")
+    print(f"{'script compile':<22} {results['rerun']['script_compile_ms']:>9}  (excluded from reruns)")
+    print(f"plotly.express loaded at import: {results['plotly_express_loaded_at_import']}")
+    return results
+
+PIPELINE_STAGES = ['interpret_business_query', 'execute_query', 'generate_business_insights',
+                   'create_visualization', 'question']
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def answer(bot, question: str) -> bool:
+    """One question through the same stages the chat tab runs, traced as 'question'"""
+    start = time.perf_counter()
+    with bot.tracer.trace():
+        try:
+            sql_query = bot.interpret_business_query(question)
+            result_df = bot.submit_query(sql_query).result()
+            bot.generate_business_insights(result_df, question)
+            bot.create_visualization(result_df, question)
+            error = None
+        except Exception as exc:
+            error = type(exc).__name__
+        bot.tracer.record('question', time.perf_counter() - start, ok=error is None, error=error)
+    return error is None
+
+def reset_caches(bot):
+    bot.result_cache.clear()
+    bot.semantic_cache.clear()
+    bot.chart_renderer.clear()
+
+def stage_table(tracer) -> Dict[str, Dict[str, float]]:
+    summary = tracer.stage_summary()
+    table = {}
+    for row in summary.to_dict('records'):
+        table[row['stage']] = {key: (round(value, 3) if isinstance(value, float) else value)
+                               for key, value in row.items() if key != 'stage'}
+    return table
+
+def run_scale(scale: float, options: Dict) -> Dict:
+    """Seed one database and replay the corpus; runs in its own process so memory and caches are per scale"""
+    import app
+    from streamlit import logger as streamlit_logger
+
+    # Bare-mode cache warnings would drown the report
+    streamlit_logger.set_log_level('error')
+    baseline_rss = peak_rss_mb()
+    db_path = os.path.join(options['data_dir'], f"business_data_sf{scale:g}.db")
+    start = time.perf_counter()
+    bot = app.BusinessDataBot(db_path, seed_scale_factor=scale, seed_end_date=options['end_date'])
+    boot_seconds = time.perf_counter() - start
+
+    latency = {}
+    reset_caches(bot)
+    for label, passes in (('cold', 1), ('warm', options['repeat'])):
+        bot.tracer = app.PipelineTracer()
+        errors = sum(not answer(bot, question) for _ in range(passes) for question in QUESTION_CORPUS)
+        latency[label] = {'errors': errors, 'stages': stage_table(bot.tracer)}
+
+    throughput = []
+    for workers in options['workers']:
+        # Every run starts cold; repeats within the run hit the caches as real traffic would
+        reset_caches(bot)
+        bot.tracer = app.PipelineTracer()
+        questions = QUESTION_CORPUS * options['repeat']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(lambda question: answer(bot, question), questions))
+        elapsed = time.perf_counter() - start
+        executions = bot.tracer.spans('execute_query')
+        question_stats = stage_table(bot.tracer).get('question', {})
+        throughput.append({
+            'workers': workers,
+            'questions': len(questions),
+            'seconds': round(elapsed, 3),
+            'qps': round(len(questions) / elapsed, 2),
+            'errors': outcomes.count(False),
+            'cache_hit_ratio': round(sum(bool(span.attributes.get('cache_hit')) for span in executions)
+                                     / max(1, len(executions)), 3),
+            'p50_ms': question_stats.get('p50_ms'),
+            'p95_ms': question_stats.get('p95_ms'),
+            'p99_ms': question_stats.get('p99_ms'),
+        })
+
+    return {
+        'scale': scale,
+        'sales_rows': bot.schema_catalog.row_count('sales'),
+        'boot_seconds': round(boot_seconds, 3),
+        'latency': latency,
+        'throughput': throughput,
+        'baseline_rss_mb': baseline_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def compare_results(baseline: Dict, current: Dict, threshold: float, min_delta_ms: float = 1.0) -> Dict:
+    """Relative change per scale for stage p95, throughput and peak memory; regressions beyond threshold %.
+
+    Latency changes smaller than ``min_delta_ms`` are timer noise and never count as regressions.
+    """
+    def change(old, new):
+        return round((new - old) / old * 100, 1) if old else None
+
+    rows, regressions = [], []
+    previous = {run['scale']: run for run in baseline.get('runs', [])}
+    for run in current['runs']:
+        old_run = previous.get(run['scale'])
+        if old_run is None:
+            continue
+        for phase in ('cold', 'warm'):
+            for stage in PIPELINE_STAGES:
+                old = old_run['latency'][phase]['stages'].get(stage, {}).get('p95_ms')
+                new = run['latency'][phase]['stages'].get(stage, {}).get('p95_ms')
+                if old is None or new is None:
+                    continue
+                rows.append({'scale': run['scale'], 'metric': f"{phase} {stage} p95_ms", 'baseline': old,
+                             'current': new, 'change_pct': change(old, new), 'higher_is_better': False})
+        old_throughput = {row['workers']: row for row in old_run['throughput']}
+        for row in run['throughput']:
+            if row['workers'] in old_throughput:
+                old = old_throughput[row['workers']]['qps']
+                rows.append({'scale': run['scale'], 'metric': f"qps @{row['workers']} workers", 'baseline': old,
+                             'current': row['qps'], 'change_pct': change(old, row['qps']), 'higher_is_better': True})
+        rows.append({'scale': run['scale'], 'metric': 'peak_rss_mb', 'baseline': old_run['peak_rss_mb'],
+                     'current': run['peak_rss_mb'], 'change_pct': change(old_run['peak_rss_mb'], run['peak_rss_mb']),
+                     'higher_is_better': False})
+    for row in rows:
+        pct = row['change_pct']
+        if row['metric'].endswith('_ms') and abs(row['current'] - row['baseline']) < min_delta_ms:
+            continue
+        if pct is not None and (-pct if row['higher_is_better'] else pct) > threshold:
+            regressions.append(row)
+    return {'baseline_commit': baseline.get('meta', {}).get('commit'), 'threshold_pct': threshold,
+            'rows': rows, 'regressions': regressions}
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(APP_PATH),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_pipeline(args) -> Dict:
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='bi_pipeline_')
+    os.makedirs(data_dir, exist_ok=True)
+    options = {'data_dir': data_dir, 'end_date': args.end_date, 'repeat': args.repeat, 'workers': args.workers}
+    results = {
+        'meta': {'commit': git_commit(), 'python': sys.version.split()[0], 'cpus': os.cpu_count(),
+                 'end_date': args.end_date, 'repeat': args.repeat, 'questions': len(QUESTION_CORPUS)},
+        'runs': [],
+    }
+    try:
+        for scale in args.scales:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as child:
+                results['runs'].append(child.submit(run_scale, scale, options).result())
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    for run in results['runs']:
+        print(f"\nscale {run['scale']:g}: {run['sales_rows']:,} sales rows, boot {run['boot_seconds']}s, "
+              f"peak RSS {run['peak_rss_mb']} MB (after import {run['baseline_rss_mb']} MB)")
+        print(f"  {'stage':<28} {'cold p50':>9} {'cold p95':>9} {'warm p50':>9} {'warm p95':>9} {'warm p99':>9}")
+        for stage in PIPELINE_STAGES:
+            cold = run['latency']['cold']['stages'].get(stage, {})
+            warm = run['latency']['warm']['stages'].get(stage, {})
+            print(f"  {stage:<28} {cold.get('p50_ms', '-'):>9} {cold.get('p95_ms', '-'):>9} "
+                  f"{warm.get('p50_ms', '-'):>9} {warm.get('p95_ms', '-'):>9} {warm.get('p99_ms', '-'):>9}")
+        print(f"  {'workers':>9} {'qps':>9} {'p95 ms':>9} {'hit ratio':>9} {'errors':>7}")
+        for row in run['throughput']:
+            print(f"  {row['workers']:>9} {row['qps']:>9} {row['p95_ms']:>9} {row['cache_hit_ratio']:>9} {row['errors']:>7}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            comparison = compare_results(json.load(handle), results, args.threshold)
+        results['comparison'] = comparison
+        print(f"\nCompared with {args.compare} (commit {comparison['baseline_commit']}):")
+        for row in comparison['rows']:
+            flag = '  REGRESSION' if row in comparison['regressions'] else ''
+            print(f"  sf {row['scale']:<6g} {row['metric']:<48} {row['baseline']:>10} -> {row['current']:>10} "
+                  f"({row['change_pct']:+}%){flag}" if row['change_pct'] is not None else
+                  f"  sf {row['scale']:<6g} {row['metric']:<48} {row['baseline']:>10} -> {row['current']:>10}")
+    return results
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the BI chatbot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    intents = subparsers.add_parser('intents', help="Question -> SQL matching latency")
+    intents.add_argument('--repeat', type=int, default=200, help="Passes over the question corpus")
+    intents.add_argument('--intents', type=int, nargs='*', default=[100, 500, 1000],
+                         help="Synthetic intent library sizes to time")
+    intents.add_argument('--json', help="Write results to this JSON file")
+    intents.set_defaults(handler=run_intents)
+
+    startup = subparsers.add_parser('startup', help="Cold import/boot and per-rerun latency")
+    startup.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per cold measurement")
+    startup.add_argument('--reruns', type=int, default=20, help="Script reruns to time after the first")
+    startup.add_argument('--scale', type=float, default=1.0, help="Seed scale factor for the demo database")
+    startup.add_argument('--json', help="Write results to this JSON file")
+    startup.set_defaults(handler=run_startup)
+
+    pipeline = subparsers.add_parser('pipeline', help="End-to-end question latency, throughput and memory")
+    pipeline.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100],
+                          help="Seed scale factors (1.0 = 1,000 sales rows)")
+    pipeline.add_argument('--repeat', type=int, default=5, help="Passes over the question corpus")
+    pipeline.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8],
+                          help="Concurrent worker counts for the throughput runs")
+    pipeline.add_argument('--end-date', default=date.today().isoformat(),
+                          help="Last day of seeded sales; pin it to compare runs from different days")
+    pipeline.add_argument('--data-dir', help="Keep seeded databases here and reuse them (default: a temp dir)")
+    pipeline.add_argument('--json', help="Write results to this JSON file")
+    pipeline.add_argument('--compare', help="Baseline JSON from an earlier run to diff against")
+    pipeline.add_argument('--threshold', type=float, default=10.0,
+                          help="Percent change counted as a regression by --compare")
+    pipeline.set_defaults(handler=run_pipeline)
+
+    args = parser.parse_args(argv)
+    results = args.handler(args)
+    if getattr(args, 'json', None):
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    # Non-zero exit lets CI fail on a --compare regression
+    return 1 if results.get('comparison', {}).get('regressions') else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
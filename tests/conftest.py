@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def bot(tmp_path_factory):
+    """A demo database with 5,000 seeded sales rows"""
+    db_path = str(tmp_path_factory.mktemp('db') / 'business_data.db')
+    return app.BusinessDataBot(db_path, seed_scale_factor=5)
+
+
+@pytest.fixture(scope='session')
+def read_sql(bot):
+    """Run SQL straight on SQLite, bypassing the cache, rollups and executor"""
+    def run(sql_query: str) -> pd.DataFrame:
+        with bot.pool.reader() as conn:
+            return pd.read_sql_query(sql_query, conn)
+    return run
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+pytest.importorskip('plotly')
+
+
+def daily_series(days: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'date': pd.date_range('2020-01-01', periods=days, freq='D').strftime('%Y-%m-%d'),
+                         'revenue': rng.normal(1000.0, 50.0, days)})
+
+
+def test_lttb_keeps_endpoints_and_extremes():
+    x = np.arange(10000, dtype=np.float64)
+    y = np.sin(x / 500.0)
+    y[4321] = 50.0
+    indices = app.ChartRenderer.lttb_indices(x, y, 500)
+    assert len(indices) == 500
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert 4321 in indices
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_long_series_is_downsampled_and_cached():
+    renderer = app.ChartRenderer(max_points=500)
+    df = daily_series(5000, seed=1)
+    fig, cached = renderer.render(df)
+    assert not cached
+    assert len(fig.data[0].x) <= 500
+    _, cached = renderer.render(df.copy())
+    assert cached
+    assert renderer.stats()['downsampled'] == 1
+
+
+def test_many_categories_are_bucketed():
+    renderer = app.ChartRenderer(max_categories=10)
+    df = pd.DataFrame({'customer_name': [f"Customer {i}" for i in range(50)], 'revenue': np.arange(50.0)})
+    fig, _ = renderer.render(df)
+    assert len(fig.data[0].x) <= 11
+    assert sum(fig.data[0].y) == pytest.approx(df['revenue'].sum())
+    assert renderer.stats()['bucketed'] == 1
+
+
+def test_counters_are_exact_under_concurrent_renders():
+    renderer = app.ChartRenderer(max_points=200, webgl_threshold=100)
+    frames = [daily_series(2000, seed) for seed in range(32)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(renderer.render, frames))
+    stats = renderer.stats()
+    assert stats['misses'] == 32
+    assert stats['downsampled'] == 32
+    assert stats['webgl'] == 32
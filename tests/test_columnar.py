@@ -0,0 +1,88 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+AGGREGATE_QUESTIONS = [
+    "show sales by region",
+    "monthly sales trends",
+    "top 5 products this quarter",
+    "sales this quarter",
+    "revenue by category this year",
+    "sales by region this month",
+    "revenue by product last 30 days",
+    "average order value by region",
+    "how many orders by category",
+    "who are our top 10 customers?",
+]
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    bot = app.BusinessDataBot(str(tmp_path / 'business_data.db'), seed_scale_factor=2)
+    return app.ColumnarStore(bot.pool, str(tmp_path / 'columnar')).table('sales')
+
+
+def mirrored_amount(mirror) -> float:
+    _, arrays, _ = mirror.snapshot()
+    return float(np.nansum(arrays['amount']))
+
+
+def source_amount(mirror) -> float:
+    with mirror.pool.reader() as conn:
+        return conn.execute("SELECT TOTAL(amount) FROM sales").fetchone()[0]
+
+
+@pytest.mark.parametrize('question', AGGREGATE_QUESTIONS)
+def test_matches_raw_sql(bot, read_sql, tmp_path, question):
+    store = app.ColumnarStore(bot.pool, str(tmp_path / 'columnar'))
+    sql_query = app.get_intent_engine().generate_sql(question)
+    aggregate = app.AggregateQuery.parse(sql_query)
+    assert aggregate is not None, sql_query
+    result_df = store.execute(aggregate)
+    assert result_df is not None, sql_query
+    # Column files sum in a different order than a raw scan
+    pd.testing.assert_frame_equal(result_df.reset_index(drop=True), read_sql(sql_query),
+                                  check_dtype=False, rtol=1e-9)
+
+
+def test_sync_appends_new_rows(mirror):
+    assert mirror.sync() == 0
+    with mirror.pool.writer() as conn:
+        conn.execute("INSERT INTO sales (date, product_name, amount, quantity, region) "
+                     "VALUES ('2026-10-01', 'Brand New Gadget', 100.0, 1, 'North')")
+    assert mirror.sync() == 1
+    assert 'Brand New Gadget' in mirror.dictionaries['product_name']
+    assert mirrored_amount(mirror) == pytest.approx(source_amount(mirror))
+
+
+def test_external_change_elsewhere_does_not_remirror(mirror):
+    mirror.pool.note_external_change()
+    assert mirror.sync() == 0
+
+    other = sqlite3.connect(mirror.pool.db_path)
+    other.execute("CREATE TABLE IF NOT EXISTS notes (body TEXT)")
+    other.execute("INSERT INTO notes VALUES ('unrelated')")
+    other.commit()
+    other.close()
+    assert mirror.sync() == 0
+
+
+@pytest.mark.parametrize('statement', [
+    "UPDATE sales SET amount = amount + 1 WHERE id <= 10",
+    "UPDATE sales SET region = 'Antarctica' WHERE id = 3",
+    "DELETE FROM sales WHERE id = 5",
+])
+def test_other_process_change_in_place_remirrors(mirror, statement):
+    mirror.sync()
+    other = sqlite3.connect(mirror.pool.db_path)
+    other.execute(statement)
+    other.commit()
+    other.close()
+    with mirror.pool.reader() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+    assert mirror.sync() == rows
+    assert mirrored_amount(mirror) == pytest.approx(source_amount(mirror))
@@ -0,0 +1,29 @@
+import pandas as pd
+
+import app
+
+
+def test_refinement_chain_keeps_limit_and_matches_sql(bot, read_sql):
+    history = app.ConversationHistory(bot.result_store)
+    context = app.ConversationContext(history, bot.schema_catalog, app.get_intent_engine())
+
+    question = "revenue by product"
+    sql_query = bot.interpret_business_query(question)
+    result_df = bot.execute_query(sql_query)
+    context.remember(sql_query, history.add(question, sql_query, result_df, ''))
+
+    for question in ["just the top 3", "now only the North region"]:
+        followup = context.refine(question)
+        assert followup is not None, question
+        from_sql = read_sql(followup.sql)
+        if followup.frame is not None:
+            # The frame is derived in memory and may sum in a different order
+            pd.testing.assert_frame_equal(followup.frame.reset_index(drop=True), from_sql,
+                                          check_dtype=False, rtol=1e-9)
+        assert len(from_sql) == 3, followup.sql
+        context.remember(followup.sql, history.add(question, followup.sql, from_sql, ''), followup)
+
+    assert '"region" IN (\'North\')' in followup.sql
+    north = read_sql("SELECT product_name, SUM(amount) AS revenue FROM sales WHERE region = 'North' "
+                     "GROUP BY product_name ORDER BY revenue DESC LIMIT 3")
+    assert from_sql['product_name'].tolist() == north['product_name'].tolist()
@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def registry(tmp_path):
+    pool = app.SQLiteConnectionPool(str(tmp_path / 'business_data.db'))
+    return app.DataConnectionRegistry(pool, str(tmp_path / 'connections'))
+
+
+def wait_for_imports(registry, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while registry._pending and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert not registry._pending
+
+
+def test_failed_import_is_retried_only_after_the_file_changes(registry, tmp_path):
+    path = tmp_path / 'orders.csv'
+    path.write_text('region,amount\n"North,10\n')
+    connection = registry.add(str(path))
+    wait_for_imports(registry)
+    assert connection.status == 'error'
+
+    # Polling an unchanged bad file must not import it again
+    for _ in range(3):
+        registry.refresh()
+        assert connection.status == 'error'
+        assert connection.name not in registry._pending
+
+    path.write_text('region,amount\nNorth,10\nSouth,20\n')
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    registry.refresh()
+    wait_for_imports(registry)
+    assert connection.status == 'ready'
+    assert connection.rows == 2
+    assert 'failed_on' not in connection.state
+
+
+def test_force_retries_a_failed_import(registry, tmp_path, monkeypatch):
+    attempts = []
+    import_csv = registry._import_csv
+    monkeypatch.setattr(registry, '_import_csv', lambda *args: (attempts.append(args), import_csv(*args)))
+    path = tmp_path / 'empty.csv'
+    path.write_text('region,amount\n')
+    connection = registry.add(str(path))
+    wait_for_imports(registry)
+    registry.refresh()
+    wait_for_imports(registry)
+    assert connection.status == 'error' and len(attempts) == 1
+
+    registry.refresh(force=True)
+    wait_for_imports(registry)
+    assert connection.status == 'error' and len(attempts) == 2
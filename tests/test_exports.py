@@ -0,0 +1,43 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import app
+
+SQL = "SELECT id, date, product_name, amount FROM sales ORDER BY id"
+
+
+def test_export_query_matches_the_query(bot, read_sql):
+    exported = pd.read_csv(io.BytesIO(bot.export_query(SQL, 'csv')))
+    pd.testing.assert_frame_equal(exported, read_sql(SQL), check_dtype=False)
+
+
+def test_export_query_batches_match_in_memory_export(bot, read_sql):
+    exporter = app.StreamingExporter(bot.pool, batch_rows=700)
+    with exporter.export_query(SQL, 'csv') as spool:
+        streamed = spool.read()
+    assert streamed == exporter.export_dataframe(read_sql(SQL), 'csv')
+
+
+def test_export_query_json_is_one_array(bot, read_sql):
+    exporter = app.StreamingExporter(bot.pool, batch_rows=700)
+    with exporter.export_query(SQL, 'json') as spool:
+        rows = json.load(spool)
+    assert len(rows) == len(read_sql(SQL))
+    assert rows[0]['id'] == 1
+
+
+@pytest.mark.parametrize('format_type', ['ndjson', 'excel'])
+def test_export_dataframe_round_trips(bot, read_sql, format_type):
+    if format_type not in app.StreamingExporter.available_formats():
+        pytest.skip(f"{format_type} support is not installed")
+    df = read_sql(SQL + " LIMIT 250")
+    data = bot.export_results(df, format_type)
+    if format_type == 'ndjson':
+        restored = pd.read_json(io.BytesIO(data), lines=True)
+    else:
+        restored = pd.read_excel(io.BytesIO(data))
+    assert len(restored) == 250
+    assert restored['amount'].sum() == pytest.approx(df['amount'].sum())
@@ -0,0 +1,51 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def test_std_and_outliers_for_large_magnitudes():
+    values = 1e12 + np.arange(100, dtype=np.float64)
+    values[-1] += 1000.0
+    stats = app.InsightEngine().compute(pd.DataFrame({'revenue': values})).columns[0]
+    assert stats.std == pytest.approx(np.std(values), rel=1e-9)
+    assert stats.outliers == 1
+
+
+def test_sql_pushdown_matches_in_memory(bot, read_sql):
+    with bot.pool.writer() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS big_values (label TEXT, revenue REAL, quantity INTEGER)")
+        conn.execute("DELETE FROM big_values")
+        conn.executemany("INSERT INTO big_values VALUES (?, ?, ?)",
+                         [(f"k{i}", 1e12 + i + (5000.0 if i == 7 else 0.0), i % 5) for i in range(2000)])
+
+    engine = bot.insight_engine
+    for sql_query in ["SELECT region, SUM(amount) AS revenue FROM sales GROUP BY region",
+                      "SELECT id, amount, quantity FROM sales",
+                      "SELECT label, revenue, quantity FROM big_values"]:
+        result_df = read_sql(sql_query)
+        in_memory, pushed = engine.compute(result_df), engine.compute_sql(sql_query)
+        assert pushed.rows == in_memory.rows
+        for expected, actual in zip(in_memory.columns, pushed.columns):
+            assert actual.name == expected.name
+            assert actual.std == pytest.approx(np.std(result_df[actual.name]), rel=1e-6)
+            assert actual.total == pytest.approx(expected.total, rel=1e-9)
+            assert actual.std == pytest.approx(expected.std, rel=1e-6, abs=1e-9)
+            assert actual.outliers == expected.outliers
+        assert engine.summarize_query(sql_query) == engine.render(pushed)
+
+
+def test_labels_the_period_in_progress():
+    engine = app.InsightEngine(today=lambda: date(2026, 10, 17))
+    open_month = engine.summarize(pd.DataFrame({'month': ['2026-08', '2026-09', '2026-10'],
+                                                'monthly_sales': [100.0, 120.0, 40.0]}))
+    assert "2026-08 → 2026-09: +20.0%" in open_month
+    assert "2026-10 is still in progress" in open_month
+
+    closed_month = engine.summarize(pd.DataFrame({'month': ['2026-07', '2026-08', '2026-09'],
+                                                  'monthly_sales': [100.0, 120.0, 40.0]}))
+    assert "2026-08 → 2026-09: -66.7%" in closed_month
+    assert "in progress" not in closed_month
@@ -0,0 +1,54 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import app
+
+
+def period_start(question: str, today: date) -> date:
+    """Evaluate the date cutoff generated for a question as if it were ``today``"""
+    sql_query = app.get_intent_engine().generate_sql(question)
+    aggregate = app.AggregateQuery.parse(sql_query)
+    assert aggregate is not None and aggregate.date_from, sql_query
+    expression = aggregate.date_from.replace("'now'", f"'{today.isoformat()}'")
+    conn = sqlite3.connect(':memory:')
+    try:
+        return date.fromisoformat(conn.execute(f"SELECT {expression}").fetchone()[0])
+    finally:
+        conn.close()
+
+
+DAYS = [date(2026, 10, 11) + timedelta(days=offset) for offset in range(14)]
+
+
+@pytest.mark.parametrize('today', DAYS, ids=lambda day: day.strftime('%a-%d'))
+def test_this_week_starts_on_the_latest_sunday(today):
+    start = period_start("sales this week", today)
+    assert start.isoweekday() == 7
+    assert today - timedelta(days=6) <= start <= today
+
+
+def test_this_week_on_a_sunday_is_just_today():
+    assert period_start("sales this week", date(2026, 10, 18)) == date(2026, 10, 18)
+
+
+@pytest.mark.parametrize('today, expected', [
+    (date(2026, 1, 1), date(2026, 1, 1)),
+    (date(2026, 3, 31), date(2026, 1, 1)),
+    (date(2026, 5, 15), date(2026, 4, 1)),
+    (date(2026, 9, 30), date(2026, 7, 1)),
+    (date(2026, 10, 17), date(2026, 10, 1)),
+    (date(2026, 12, 31), date(2026, 10, 1)),
+])
+def test_this_quarter_starts_on_the_quarter(today, expected):
+    assert period_start("sales this quarter", today) == expected
+
+
+@pytest.mark.parametrize('question, expected', [
+    ("sales this month", date(2026, 10, 1)),
+    ("sales this year", date(2026, 1, 1)),
+    ("sales yesterday", date(2026, 10, 16)),
+])
+def test_other_anchored_periods(question, expected):
+    assert period_start(question, date(2026, 10, 17)) == expected
@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+import app
+
+pytest.importorskip('httpx')
+
+SCHEMA = {'sales': ['id', 'date', 'product_name', 'amount', 'region']}
+
+
+@pytest.fixture
+def server():
+    with app.LocalLLMStubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def make_client(server):
+    clients = []
+
+    def make(**options):
+        options.setdefault('max_retries', 1)
+        client = app.OpenAIChatClient('test-key', base_url=server.base_url, **options)
+        clients.append(client)
+        return client
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_sql_comes_from_the_endpoint(server, make_client):
+    client = make_client()
+    sql_query = client.generate_sql_query("show sales by region", SCHEMA)
+    assert sql_query == app.MockOpenAI().generate_sql_query("show sales by region", SCHEMA)
+    assert server.requests == 1
+    assert client.stats()['prompt_tokens'] > 0
+
+
+def test_concurrent_identical_prompts_make_one_request(server, make_client):
+    server.latency = 0.3
+    client = make_client()
+    results = client.generate_sql_batch(["show sales by region"] * 5 + ["monthly sales trends"], SCHEMA)
+    assert len(set(results[:5])) == 1
+    assert server.requests == 2
+    assert client.stats()['coalesced'] == 4
+
+
+def test_identical_prompts_from_several_threads_share_a_request(server, make_client):
+    server.latency = 0.3
+    client = make_client()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate_sql_query("top 5 products", SCHEMA)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4 and len(set(results)) == 1
+    assert server.requests == 1
+
+
+def test_prompt_cache_survives_a_restart(server, make_client, tmp_path):
+    cache_path = str(tmp_path / 'prompt_cache.db')
+    first = make_client(prompt_cache=app.PromptCache(cache_path))
+    answer = first.generate_sql_query("show sales by region", SCHEMA)
+    first.close()
+
+    restarted = make_client(prompt_cache=app.PromptCache(cache_path))
+    assert restarted.generate_sql_query("show sales by region", SCHEMA) == answer
+    assert server.requests == 1
+    assert restarted.stats()['cache_hits'] == 1
+
+    # A different schema is a different prompt
+    restarted.generate_sql_query("show sales by region", {'sales': ['id', 'amount']})
+    assert server.requests == 2
+
+
+def test_rate_limit_is_retried(server, make_client):
+    client = make_client()
+    server.queue_response(429, b'{"error": "slow down"}')
+    assert client.generate_sql_query("show sales by region", SCHEMA).startswith("SELECT")
+    assert server.requests == 2
+    assert client.stats()['retries'] == 1
+
+
+def test_bursts_up_to_max_concurrency_without_waiting(make_client):
+    client = make_client(requests_per_minute=60, max_concurrency=4)
+    client.generate_sql_query("show sales by region", SCHEMA)
+    client.generate_insights(app.pd.DataFrame({'region': ['North'], 'revenue': [1.0]}), "show sales by region")
+    assert client.stats()['rate_limit_wait_seconds'] == 0.0
+
+
+@pytest.mark.parametrize('status, body', [
+    (429, b'{"error": "rate limited"}'),
+    (401, b'{"error": "bad key"}'),
+    (200, b'{"choices": [{"message": {"content": "SELECT'),
+    (200, b'<html>gateway</html>'),
+    (200, b'{"choices": []}'),
+])
+def test_bot_falls_back_to_the_intent_engine(bot, server, make_client, status, body):
+    client = make_client()
+    server.queue_response(status, body, times=2)
+    question = f"show sales by region ({status} {len(body)})"
+    with pytest.raises(app.LLMError):
+        client.generate_sql_query(question, SCHEMA)
+
+    server.queue_response(status, body, times=2)
+    assert bot.interpret_business_query(question, llm_client=client) == \
+        app.MockOpenAI().generate_sql_query(question, SCHEMA)
+    assert client.stats()['errors'] == 2
+
+
+def test_insights_fall_back_to_builtin(bot, server, make_client):
+    client = make_client()
+    server.queue_response(503, times=2)
+    result_df = app.pd.DataFrame({'region': ['North', 'South'], 'revenue': [10.0, 30.0]})
+    assert bot.generate_business_insights(result_df, "sales by region", llm_client=client) == \
+        app.MockOpenAI().generate_insights(result_df, "sales by region")
@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+import app
+
+SLOW = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 100000000) SELECT COUNT(*) FROM n"
+
+
+@pytest.fixture
+def executor(bot):
+    executor = app.QueryExecutor(bot.pool, max_workers=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_result_and_outcome(executor):
+    handle = executor.submit("SELECT COUNT(*) AS n FROM sales")
+    assert handle.result(timeout=10)['n'].iat[0] == 5000
+    assert handle.outcome == 'completed'
+    assert executor.counters['completed'] == 1
+
+
+def test_cancel_counts_queued_and_running_queries_once(executor):
+    running, queued = executor.submit(SLOW), executor.submit(SLOW)
+    while running.elapsed < 0.2:
+        time.sleep(0.05)
+
+    assert executor.cancel(queued.id)
+    assert executor.cancel(running.id)
+    with pytest.raises(app.QueryCancelledError):
+        running.result(timeout=10)
+    with pytest.raises(CancelledError):
+        queued.result(timeout=10)
+    assert executor.counters['cancelled'] == 2
+    assert running.outcome == queued.outcome == 'cancelled'
+    assert not executor.cancel(running.id)
+
+
+def test_cancel_right_after_submit(executor):
+    blocker = executor.submit(SLOW, timeout=0.5)
+    handles = [executor.submit("SELECT 1") for _ in range(20)]
+    for handle in handles:
+        executor.cancel(handle.id)
+    with pytest.raises(app.QueryTimeoutError):
+        blocker.result(timeout=10)
+    for handle in handles:
+        with pytest.raises((CancelledError, app.QueryCancelledError)):
+            handle.result(timeout=10)
+    assert executor.counters['cancelled'] == 20
+
+
+def test_queue_wait_is_not_charged_to_the_time_budget(executor):
+    blocker = executor.submit(SLOW, timeout=0.5)
+    # Short, but long enough for the progress handler to check its deadline
+    queued = executor.submit(SLOW.replace('100000000', '200000'), timeout=0.3)
+    with pytest.raises(app.QueryTimeoutError):
+        blocker.result(timeout=10)
+    assert queued.result(timeout=10).iat[0, 0] == 200000
+    assert queued.elapsed > 0.3
+
+
+def test_row_limit_rejects_before_building_a_frame(executor):
+    handle = executor.submit("SELECT * FROM sales", max_rows=100)
+    with pytest.raises(app.QueryLimitExceededError):
+        handle.result(timeout=10)
+    assert handle.outcome == 'rejected'
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import app
+
+AGGREGATE_QUESTIONS = [
+    "show sales by region",
+    "monthly sales trends",
+    "top 5 products this quarter",
+    "sales this quarter",
+    "revenue by category this year",
+    "sales by region this month",
+    "revenue by product last 30 days",
+    "average order value by region",
+    "how many orders by category",
+    "who are our top 10 customers?",
+]
+
+
+@pytest.fixture
+def rollups(tmp_path):
+    bot = app.BusinessDataBot(str(tmp_path / 'business_data.db'), seed_scale_factor=2)
+    return bot.rollups
+
+
+def rollup_matches_sales(rollups) -> bool:
+    with rollups.pool.reader() as conn:
+        expected = conn.execute("SELECT TOTAL(amount) FROM sales").fetchone()[0]
+        actual = conn.execute(
+            "SELECT TOTAL(revenue) FROM sales_rollup WHERE grain = 'day' AND dimension = 'all'").fetchone()[0]
+    return abs(expected - actual) < 1e-6
+
+
+@pytest.mark.parametrize('question', AGGREGATE_QUESTIONS)
+def test_route_matches_raw_sql(bot, read_sql, question):
+    sql_query = app.get_intent_engine().generate_sql(question)
+    routed = bot.rollups.route(sql_query)
+    assert routed is not None, sql_query
+    # The rollup sums in a different order than a raw scan
+    pd.testing.assert_frame_equal(read_sql(routed), read_sql(sql_query), check_dtype=False, rtol=1e-9)
+
+
+def test_refresh_folds_only_new_rows(rollups):
+    assert rollups.refresh() == 0
+    with rollups.pool.writer() as conn:
+        conn.execute("INSERT INTO sales (date, product_name, amount, quantity, region) "
+                     "VALUES ('2026-10-01', 'Laptop Pro', 100.0, 1, 'North')")
+    assert rollups.refresh() == 1
+    assert rollup_matches_sales(rollups)
+
+
+def test_external_change_elsewhere_does_not_rebuild(rollups, tmp_path):
+    assert rollups.refresh() == 0
+    rollups.pool.note_external_change()
+    assert rollups.refresh() == 0
+
+    # Another process writing some other table moves the epoch too
+    other = sqlite3.connect(rollups.pool.db_path)
+    other.execute("CREATE TABLE IF NOT EXISTS notes (body TEXT)")
+    other.execute("INSERT INTO notes VALUES ('unrelated')")
+    other.commit()
+    other.close()
+    assert rollups.refresh() == 0
+
+
+@pytest.mark.parametrize('statement', [
+    "UPDATE sales SET amount = amount + 1 WHERE id <= 10",
+    "UPDATE sales SET region = 'Antarctica' WHERE id = 3",
+    "UPDATE sales SET date = date(date, '-1 day') WHERE id = 4",
+    "DELETE FROM sales WHERE id = 5",
+])
+def test_other_process_change_in_place_rebuilds(rollups, statement):
+    rollups.refresh()
+    other = sqlite3.connect(rollups.pool.db_path)
+    other.execute(statement)
+    other.commit()
+    other.close()
+    assert rollups.refresh() > 0
+    assert rollup_matches_sales(rollups)
+    sql_query = app.get_intent_engine().generate_sql("show sales by region")
+    with rollups.pool.reader() as conn:
+        routed = pd.read_sql_query(rollups.route(sql_query), conn)
+        raw = pd.read_sql_query(sql_query, conn)
+    pd.testing.assert_frame_equal(routed, raw, check_dtype=False, rtol=1e-9)
@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+import app
+
+
+def seeded_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT date, customer_id, product_name, amount, quantity, sales_rep, region "
+                            "FROM sales ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_interrupted_seed_resumes_to_the_same_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.BusinessDataBot, 'SEED_BLOCK_ROWS', 1000)
+    options = dict(seed_scale_factor=3, seed_end_date='2026-10-01')
+    clean_path = str(tmp_path / 'clean.db')
+    app.BusinessDataBot(clean_path, **options)
+
+    real_rng, calls = app.np.random.default_rng, []
+
+    def crash_on_third_block(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt("simulated crash")
+        return real_rng(*args, **kwargs)
+
+    resumed_path = str(tmp_path / 'resumed.db')
+    with monkeypatch.context() as patch:
+        patch.setattr(app.np.random, 'default_rng', crash_on_third_block)
+        with pytest.raises(KeyboardInterrupt):
+            app.BusinessDataBot(resumed_path, **options)
+    assert 0 < len(seeded_rows(resumed_path)) < 3000
+
+    app.BusinessDataBot(resumed_path, **options)
+    assert seeded_rows(resumed_path) == seeded_rows(clean_path)
@@ -0,0 +1,56 @@
+import json
+
+import app
+
+
+def make_cache(index_path=None, **options):
+    return app.SemanticQueryCache(index_path, app.get_intent_engine(), **options)
+
+
+def test_rephrased_question_hits_for_the_builtin_engine():
+    cache = make_cache()
+    cache.store("show sales by region", "SELECT 'by region'", 'fp', 'mock')
+    assert cache.lookup("show me our sales by region", 'fp', 'mock') == "SELECT 'by region'"
+    assert cache.lookup("show sales by category", 'fp', 'mock') is None
+
+
+def test_rejects_other_names_for_llm_scopes():
+    cache = make_cache()
+    cache.store("list all orders placed by customer Acme Corp",
+                "SELECT * FROM sales WHERE customer_name = 'Acme Corp'", 'fp', 'openai:gpt-4o-mini')
+
+    assert cache.lookup("list all orders placed by customer Acme Inc", 'fp', 'openai:gpt-4o-mini') is None
+    assert cache.lookup("List all orders placed by customer Acme Corp!", 'fp', 'openai:gpt-4o-mini') is not None
+    assert cache.stats()['rejected_by_slots'] >= 1
+
+
+def test_rechecks_signature_of_exact_hits():
+    cache = make_cache()
+    question = "top 5 products this quarter"
+    cache.store(question, "SELECT 'stale'", 'fp', 'mock')
+    # As if persisted by an engine that resolved the period differently
+    for entry in cache._entries.values():
+        entry['signature'] = 'stale'
+
+    assert cache.lookup(question, 'fp', 'mock') is None
+    assert cache.stats()['rejected_by_slots'] == 1
+    cache.store(question, "SELECT 'fresh'", 'fp', 'mock')
+    assert cache.lookup(question, 'fp', 'mock') == "SELECT 'fresh'"
+
+
+def test_saves_are_batched_and_flushed(tmp_path):
+    index_path = str(tmp_path / 'semantic_cache.json')
+    cache = make_cache(index_path, save_interval=3600)
+    questions = ["show sales by region", "monthly sales trends", "top 5 products this quarter"]
+    for question in questions:
+        cache.store(question, f"SELECT '{question}'", 'fp', 'mock')
+
+    with open(index_path) as handle:
+        assert len(json.load(handle)) == 1
+    assert cache.stats()['unsaved']
+
+    cache.flush()
+    assert not cache.stats()['unsaved']
+    reloaded = make_cache(index_path)
+    assert [reloaded.lookup(question, 'fp', 'mock') for question in questions] == \
+        [f"SELECT '{question}'" for question in questions]
@@ -0,0 +1,66 @@
+from dataclasses import replace
+
+import pandas as pd
+import pytest
+
+import app
+
+
+def page_through(browser, table_name, page_size=50, filters=None):
+    pages, after = [], None
+    while True:
+        page, after, has_more = browser.fetch_page(table_name, None, filters, page_size, after)
+        pages.append(page)
+        if not has_more:
+            return pd.concat(pages, ignore_index=True), len(pages)
+
+
+@pytest.fixture(scope='module')
+def browser(bot):
+    with bot.pool.writer() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS keyless (label TEXT, value INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS rowidless (code TEXT PRIMARY KEY, value INTEGER) WITHOUT ROWID")
+        conn.execute("DELETE FROM keyless")
+        conn.executemany("INSERT INTO keyless VALUES (?, ?)", [(str(i % 7), i) for i in range(130)])
+        conn.executemany("INSERT OR IGNORE INTO rowidless VALUES (?, ?)", [(f"c{i:03d}", i) for i in range(130)])
+    return bot.table_browser
+
+
+def test_pages_every_catalog_table(bot, browser, read_sql):
+    tables = bot.schema_catalog.tables
+    assert {'sales', 'sales_rollup', 'keyless', 'rowidless'} <= set(tables)
+    for name in tables:
+        paged, _ = page_through(browser, name)
+        expected = read_sql(f"SELECT COUNT(*) AS n FROM {app.quote_identifier(name)}")['n'].iat[0]
+        assert len(paged) == expected, name
+        assert not paged.duplicated().any(), name
+
+
+def test_page_keys(bot, browser):
+    tables = bot.schema_catalog.tables
+    assert browser.page_key(tables['sales']) == ['rowid']
+    assert browser.page_key(tables['rowidless']) == ['"code"']
+    assert browser.page_key(tables['keyless']) == ['rowid']
+    assert browser.page_key(tables['sales_rollup']) == ['"grain"', '"dimension"', '"key"', '"bucket"']
+
+
+def test_filtered_pages(browser, read_sql):
+    paged, pages = page_through(browser, 'sales', page_size=100, filters=[('region', '=', 'North')])
+    expected = read_sql("SELECT id FROM sales WHERE region = 'North' ORDER BY id")
+    assert paged['id'].tolist() == expected['id'].tolist()
+    assert pages == -(-len(expected) // 100)
+
+
+def test_internal_tables_are_hidden_from_users(bot):
+    user_tables = set(bot.schema_catalog.user_tables)
+    assert 'sales' in user_tables
+    assert not user_tables & {'sales_rollup', 'rollup_state', 'demo_seed'}
+
+
+def test_offset_fallback_without_a_key(bot, browser, monkeypatch):
+    keyless = replace(bot.schema_catalog.tables['keyless'], has_rowid=False, key_columns=[])
+    monkeypatch.setattr(browser, '_table', lambda name: keyless)
+    assert browser.page_key(keyless) == []
+    paged, pages = page_through(browser, 'keyless', page_size=50)
+    assert sorted(paged['value']) == list(range(130))
+    assert pages == 3